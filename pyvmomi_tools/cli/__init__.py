@@ -14,3 +14,4 @@
 
 from pyvmomi_tools.cli import args
 from pyvmomi_tools.cli import cursor
+from pyvmomi_tools.cli import session
@@ -17,6 +17,8 @@ __author__ = "VMware, Inc."
 import argparse
 import getpass
 
+from pyvmomi_tools.cli import session
+
 
 def add_connection_arguments(parser):
     parser.add_argument('-s', '--host',
@@ -39,12 +41,37 @@ def add_connection_arguments(parser):
                         action='store',
                         help="port to use, default 443", default=443)
 
+    parser.add_argument('--session-cache',
+                        required=False,
+                        action='store_true',
+                        help='Reuse the vSphere session between runs')
+
+    parser.add_argument('--session-cache-dir',
+                        required=False,
+                        action='store',
+                        help='Where cached sessions are kept, default %s' %
+                             session.DEFAULT_CACHE_DIR,
+                        default=session.DEFAULT_CACHE_DIR)
+
+    parser.add_argument('--max-read-rate',
+                        required=False,
+                        type=float,
+                        help='Most read calls per second, default no limit')
+
+    parser.add_argument('--max-task-rate',
+                        required=False,
+                        type=float,
+                        help='Most task creating calls per second, '
+                             'default no limit')
+
     return parser
 
 
 def prompt_for_password(parser):
     args = parser.parse_args()
-    if args.password is None:
+    # with a session cache the password is only asked for if a login is
+    # actually needed, see session.connect
+    if args.password is None and not args.session_cache:
         args.password = getpass.getpass(
             prompt='Enter password for host %s and user %s: ' %
                    (args.host, args.user))
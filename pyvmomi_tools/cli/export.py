@@ -0,0 +1,81 @@
+# Copyright (c) 2014 VMware, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+The 'export' command: stream inventory properties to a JSONL or CSV file.
+
+code::
+    pyvmomi-tools export -s vcenter -u admin vms.jsonl.gz \\
+        --property name --property runtime.powerState \\
+        --property summary.config.numCpu
+"""
+from __future__ import print_function
+
+__author__ = "VMware, Inc."
+
+from pyVmomi import vim
+
+from pyvmomi_tools.cli import session
+from pyvmomi_tools.extensions import export as export_extensions
+
+# --type choices
+TYPES = {
+    'vm': vim.VirtualMachine,
+    'host': vim.HostSystem,
+    'datastore': vim.Datastore,
+    'network': vim.Network,
+    'cluster': vim.ClusterComputeResource,
+}
+
+
+def add_arguments(parser):
+    parser.add_argument('output',
+                        help='File to write, .jsonl or .csv, optionally .gz')
+
+    parser.add_argument('-P', '--property',
+                        required=True,
+                        action='append',
+                        dest='properties',
+                        help='Property path to export, may be repeated')
+
+    parser.add_argument('-T', '--type',
+                        required=False,
+                        choices=sorted(TYPES.keys()),
+                        default='vm',
+                        help='Kind of object to export, default vm')
+
+    parser.add_argument('-f', '--format',
+                        required=False,
+                        choices=export_extensions.FORMATS,
+                        help='Output format, taken from the file name '
+                             'by default')
+
+    parser.add_argument('--page-size',
+                        required=False,
+                        type=int,
+                        default=1000,
+                        help='Objects retrieved per round trip, default 1000')
+
+    return parser
+
+
+def run(args):
+    si = session.connect(args)
+    rows, seconds = export_extensions.export_inventory(
+        si.content.rootFolder, args.output, args.properties,
+        obj_type=TYPES[args.type], fmt=args.format,
+        page_size=args.page_size)
+    print('exported %d rows in %.1fs (%.0f rows/s)' %
+          (rows, seconds, rows / seconds if seconds else 0.0))
+    return 0
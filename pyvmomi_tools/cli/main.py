@@ -0,0 +1,62 @@
+# Copyright (c) 2014 VMware, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+The pyvmomi-tools command line entry point.
+
+code::
+    pyvmomi-tools <command> -s host -u user [options]
+
+Each command module provides add_arguments(parser) and run(args), the
+connection arguments from cli.args are added to every command.
+"""
+__author__ = "VMware, Inc."
+
+import argparse
+import sys
+
+from pyvmomi_tools.cli import args as cli_args
+from pyvmomi_tools.cli import export
+from pyvmomi_tools.cli import run
+
+# command name -> (module, help)
+COMMANDS = {
+    'export': (export, 'Stream inventory properties to JSONL or CSV'),
+    'run': (run, 'Apply an operation to all matching entities'),
+}
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='pyvmomi-tools')
+    subparsers = parser.add_subparsers(dest='command')
+    for name in sorted(COMMANDS.keys()):
+        module, help_text = COMMANDS[name]
+        subparser = subparsers.add_parser(name, help=help_text)
+        cli_args.add_connection_arguments(subparser)
+        module.add_arguments(subparser)
+        subparser.set_defaults(func=module.run)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if getattr(args, 'func', None) is None:
+        parser.print_help()
+        return 2
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,240 @@
+# Copyright (c) 2014 VMware, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+The 'run' command: apply one operation to every entity matching a name.
+
+code::
+    pyvmomi-tools run -s vcenter -u admin --match 'web-*' power-off \\
+        --workers 8 --max-inflight-tasks 32
+    pyvmomi-tools run -s vcenter -u admin --match 'web-*' rename \\
+        --new-name 'old-{name}'
+
+Matches stream out of a parallel find_by, with the names the traversal
+fetched, into a pool of workers that start one task per entity. At most
+--max-inflight-tasks tasks are running at any time and all of them are
+tracked by a single TaskMonitor. At the end the command prints the task
+throughput and latency percentiles.
+"""
+from __future__ import print_function
+
+__author__ = "VMware, Inc."
+
+import fnmatch
+import sys
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+from pyVmomi import vim
+from pyVmomi import vmodl
+
+from pyvmomi_tools.cli import session
+from pyvmomi_tools.extensions import task as task_extensions
+
+
+def _rename(entity, name, args):
+    return entity.Rename(args.new_name.format(name=name))
+
+
+def _reconfigure(entity, name, args):
+    spec = vim.vm.ConfigSpec()
+    if args.memory_mb is not None:
+        spec.memoryMB = args.memory_mb
+    if args.num_cpus is not None:
+        spec.numCPUs = args.num_cpus
+    return entity.ReconfigVM_Task(spec=spec)
+
+
+# operation name -> (entity types it applies to, function called with the
+# entity, its name and the arguments returning a task)
+OPERATIONS = {
+    'power-on': ([vim.VirtualMachine], lambda e, name, args: e.PowerOn()),
+    'power-off': ([vim.VirtualMachine], lambda e, name, args: e.PowerOff()),
+    'reset': ([vim.VirtualMachine], lambda e, name, args: e.ResetVM_Task()),
+    'rename': (None, _rename),
+    'reconfigure': ([vim.VirtualMachine], _reconfigure),
+}
+
+# operation name -> the options it cannot run without, each entry is a
+# tuple of options at least one of which must be given
+REQUIRED_OPTIONS = {
+    'rename': [('new_name',)],
+    'reconfigure': [('memory_mb', 'num_cpus')],
+}
+
+
+def add_arguments(parser):
+    parser.add_argument('operation',
+                        choices=sorted(OPERATIONS.keys()),
+                        help='Operation to apply to each matched entity')
+
+    parser.add_argument('-m', '--match',
+                        required=True,
+                        action='store',
+                        help='Shell style pattern the entity name must match')
+
+    parser.add_argument('-w', '--workers',
+                        required=False,
+                        type=int,
+                        default=8,
+                        help='Threads used to search and start tasks, '
+                             'default 8')
+
+    parser.add_argument('-b', '--batch-size',
+                        required=False,
+                        type=int,
+                        default=10,
+                        help='Matches handed to a worker at a time, '
+                             'default 10')
+
+    parser.add_argument('-t', '--max-inflight-tasks',
+                        required=False,
+                        type=int,
+                        default=32,
+                        help='Most tasks running at once, default 32')
+
+    parser.add_argument('--new-name',
+                        required=False,
+                        action='store',
+                        help="rename, required: new name, '{name}' is the "
+                             "old name")
+
+    parser.add_argument('--memory-mb',
+                        required=False,
+                        type=int,
+                        help='reconfigure: memory size in MB, this or '
+                             '--num-cpus is required')
+
+    parser.add_argument('--num-cpus',
+                        required=False,
+                        type=int,
+                        help='reconfigure: number of virtual CPUs')
+
+    return parser
+
+
+def _percentile(values, percent):
+    # nearest rank on an already sorted list
+    if not values:
+        return 0.0
+    rank = int(round(percent / 100.0 * (len(values) - 1)))
+    return values[rank]
+
+
+class _Stats(object):
+    """Thread safe tally of task outcomes and latencies."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = []
+        self.succeeded = 0
+        self.failed = 0
+
+    def record(self, latency, ok):
+        with self._lock:
+            self.latencies.append(latency)
+            if ok:
+                self.succeeded += 1
+            else:
+                self.failed += 1
+
+    def report(self, elapsed):
+        latencies = sorted(self.latencies)
+        total = self.succeeded + self.failed
+        print('tasks: %d succeeded, %d failed in %.1fs (%.1f tasks/s)' %
+              (self.succeeded, self.failed, elapsed,
+               total / elapsed if elapsed else 0.0))
+        print('latency: p50 %.2fs  p90 %.2fs  p99 %.2fs  max %.2fs' %
+              (_percentile(latencies, 50), _percentile(latencies, 90),
+               _percentile(latencies, 99), _percentile(latencies, 100)))
+
+
+def _batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def run(args):
+    """Apply args.operation to every entity whose name matches args.match.
+
+    :rtype types.IntType:
+    :return: the process exit code, non zero if any task failed, 2 for a \
+    missing option.
+    """
+    for options in REQUIRED_OPTIONS.get(args.operation, []):
+        if all(getattr(args, option) is None for option in options):
+            print('%s requires %s' % (args.operation, ' or '.join(
+                '--' + option.replace('_', '-') for option in options)),
+                  file=sys.stderr)
+            return 2
+
+    si = session.connect(args)
+    types, operation = OPERATIONS[args.operation]
+
+    monitor = task_extensions.TaskMonitor(si)
+    monitor.start()
+    inflight = threading.BoundedSemaphore(args.max_inflight_tasks)
+    stats = _Stats()
+
+    def finished(started, name):
+        def callback(task, state, error):
+            inflight.release()
+            stats.record(time.time() - started,
+                         state == vim.TaskInfo.State.success)
+            if error is not None:
+                print('%s: %s' % (name, error.__class__.__name__))
+        return callback
+
+    def start(batch):
+        for entity, name in batch:
+            inflight.acquire()
+            started = time.time()
+            try:
+                task = operation(entity, name, args)
+            except vmodl.MethodFault as e:
+                inflight.release()
+                stats.record(time.time() - started, False)
+                print('%s: %s' % (name, e.__class__.__name__))
+                continue
+            monitor.add(task, finished(started, name))
+
+    def matcher(entity, name):
+        # the name comes with the traversal, no read per entity
+        return name is not None and fnmatch.fnmatchcase(name, args.match)
+
+    began = time.time()
+    pool = ThreadPool(args.workers)
+    try:
+        root_folder = si.content.rootFolder
+        matches = root_folder.find_by(matcher, types=types,
+                                      workers=args.workers, names=True)
+        results = [pool.apply_async(start, (batch,))
+                   for batch in _batches(matches, args.batch_size)]
+        for result in results:
+            # re-raises anything a worker hit outside of a task failure
+            result.get()
+        monitor.wait()
+    finally:
+        pool.terminate()
+        monitor.stop()
+
+    stats.report(time.time() - began)
+    return 1 if stats.failed else 0
@@ -0,0 +1,196 @@
+# Copyright (c) 2014 VMware, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module implements connecting from the command line with an optional
+session cache.
+
+Logging in is one of the slowest calls on a busy vCenter. With the cache
+turned on the session cookie is kept in a file only the current user can
+read, the next run checks it with a single currentSession read and only logs
+in again when the server no longer knows the session. A cache file or
+directory others could read is not trusted and the run logs in again.
+
+code::
+    parser = argparse.ArgumentParser()
+    cli.args.add_connection_arguments(parser)
+    args = cli.args.prompt_for_password(parser)
+    si = cli.session.connect(args)
+
+Run the script with --session-cache to reuse sessions between runs.
+"""
+__author__ = "VMware, Inc."
+
+import atexit
+import errno
+import getpass
+import json
+import os
+import re
+
+from pyVim import connect as pyvim_connect
+from pyVmomi import SoapStubAdapter
+from pyVmomi import vim
+
+from pyvmomi_tools.extensions import rate_limit
+
+DEFAULT_CACHE_DIR = os.path.join('~', '.pyvmomi_tools', 'sessions')
+
+
+def _cache_file(cache_dir, host, port, user):
+    name = re.sub(r'[^A-Za-z0-9_.@-]', '_', '%s_%s_%s' % (user, host, port))
+    return os.path.join(os.path.expanduser(cache_dir), name)
+
+
+def _private(path):
+    # only the current user may read or replace the file and its directory,
+    # where there are POSIX permissions to check
+    if not hasattr(os, 'getuid'):
+        return True
+    for checked in (path, os.path.dirname(path)):
+        st = os.stat(checked)
+        if st.st_uid != os.getuid() or st.st_mode & 0o077:
+            return False
+    return True
+
+
+def load_session(host, port, user, cache_dir=DEFAULT_CACHE_DIR):
+    """Reconnect with a cached session cookie if the server still knows it.
+
+    The session is checked with one read of currentSession, on the session
+    manager recorded with the cookie. A cookie the server no longer accepts,
+    or one in a file or directory others can read, is removed from the
+    cache.
+
+    :type host: types.StringTypes
+    :param host: the vCenter or ESX host.
+
+    :type port: types.IntType
+    :param port: the port to connect to.
+
+    :type user: types.StringTypes
+    :param user: the user the session belongs to.
+
+    :rtype vim.ServiceInstance:
+    :return: a logged in service instance or None.
+    """
+    path = _cache_file(cache_dir, host, port, user)
+    try:
+        if not _private(path):
+            clear_session(host, port, user, cache_dir)
+            return None
+        with open(path) as f:
+            cached = json.load(f)
+        cookie = cached['cookie']
+        version = cached['version']
+        session_manager_id = cached['session_manager']
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        return None
+
+    stub = SoapStubAdapter(host=host, port=int(port), version=version)
+    stub.cookie = cookie
+    session_manager = vim.SessionManager(session_manager_id, stub)
+    try:
+        if session_manager.currentSession is not None:
+            return vim.ServiceInstance('ServiceInstance', stub)
+    except vim.fault.NotAuthenticated:
+        pass
+
+    clear_session(host, port, user, cache_dir)
+    return None
+
+
+def save_session(si, host, port, user, cache_dir=DEFAULT_CACHE_DIR):
+    """Store the session cookie of si, readable by the current user only.
+
+    An existing cache directory or file has its permissions narrowed too.
+
+    :type si: vim.ServiceInstance
+    :param si: a logged in service instance.
+    """
+    path = _cache_file(cache_dir, host, port, user)
+    directory = os.path.dirname(path)
+    try:
+        os.makedirs(directory, 0o700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    os.chmod(directory, 0o700)
+
+    # the session manager is ha-sessionmgr on ESX, record it so loading
+    # does not need the service content
+    cached = {'cookie': si._stub.cookie, 'version': si._stub.version,
+              'session_manager': si.content.sessionManager._moId}
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    # the mode above only applies to new files
+    os.chmod(path, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(cached, f)
+
+
+def clear_session(host, port, user, cache_dir=DEFAULT_CACHE_DIR):
+    """Forget a cached session."""
+    try:
+        os.remove(_cache_file(cache_dir, host, port, user))
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
+def connect(args):
+    """Connect using parsed connection arguments.
+
+    Without args.session_cache this is SmartConnect followed by Disconnect
+    at exit. With it a cached session is reused when it is still valid,
+    otherwise this logs in, prompting for a password if none was given, and
+    caches the new session. Cached sessions are left logged in at exit.
+
+    When args.max_read_rate or args.max_task_rate is set a RateLimiter with
+    those limits is installed on the connection.
+
+    :type args: argparse.Namespace
+    :param args: arguments from a parser set up by add_connection_arguments.
+
+    :rtype vim.ServiceInstance:
+    :return: a logged in service instance, also set as the default GetSi().
+    """
+    use_cache = getattr(args, 'session_cache', False)
+    cache_dir = getattr(args, 'session_cache_dir', DEFAULT_CACHE_DIR)
+
+    if use_cache:
+        si = load_session(args.host, args.port, args.user, cache_dir)
+        if si is not None:
+            pyvim_connect.SetSi(si)
+            return _limit(si, args)
+
+    if args.password is None:
+        args.password = getpass.getpass(
+            prompt='Enter password for host %s and user %s: ' %
+                   (args.host, args.user))
+
+    si = pyvim_connect.SmartConnect(host=args.host, user=args.user,
+                                    pwd=args.password, port=int(args.port))
+    if use_cache:
+        save_session(si, args.host, args.port, args.user, cache_dir)
+    else:
+        atexit.register(pyvim_connect.Disconnect, si)
+    return _limit(si, args)
+
+
+def _limit(si, args):
+    read_rate = getattr(args, 'max_read_rate', None)
+    task_rate = getattr(args, 'max_task_rate', None)
+    if read_rate or task_rate:
+        rate_limit.RateLimiter(read_rate, task_rate).install(si)
+    return si
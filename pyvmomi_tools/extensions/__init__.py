@@ -16,7 +16,23 @@ __author__ = 'VMware, Inc.'
 
 # pulling these imports in here allows them to monkey-patch the main
 # pyvmomi_tools library and add new methods to existing classes.
+from pyvmomi_tools.extensions import change_bus
+from pyvmomi_tools.extensions import custom_fields
+from pyvmomi_tools.extensions import datastore
+from pyvmomi_tools.extensions import export
+from pyvmomi_tools.extensions import federation
 from pyvmomi_tools.extensions import folder
+from pyvmomi_tools.extensions import guest_files
+from pyvmomi_tools.extensions import host_health
 from pyvmomi_tools.extensions import managed_object
+from pyvmomi_tools.extensions import performance_manager
+from pyvmomi_tools.extensions import pipeline
+from pyvmomi_tools.extensions import process_pool
+from pyvmomi_tools.extensions import profiling
+from pyvmomi_tools.extensions import property_collector
+from pyvmomi_tools.extensions import rate_limit
+from pyvmomi_tools.extensions import serializer
+from pyvmomi_tools.extensions import snapshot
 from pyvmomi_tools.extensions import task
+from pyvmomi_tools.extensions import task_stats
 from pyvmomi_tools.extensions import virtual_machine
@@ -0,0 +1,424 @@
+# Copyright (c) 2014 VMware, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module implements an in-process publish/subscribe bus for property
+changes.
+
+Every component creating its own property filters for the same objects
+multiplies the work the server does. A ChangeBus holds one filter per
+object carrying the union of the property paths all subscribers asked for,
+runs a single WaitForUpdatesEx loop and copies each change to the queues of
+the subscribers interested in that object and path.
+
+methods
+=======
+
+subscribe
+---------
+
+code::
+    subscription = vm.subscribe(['runtime.powerState'])
+    while True:
+        event = subscription.get()
+        print event.obj, event.name, event.val
+
+Subscribes through the shared bus of the object's session. The first events
+are the current values of the paths, with kind 'enter'. When the update loop
+stops, get() raises ChangeBusStopped.
+
+change_bus
+----------
+
+code::
+    bus = change_bus(si)
+
+The shared, started bus for a session.
+"""
+__author__ = "VMware, Inc."
+
+import collections
+import threading
+
+from six.moves import queue
+
+from pyVmomi import VmomiSupport
+from pyVmomi import vim
+from pyVmomi import vmodl
+
+# what a subscription does when its queue is full
+BLOCK = 'block'              # the update loop waits, slowing every consumer
+DROP_OLDEST = 'drop_oldest'  # discard the oldest queued event
+DROP_NEWEST = 'drop_newest'  # discard the event being delivered
+
+ChangeEvent = collections.namedtuple('ChangeEvent',
+                                     ['obj', 'kind', 'name', 'op', 'val'])
+
+
+class ChangeBusStopped(Exception):
+    """Raised by Subscription.get once the bus's update loop has ended."""
+
+    def __init__(self, error=None):
+        super(ChangeBusStopped, self).__init__(
+            'the change bus stopped' +
+            (': %s' % error if error is not None else ''))
+        self.error = error
+
+
+class _Stopped(object):
+    # queued after the last event when the update loop ends
+    def __init__(self, error):
+        self.error = error
+
+
+def _same(a, b):
+    # pyVmomi data objects do not compare by value, their repr does
+    if isinstance(a, (VmomiSupport.DataObject, list)):
+        return repr(a) == repr(b)
+    return a == b
+
+
+def _path_matches(subscribed, changed):
+    # a change to 'runtime' covers 'runtime.powerState' and the other way
+    return (subscribed == changed or
+            changed.startswith(subscribed + '.') or
+            subscribed.startswith(changed + '.'))
+
+
+class Subscription(object):
+    """A subscriber's view of the bus: a bounded queue of ChangeEvents."""
+
+    def __init__(self, bus, obj, paths, maxsize, policy):
+        self.bus = bus
+        self.obj = obj
+        self.paths = frozenset(paths)
+        self.policy = policy
+        self.dropped = 0
+        # True once the current values have been delivered
+        self.primed = False
+        self._queue = queue.Queue(maxsize)
+
+    def get(self, block=True, timeout=None):
+        """Take the next event, see Queue.get.
+
+        :raises ChangeBusStopped: once the bus has stopped and every event \
+        before that has been taken.
+        """
+        event = self._queue.get(block, timeout)
+        if isinstance(event, _Stopped):
+            # leave it for the next get
+            self._put_last(event)
+            raise ChangeBusStopped(event.error)
+        return event
+
+    def close(self):
+        """Unsubscribe from the bus."""
+        self.bus.unsubscribe(self)
+
+    def _wants(self, name):
+        for path in self.paths:
+            if _path_matches(path, name):
+                return True
+        return False
+
+    def _put_last(self, event):
+        # never blocks, makes room by dropping the oldest event
+        while True:
+            try:
+                self._queue.put_nowait(event)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def _prime(self, events):
+        # the current values, dropped rather than blocking the subscriber
+        for event in events:
+            try:
+                self._queue.put_nowait(event)
+            except queue.Full:
+                self.dropped += 1
+        self.primed = True
+
+    def _deliver(self, event):
+        if self.policy == BLOCK:
+            self._queue.put(event)
+            return
+        while True:
+            try:
+                self._queue.put_nowait(event)
+                return
+            except queue.Full:
+                self.dropped += 1
+                if self.policy == DROP_NEWEST:
+                    return
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+
+class ChangeBus(object):
+    """Fans property changes out from one update loop to many subscribers.
+
+    Subscriptions on the same object share one property filter, the filter
+    is rebuilt when a subscription adds or removes the last interest in a
+    path. The update loop runs on a daemon thread with a private property
+    collector.
+
+    The bus keeps the latest value of every watched path. A new subscriber
+    gets the current values of its paths first, from that cache when the
+    filter already covers them and from the rebuilt filter's first update
+    otherwise. The values a rebuilt filter repeats are not delivered again
+    to subscribers that already have them.
+    """
+
+    def __init__(self, si, max_wait_seconds=1):
+        """
+        :type si: vim.ServiceInstance
+        :param si: the session to watch.
+
+        :type max_wait_seconds: types.IntType
+        :param max_wait_seconds: the longest a single WaitForUpdatesEx call \
+        blocks, bounds how long stop() takes.
+        """
+        collector = si.content.propertyCollector
+        self._pc = collector.CreatePropertyCollector()
+        self._wait_options = vmodl.query.PropertyCollector.WaitOptions(
+            maxWaitSeconds=max_wait_seconds)
+        self._lock = threading.RLock()
+        # object id -> [Subscription]
+        self._subscriptions = {}
+        # object id -> (frozenset of paths, vmodl.query.PropertyFilter)
+        self._filters = {}
+        # object id -> {path: latest value}
+        self._values = {}
+        # ids of objects whose current filter has sent its first update
+        self._synced = set()
+        self._stopping = False
+        self._stopped = None
+        self._thread = None
+        self.error = None
+
+    def subscribe(self, obj, paths, maxsize=1000, policy=BLOCK):
+        """Subscribe to changes of paths on obj.
+
+        :type obj: vim.ManagedObject
+        :param obj: the object to watch.
+
+        :type paths: types.ListType
+        :param paths: property paths, e.g. ['runtime.powerState'].
+
+        :type maxsize: types.IntType
+        :param maxsize: the most events queued for this subscriber.
+
+        :type policy: types.StringTypes
+        :param policy: BLOCK, DROP_OLDEST or DROP_NEWEST when the queue is \
+        full.
+
+        :rtype Subscription:
+        :return: the subscription to read events from.
+
+        :raises ChangeBusStopped: when the update loop has already ended.
+        """
+        subscription = Subscription(self, obj, paths, maxsize, policy)
+        with self._lock:
+            if self._stopped is not None:
+                raise ChangeBusStopped(self._stopped.error)
+            self._subscriptions.setdefault(obj.id, []).append(subscription)
+            self._refilter(obj)
+            if obj.id in self._synced:
+                # the filter already covers these paths, nothing new will
+                # come from the server, prime from the cache
+                subscription._prime(self._current(subscription))
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Stop delivering events to subscription."""
+        obj = subscription.obj
+        with self._lock:
+            subscriptions = self._subscriptions.get(obj.id, [])
+            if subscription in subscriptions:
+                subscriptions.remove(subscription)
+            if not subscriptions:
+                self._subscriptions.pop(obj.id, None)
+            self._refilter(obj)
+
+    def _current(self, subscription):
+        values = self._values.get(subscription.obj.id, {})
+        return [ChangeEvent(subscription.obj, 'enter', name, 'assign', val)
+                for name, val in sorted(values.items())
+                if subscription._wants(name)]
+
+    def _refilter(self, obj):
+        # keep exactly one filter per object covering all subscribed paths
+        paths = frozenset()
+        for subscription in self._subscriptions.get(obj.id, []):
+            paths = paths | subscription.paths
+        current_paths, current_filter = self._filters.get(obj.id,
+                                                          (None, None))
+        if paths == current_paths:
+            return
+        if current_filter is not None:
+            current_filter.Destroy()
+            del self._filters[obj.id]
+        self._synced.discard(obj.id)
+        if not paths:
+            self._values.pop(obj.id, None)
+        if paths:
+            collector = vmodl.query.PropertyCollector
+            filter_spec = collector.FilterSpec(
+                objectSet=[collector.ObjectSpec(obj=obj)],
+                propSet=[collector.PropertySpec(type=obj.__class__,
+                                                pathSet=sorted(paths))])
+            self._filters[obj.id] = (paths,
+                                     self._pc.CreateFilter(filter_spec, True))
+
+    def start(self):
+        """Run the update loop on a daemon thread."""
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop the update loop and destroy the private property collector.
+
+        Subscribers get ChangeBusStopped once they have read every event.
+        """
+        self._stopping = True
+        if self._thread is not None:
+            self._thread.join()
+        try:
+            self._pc.Destroy()
+        except vmodl.MethodFault:
+            pass
+
+    def _run(self):
+        version = None
+        try:
+            while not self._stopping:
+                update = self._pc.WaitForUpdatesEx(version,
+                                                   self._wait_options)
+                if update is None:
+                    continue
+                version = update.version
+                for filter_set in update.filterSet:
+                    for obj_set in filter_set.objectSet:
+                        self._publish(filter_set.filter, obj_set)
+        except Exception as e:
+            self.error = e
+        finally:
+            self._end()
+
+    def _end(self):
+        # wake every subscriber and let the session get a new bus
+        with self._lock:
+            self._stopped = _Stopped(self.error)
+            subscriptions = [s for subscriptions in
+                             self._subscriptions.values()
+                             for s in subscriptions]
+        for subscription in subscriptions:
+            subscription._put_last(self._stopped)
+        _forget(self)
+
+    def _publish(self, pfilter, obj_set):
+        obj_id = obj_set.obj.id
+        deliveries = []
+        with self._lock:
+            current = self._filters.get(obj_id)
+            if current is None or current[1] != pfilter:
+                # sent by a filter that has since been replaced
+                return
+            values = self._values.setdefault(obj_id, {})
+            if obj_id not in self._synced:
+                # the first update of a new filter carries every value
+                self._synced.add(obj_id)
+                repeated = dict(values)
+                values.clear()
+            else:
+                repeated = {}
+            events = []
+            for change in obj_set.changeSet or []:
+                if change.op in ('remove', 'indirectRemove'):
+                    values.pop(change.name, None)
+                else:
+                    values[change.name] = change.val
+                events.append(ChangeEvent(obj_set.obj, obj_set.kind,
+                                          change.name, change.op,
+                                          change.val))
+            for subscription in self._subscriptions.get(obj_id, []):
+                if not subscription.primed:
+                    subscription.primed = True
+                    wanted = events
+                else:
+                    # skip the values a rebuilt filter repeats
+                    wanted = [e for e in events
+                              if e.name not in repeated or
+                              not _same(repeated[e.name], e.val)]
+                wanted = [e for e in wanted if subscription._wants(e.name)]
+                if wanted:
+                    deliveries.append((subscription, wanted))
+        # deliver outside the lock, a blocking subscriber must not stop
+        # others from subscribing
+        for subscription, events in deliveries:
+            for event in events:
+                subscription._deliver(event)
+
+
+_buses = {}
+_buses_lock = threading.Lock()
+
+
+def _forget(bus):
+    # drop a stopped bus so the next change_bus call starts a new one
+    with _buses_lock:
+        for stub, registered in list(_buses.items()):
+            if registered is bus:
+                del _buses[stub]
+
+
+def change_bus(si):
+    """The shared change bus of a session, started on first use.
+
+    A bus whose update loop has ended is replaced by a new one.
+
+    :type si: vim.ServiceInstance
+    :param si: the session.
+
+    :rtype ChangeBus:
+    """
+    with _buses_lock:
+        bus = _buses.get(si._stub)
+        if bus is None:
+            bus = ChangeBus(si)
+            bus.start()
+            _buses[si._stub] = bus
+        return bus
+
+
+def subscribe(managed_object, paths, maxsize=1000, policy=BLOCK):
+    """Subscribe to changes of paths on this object via the session's bus.
+
+    See ChangeBus.subscribe.
+
+    :rtype Subscription:
+    """
+    si = vim.ServiceInstance('ServiceInstance', managed_object._stub)
+    return change_bus(si).subscribe(managed_object, paths, maxsize, policy)
+
+
+vim.ManagedObject.subscribe = subscribe
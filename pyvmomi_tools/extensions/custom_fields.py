@@ -0,0 +1,298 @@
+# Copyright (c) 2014 VMware, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module implements a local index of custom attribute values.
+
+Filtering by custom attribute otherwise reads customValue on every entity
+and maps the integer keys back to names through CustomFieldsManager.field
+each time. A CustomAttributeIndex keeps the field definitions and an
+(attribute, value) to entity index in memory. It is filled by the first
+WaitForUpdatesEx of a private property collector watching customValue and
+the parent of every entity below a container, then kept current by the
+same update stream, so lookups, including limiting them to a folder, never
+go to the server.
+
+code::
+    index = custom_attribute_index(si)
+    vms = index.find('owner', 'alice', vim.VirtualMachine)
+    print index.values(vms[0])
+    vms = index.find('owner', 'alice', container=folder)
+
+    vms = root_folder.find_by_custom_value('owner', 'alice')
+
+custom_attribute_index(si) is a shared, started index of the whole
+inventory per session. vSphere tags are served by a separate REST API and
+are not covered.
+"""
+__author__ = "VMware, Inc."
+
+import threading
+
+from pyVmomi import vim
+from pyVmomi import vmodl
+
+
+class CustomAttributeIndex(object):
+    """Custom attribute values of many entities, kept current on a thread.
+    """
+
+    def __init__(self, si, container=None, types=(vim.ManagedEntity,),
+                 max_wait_seconds=1):
+        """
+        :type si: vim.ServiceInstance
+        :param si: the session to watch.
+
+        :type container: vim.ManagedEntity
+        :param container: index the entities below this, default the root \
+        folder.
+
+        :type types: types.TupleType
+        :param types: the entity types to index.
+
+        :type max_wait_seconds: types.IntType
+        :param max_wait_seconds: the longest a single WaitForUpdatesEx call \
+        blocks, bounds how long stop() takes.
+        """
+        content = si.content
+        self._content = content
+        self._container = container or content.rootFolder
+        self._types = tuple(types)
+        self._pc = content.propertyCollector.CreatePropertyCollector()
+        self._wait_options = vmodl.query.PropertyCollector.WaitOptions(
+            maxWaitSeconds=max_wait_seconds)
+        self._lock = threading.Lock()
+        self._synced = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self._view = None
+        # field key -> vim.CustomFieldsManager.FieldDef
+        self._fields = {}
+        # entity id -> entity and entity id -> {field key: value}
+        self._entities = {}
+        self._values = {}
+        # (field key, value) -> set of entity ids
+        self._inverted = {}
+        # entity id -> {'parent' or 'parentVApp': parent id}
+        self._parents = {}
+        self.error = None
+
+    def start(self, timeout=None):
+        """Build the index and keep it current on a daemon thread.
+
+        :type timeout: types.FloatType
+        :param timeout: the longest to wait for the index to be built.
+
+        :raises: the error that stopped the update loop, if any.
+        """
+        collector = vmodl.query.PropertyCollector
+        self._view = self._content.viewManager.CreateContainerView(
+            self._container, list(self._types), True)
+        traversal_spec = collector.TraversalSpec(name='traverseView',
+                                                 path='view', skip=False,
+                                                 type=vim.view.ContainerView)
+        prop_set = [collector.PropertySpec(type=t,
+                                           pathSet=['customValue', 'parent'])
+                    for t in self._types]
+        if [t for t in self._types if issubclass(vim.VirtualMachine, t)]:
+            # virtual machines in a vApp have parentVApp instead of parent
+            prop_set.append(collector.PropertySpec(type=vim.VirtualMachine,
+                                                   pathSet=['parentVApp']))
+        self._pc.CreateFilter(collector.FilterSpec(
+            objectSet=[collector.ObjectSpec(obj=self._view, skip=True,
+                                            selectSet=[traversal_spec])],
+            propSet=prop_set), True)
+        fields_manager = self._content.customFieldsManager
+        if fields_manager is not None:
+            self._pc.CreateFilter(collector.FilterSpec(
+                objectSet=[collector.ObjectSpec(obj=fields_manager)],
+                propSet=[collector.PropertySpec(type=vim.CustomFieldsManager,
+                                                pathSet=['field'])]), True)
+
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        self._synced.wait(timeout)
+        if self.error is not None:
+            raise self.error
+
+    def stop(self):
+        """Stop the update loop and destroy the view and the collector."""
+        self._stopping = True
+        if self._thread is not None:
+            self._thread.join()
+        for obj in (self._view, self._pc):
+            try:
+                if obj is not None:
+                    obj.Destroy()
+            except vmodl.MethodFault:
+                pass
+
+    def field_keys(self, name, obj_type=None):
+        """The keys of the fields called name that apply to obj_type.
+
+        Fields without a managed object type apply to every type.
+
+        :rtype types.ListType:
+        """
+        with self._lock:
+            return [key for key, field in self._fields.items()
+                    if field.name == name and
+                    (obj_type is None or field.managedObjectType is None or
+                     issubclass(obj_type, field.managedObjectType))]
+
+    def field_name(self, key):
+        """The name of the field with key, or None."""
+        with self._lock:
+            field = self._fields.get(key)
+        return field.name if field is not None else None
+
+    def find(self, name, value, obj_type=None, container=None):
+        """The entities whose attribute name is set to value.
+
+        :type name: types.StringTypes
+        :param name: the custom attribute name.
+
+        :type value: types.StringTypes
+        :param value: the exact value.
+
+        :type obj_type: type
+        :param obj_type: only entities of this type, e.g. vim.VirtualMachine.
+
+        :type container: vim.ManagedEntity
+        :param container: only entities below this, checked against the \
+        parents in the index. It must itself be indexed or be the index's \
+        container.
+
+        :rtype types.ListType: contains [<vim.ManagedEntity>]
+        """
+        keys = self.field_keys(name, obj_type)
+        with self._lock:
+            ids = set()
+            for key in keys:
+                ids.update(self._inverted.get((key, value), ()))
+            if container is not None and \
+                    container.id != self._container.id:
+                ids = [i for i in ids if self._below(container.id, i)]
+            entities = [self._entities[i] for i in ids]
+        if obj_type is not None:
+            entities = [e for e in entities if isinstance(e, obj_type)]
+        return sorted(entities, key=lambda e: e.id)
+
+    def values(self, entity):
+        """The custom attributes of entity as {name: value}."""
+        with self._lock:
+            values = dict(self._values.get(entity.id, {}))
+            return dict((self._fields[key].name if key in self._fields
+                         else key, value) for key, value in values.items())
+
+    def _below(self, container_id, entity_id):
+        # walk up the indexed parents, entities are not below themselves
+        seen = set([entity_id])
+        while True:
+            parents = self._parents.get(entity_id, {})
+            entity_id = parents.get('parent') or parents.get('parentVApp')
+            if entity_id is None or entity_id in seen:
+                return False
+            if entity_id == container_id:
+                return True
+            seen.add(entity_id)
+
+    def _run(self):
+        version = None
+        try:
+            while not self._stopping:
+                update = self._pc.WaitForUpdatesEx(version,
+                                                   self._wait_options)
+                if update is None:
+                    continue
+                version = update.version
+                with self._lock:
+                    for filter_set in update.filterSet:
+                        for obj_set in filter_set.objectSet:
+                            self._apply(obj_set)
+                if not update.truncated:
+                    self._synced.set()
+        except Exception as e:
+            self.error = e
+            self._synced.set()
+
+    def _apply(self, obj_set):
+        obj = obj_set.obj
+        if isinstance(obj, vim.CustomFieldsManager):
+            for change in obj_set.changeSet or []:
+                if change.name == 'field':
+                    self._fields = dict((f.key, f) for f in change.val or [])
+            return
+        if obj_set.kind == 'leave':
+            self._set_values(obj, [])
+            self._entities.pop(obj.id, None)
+            self._parents.pop(obj.id, None)
+            return
+        self._entities[obj.id] = obj
+        for change in obj_set.changeSet or []:
+            if change.name == 'customValue':
+                self._set_values(obj, change.val if change.op == 'assign'
+                                 else [])
+            elif change.name in ('parent', 'parentVApp'):
+                parents = self._parents.setdefault(obj.id, {})
+                if change.op == 'assign' and change.val is not None:
+                    parents[change.name] = change.val.id
+                else:
+                    parents.pop(change.name, None)
+
+    def _set_values(self, obj, custom_values):
+        for key, value in self._values.pop(obj.id, {}).items():
+            ids = self._inverted.get((key, value))
+            if ids is not None:
+                ids.discard(obj.id)
+                if not ids:
+                    del self._inverted[(key, value)]
+        values = dict((v.key, getattr(v, 'value', None))
+                      for v in custom_values or [])
+        if values:
+            self._values[obj.id] = values
+        for key, value in values.items():
+            self._inverted.setdefault((key, value), set()).add(obj.id)
+
+
+# stub -> [lock, CustomAttributeIndex or None], the per-session lock is held
+# while the index is built so other sessions are not held up
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def custom_attribute_index(si):
+    """The shared index of the whole inventory of a session, started and
+    built on first use.
+
+    An index whose update loop has ended is replaced by a new one.
+
+    :type si: vim.ServiceInstance
+    :param si: the session.
+
+    :rtype CustomAttributeIndex:
+    """
+    with _indexes_lock:
+        entry = _indexes.setdefault(si._stub, [threading.Lock(), None])
+    with entry[0]:
+        if entry[1] is not None and entry[1].error is not None:
+            # no longer kept current, its answers would go stale
+            entry[1].stop()
+            entry[1] = None
+        if entry[1] is None:
+            index = CustomAttributeIndex(si)
+            index.start()
+            entry[1] = index
+        return entry[1]
@@ -0,0 +1,252 @@
+# Copyright (c) 2014 VMware, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module implements a parallel datastore browser.
+
+Searching a whole datastore with one SearchDatastoreSubFolders_Task runs the
+search serially on one host and returns every file in a single result that
+has to fit in memory. browse_datastores lists the top level of each
+datastore first, then searches every top level folder as its own task, many
+at once across all the datastores, and yields the file entries of each
+folder as soon as its search completes.
+
+code::
+    cache = ListingCache()
+    for entry in browse_datastores(datacenter.datastore, ['*.vmdk'],
+                                   cache=cache):
+        print entry.datastore_path, entry.size
+
+With a ListingCache a later scan only searches the top level folders whose
+modification time changed. A folder's modification time only moves when
+entries are added, removed or renamed, not when a file in it is written to,
+so a growing disk keeps its old size until the cached listing reaches
+max_age and the folder is searched again.
+"""
+__author__ = "VMware, Inc."
+
+import collections
+import fnmatch
+import threading
+import time
+
+from six.moves import queue
+
+from pyVmomi import vim
+
+from pyvmomi_tools.extensions import task as task_extensions
+
+DEFAULT_MAX_INFLIGHT = 8
+
+# seconds a cached folder listing is trusted while its modification time
+# stays the same
+DEFAULT_MAX_AGE = 300
+
+_FolderInfo = vim.host.DatastoreBrowser.FolderInfo
+
+FileEntry = collections.namedtuple('FileEntry',
+                                   ['datastore', 'datastore_path', 'folder',
+                                    'path', 'file_type', 'size',
+                                    'modification'])
+FileEntry.__doc__ = """A file found on a datastore.
+
+datastore is the datastore name, datastore_path the full '[datastore]
+folder/path' of the file, folder the top level folder it was found under
+(None at the top level) and file_type the FileInfo class name such as
+'VmDiskInfo'. Folders themselves are not listed.
+"""
+
+
+class ListingCache(object):
+    """Thread safe file entries per top level folder and modification time.
+
+    Plain data only, so a cache can be pickled and kept between runs.
+    """
+
+    def __init__(self, max_age=DEFAULT_MAX_AGE):
+        """
+        :type max_age: types.IntType
+        :param max_age: seconds a listing is reused, None to trust the \
+        folder's modification time alone.
+        """
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        # (datastore name, folder, patterns) ->
+        #     (modification, time.time() when stored, [FileEntry])
+        self._folders = {}
+
+    def get(self, datastore, folder, modification, patterns=None):
+        """The cached entries if the folder has not changed and the listing
+        is younger than max_age, else None.
+        """
+        with self._lock:
+            cached = self._folders.get(_key(datastore, folder, patterns))
+        if cached is None or cached[0] != modification:
+            return None
+        if self.max_age is not None and \
+                time.time() - cached[1] > self.max_age:
+            return None
+        return cached[2]
+
+    def put(self, datastore, folder, modification, entries, patterns=None):
+        with self._lock:
+            self._folders[_key(datastore, folder, patterns)] = (
+                modification, time.time(), list(entries))
+
+    def __getstate__(self):
+        return {'folders': self._folders, 'max_age': self.max_age}
+
+    def __setstate__(self, state):
+        self._lock = threading.Lock()
+        self.max_age = state.get('max_age', DEFAULT_MAX_AGE)
+        # listings pickled without a time or patterns cannot be checked
+        self._folders = state['folders'] if 'max_age' in state else {}
+
+
+def _key(datastore, folder, patterns):
+    # a listing is only valid for the patterns it was searched with
+    return (datastore, folder, tuple(sorted(patterns or ())))
+
+
+def _search_spec(patterns=None, folders=False):
+    browser = vim.host.DatastoreBrowser
+    details = browser.FileInfo.Details(fileType=True, fileSize=True,
+                                       modification=True)
+    spec = browser.SearchSpec(details=details)
+    if patterns:
+        spec.matchPattern = list(patterns)
+    if folders:
+        spec.query = [browser.FolderQuery(), browser.Query()]
+    return spec
+
+
+def _join(folder_path, name):
+    # '[ds]' + 'a' is '[ds] a', '[ds] a/' + 'b' is '[ds] a/b'
+    if folder_path.endswith(']'):
+        return '%s %s' % (folder_path, name)
+    return '%s/%s' % (folder_path.rstrip('/'), name)
+
+
+def _entries(datastore_name, folder, result, patterns=None):
+    # the files of one SearchResults as FileEntry tuples
+    for info in result.file or []:
+        if isinstance(info, _FolderInfo):
+            continue
+        if patterns and not any(fnmatch.fnmatch(info.path, p)
+                                for p in patterns):
+            continue
+        yield FileEntry(datastore_name, _join(result.folderPath, info.path),
+                        folder, info.path,
+                        info.__class__.__name__.rsplit('.', 1)[-1],
+                        info.fileSize, info.modification)
+
+
+def browse_datastores(datastores, patterns=None,
+                      max_inflight=DEFAULT_MAX_INFLIGHT, cache=None,
+                      si=None):
+    """Yield the files on many datastores, searching folders in parallel.
+
+    Top level folders are searched as separate tasks, at most max_inflight
+    at a time over all the datastores, and each folder's entries are
+    yielded as soon as its search completes. Folders removed during the
+    scan are skipped. Closing the generator early stops waiting, searches
+    still running on the server are left to finish.
+
+    :type datastores: types.ListType
+    :param datastores: the vim.Datastore objects to browse.
+
+    :type patterns: types.ListType
+    :param patterns: file name patterns such as '*.vmdk', default all.
+
+    :type max_inflight: types.IntType
+    :param max_inflight: the most search tasks running at once.
+
+    :type cache: ListingCache
+    :param cache: reuse the entries of unchanged top level folders.
+
+    :type si: vim.ServiceInstance
+    :param si: the connection, default GetSi().
+
+    :rtype types.GeneratorType: yields <FileEntry>
+    """
+    top_spec = _search_spec(folders=True)
+    folder_spec = _search_spec(patterns)
+    completed = queue.Queue()
+    # (datastore, name, folder or None for the top level, modification)
+    shards = collections.deque((ds, ds.name, None, None) for ds in datastores)
+    inflight = 0
+
+    monitor = task_extensions.TaskMonitor(si)
+    monitor.start()
+    try:
+        while shards or inflight:
+            while shards and inflight < max_inflight:
+                shard = shards.popleft()
+                datastore, name, folder, _ = shard
+                if folder is None:
+                    search = datastore.browser.SearchDatastore_Task(
+                        '[%s]' % name, top_spec)
+                else:
+                    search = datastore.browser.SearchDatastoreSubFolders_Task(
+                        '[%s] %s' % (name, folder), folder_spec)
+                monitor.add(search,
+                            lambda t, state, error, shard=shard:
+                            completed.put((shard, t, state, error)))
+                inflight += 1
+
+            shard, search, state, error = completed.get()
+            inflight -= 1
+            datastore, name, folder, modification = shard
+            if state != vim.TaskInfo.State.success:
+                if isinstance(error, vim.fault.FileNotFound):
+                    continue
+                raise error
+
+            if folder is None:
+                result = search.info.result
+                for info in result.file or []:
+                    if not isinstance(info, _FolderInfo):
+                        continue
+                    cached = cache.get(name, info.path, info.modification,
+                                       patterns) \
+                        if cache is not None else None
+                    if cached is not None:
+                        for entry in cached:
+                            yield entry
+                    else:
+                        shards.append((datastore, name, info.path,
+                                       info.modification))
+                for entry in _entries(name, None, result, patterns):
+                    yield entry
+            else:
+                entries = [entry for result in search.info.result or []
+                           for entry in _entries(name, folder, result)]
+                if cache is not None:
+                    cache.put(name, folder, modification, entries,
+                              patterns)
+                for entry in entries:
+                    yield entry
+    finally:
+        monitor.stop()
+
+
+def browse(datastore, patterns=None, max_inflight=DEFAULT_MAX_INFLIGHT,
+           cache=None):
+    """Yield the files on one datastore, see browse_datastores."""
+    si = vim.ServiceInstance('ServiceInstance', datastore._stub)
+    return browse_datastores([datastore], patterns, max_inflight, cache, si)
+
+
+# NOTE: This kind of injection usually goes at the *bottom* of a file.
+vim.Datastore.browse = browse
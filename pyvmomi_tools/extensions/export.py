@@ -0,0 +1,181 @@
+# Copyright (c) 2014 VMware, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module implements streaming inventory export for the vim.Folder object
+in the pyvmomi library.
+
+methods
+=======
+
+export_inventory
+----------------
+
+code::
+    root_folder = si.content.rootFolder
+    rows, seconds = root_folder.export_inventory(
+        'vms.csv.gz', ['name', 'runtime.powerState', 'summary.config.numCpu'])
+
+Writes one row per object to a JSON Lines (.jsonl) or CSV (.csv) file,
+gzip compressed when the name ends in .gz. Properties are retrieved in pages
+and each page is written out before the next is fetched, so memory use does
+not grow with the size of the inventory.
+"""
+__author__ = "VMware, Inc."
+
+import csv
+import datetime
+import gzip
+import io
+import json
+import time
+
+import six
+
+from pyVmomi import vim
+from pyVmomi import vmodl
+
+from pyvmomi_tools.extensions import property_collector as pc_extensions
+
+FORMATS = ('jsonl', 'csv')
+
+
+def to_plain(value):
+    """Convert a property value to plain JSON compatible python values.
+
+    Managed object references become their id, data objects become dicts of
+    their set properties and datetimes become ISO 8601 strings.
+    """
+    if isinstance(value, vim.ManagedObject):
+        return value.id
+    if isinstance(value, vmodl.DynamicData):
+        plain = {}
+        for prop in value._GetPropertyList():
+            item = getattr(value, prop.name)
+            if item in (None, []) or prop.name in ('dynamicType',
+                                                   'dynamicProperty'):
+                continue
+            plain[prop.name] = to_plain(item)
+        return plain
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, type):
+        return value.__name__
+    if isinstance(value, (list, tuple)):
+        return [to_plain(v) for v in value]
+    if isinstance(value, dict):
+        return dict((k, to_plain(v)) for k, v in value.items())
+    return value
+
+
+def _format_for(path):
+    name = path[:-3] if path.endswith('.gz') else path
+    for fmt in FORMATS:
+        if name.endswith('.' + fmt):
+            return fmt
+    raise ValueError('cannot tell the export format of %s, use a .jsonl or '
+                     '.csv name or pass fmt' % path)
+
+
+def _open(path):
+    if path.endswith('.gz'):
+        raw = gzip.open(path, 'wb')
+    else:
+        raw = io.open(path, 'wb')
+    if six.PY2:
+        return raw
+    return io.TextIOWrapper(raw, encoding='utf-8', newline='')
+
+
+class _JsonLinesWriter(object):
+
+    def __init__(self, stream, columns):
+        self._stream = stream
+        self._columns = columns
+
+    def write(self, row):
+        record = dict(zip(self._columns, row))
+        self._stream.write(json.dumps(record, sort_keys=True) + '\n')
+
+
+class _CsvWriter(object):
+
+    def __init__(self, stream, columns):
+        self._writer = csv.writer(stream)
+        self._writer.writerow(columns)
+
+    def write(self, row):
+        # nested values do not fit in a cell, store them as JSON
+        self._writer.writerow(
+            ['' if v is None else
+             json.dumps(v, sort_keys=True) if isinstance(v, (dict, list))
+             else v for v in row])
+
+
+def export_inventory(folder, path, properties, obj_type=vim.VirtualMachine,
+                     fmt=None, page_size=pc_extensions.DEFAULT_PAGE_SIZE):
+    """Stream the properties of every obj_type below folder to a file.
+
+    The first column is the object's id followed by one column per property
+    path, in the order given.
+
+    :type folder: vim.Folder
+    :param folder: the folder to export from.
+
+    :type path: types.StringTypes
+    :param path: the file to write, a .gz suffix compresses it.
+
+    :type properties: types.ListType
+    :param properties: property paths to export, for example \
+    'summary.config.numCpu'.
+
+    :type obj_type: type
+    :param obj_type: the managed object type to export.
+
+    :type fmt: types.StringTypes
+    :param fmt: 'jsonl' or 'csv', taken from path when None.
+
+    :type page_size: types.IntType
+    :param page_size: objects retrieved per round trip.
+
+    :rtype types.TupleType:
+    :return: the number of rows written and the seconds it took.
+
+    :raises ValueError: when the format is unknown.
+    """
+    fmt = fmt or _format_for(path)
+    if fmt not in FORMATS:
+        raise ValueError('unknown export format %s' % fmt)
+    properties = list(properties)
+    columns = ['id'] + properties
+
+    si = vim.ServiceInstance('ServiceInstance', folder._stub)
+    property_collector = si.content.propertyCollector
+
+    started = time.time()
+    rows = 0
+    with _open(path) as stream:
+        if fmt == 'jsonl':
+            writer = _JsonLinesWriter(stream, columns)
+        else:
+            writer = _CsvWriter(stream, columns)
+        for obj, props in pc_extensions.iter_properties(
+                property_collector, folder, obj_type, properties, page_size):
+            writer.write([obj.id] +
+                         [to_plain(props.get(p)) for p in properties])
+            rows += 1
+    return rows, time.time() - started
+
+
+vim.Folder.export_inventory = export_inventory
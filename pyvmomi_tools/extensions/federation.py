@@ -0,0 +1,288 @@
+# Copyright (c) 2014 VMware, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module implements searches and task waits across many vCenters.
+
+The folder and task helpers work against one session. A Federation holds
+one session per site, runs a query on every site at once and merges the
+results tagged with the site they came from, so a global lookup takes
+about as long as the slowest site instead of the sum of all of them. Task
+completions are tracked by one TaskMonitor per site behind a single
+FederatedTaskMonitor.
+
+code::
+    federation = Federation.connect(['vc1', 'vc2', 'vc3'], user, pwd)
+    for result in federation.find_all_by_name('web-01'):
+        print result.site, result.value
+
+    monitor = federation.task_monitor()
+    for result in federation.find_all_by_name('web-01'):
+        monitor.add(result.value.PowerOn(), on_done)
+    monitor.wait()
+    monitor.stop()
+    federation.close()
+
+When a site fails a query raises FederationError carrying the results of
+the sites that answered.
+"""
+__author__ = "VMware, Inc."
+
+import collections
+import threading
+from multiprocessing.pool import ThreadPool
+
+from pyVim import connect
+
+from pyvmomi_tools.extensions import folder as folder_extensions
+from pyvmomi_tools.extensions import task as task_extensions
+
+FederatedResult = collections.namedtuple('FederatedResult',
+                                         ['site', 'value'])
+
+
+class FederationError(Exception):
+    """Some sites failed a federated query.
+
+    results holds the FederatedResult list of the sites that answered and
+    errors the exception of each site that did not, by site name.
+    """
+
+    def __init__(self, results, errors):
+        Exception.__init__(self, '; '.join('%s: %s' % (site, errors[site])
+                                           for site in sorted(errors)))
+        self.results = results
+        self.errors = errors
+
+
+class Federation(object):
+    """One session per site, see the module docs."""
+
+    def __init__(self, sessions=None):
+        """
+        :type sessions: types.DictType
+        :param sessions: {site name: vim.ServiceInstance} to start with.
+        """
+        self._lock = threading.Lock()
+        self._sessions = collections.OrderedDict()
+        # stubs of sessions this federation logged in and must log out
+        self._owned = set()
+        for name, si in (sessions or {}).items():
+            self.add(name, si)
+
+    @classmethod
+    def connect(cls, hosts, user, pwd, port=443, **connect_kwargs):
+        """Log in to every host at once, naming each site by its host.
+
+        :type hosts: types.ListType
+        :param hosts: the vCenter host names.
+
+        :param connect_kwargs: passed on to SmartConnect.
+
+        :raises FederationError: when a login fails, the sessions that \
+        were made are logged out again.
+        """
+        federation = cls()
+
+        def login(host):
+            return connect.SmartConnect(host=host, user=user, pwd=pwd,
+                                        port=int(port), **connect_kwargs)
+
+        results, errors = _fan_out(hosts, login)
+        for host, si in results:
+            federation.add(host, si)
+            federation._owned.add(si._stub)
+        if errors:
+            federation.close()
+            raise FederationError([], errors)
+        return federation
+
+    def add(self, name, si):
+        """Add a site."""
+        with self._lock:
+            self._sessions[name] = si
+
+    @property
+    def sites(self):
+        """The site names in the order they were added."""
+        with self._lock:
+            return list(self._sessions)
+
+    def session(self, name):
+        """The vim.ServiceInstance of a site."""
+        with self._lock:
+            return self._sessions[name]
+
+    def site_of(self, managed_object):
+        """The name of the site a managed object belongs to, or None."""
+        with self._lock:
+            for name, si in self._sessions.items():
+                if si._stub is managed_object._stub:
+                    return name
+        return None
+
+    def map(self, function, *args, **kwargs):
+        """Call function(si, *args, **kwargs) on every site at once.
+
+        :rtype types.ListType: contains [<FederatedResult>] with the value \
+        function returned, in site order.
+
+        :raises FederationError: when function raised for a site.
+        """
+        with self._lock:
+            sessions = dict(self._sessions)
+            names = list(self._sessions)
+        results, errors = _fan_out(
+            names, lambda name: function(sessions[name], *args, **kwargs))
+        results = [FederatedResult(name, value) for name, value in results]
+        if errors:
+            raise FederationError(results, errors)
+        return results
+
+    def _each(self, function, *args, **kwargs):
+        # one FederatedResult per value of every site's list of values
+        def flatten(results):
+            return [FederatedResult(result.site, value)
+                    for result in results for value in result.value]
+
+        try:
+            return flatten(self.map(function, *args, **kwargs))
+        except FederationError as e:
+            raise FederationError(flatten(e.results), e.errors)
+
+    def find_by(self, matcher, *args, **kwargs):
+        """Folder.find_by from every site's root folder.
+
+        :rtype types.ListType: contains [<FederatedResult>]
+        """
+        # find_by is a generator, run it to the end on the site's thread
+        return self._each(lambda si: list(folder_extensions.find_by(
+            si.content.rootFolder, matcher, *args, **kwargs)))
+
+    def find_all_by_name(self, name, workers=None, types=None):
+        """Folder.find_all_by_name on every site.
+
+        :rtype types.ListType: contains [<FederatedResult>]
+        """
+        return self._each(lambda si: folder_extensions.find_all_by_name(
+            si.content.rootFolder, name, workers, types))
+
+    def find_by_name(self, name, workers=None, types=None):
+        """Folder.find_by_name on every site, sites without a match are
+        left out.
+
+        :rtype types.ListType: contains [<FederatedResult>]
+        """
+        def found(results):
+            return [r for r in results if r.value is not None]
+
+        try:
+            return found(self.map(
+                lambda si: folder_extensions.find_by_name(
+                    si.content.rootFolder, name, workers=workers,
+                    types=types)))
+        except FederationError as e:
+            raise FederationError(found(e.results), e.errors)
+
+    def task_monitor(self, max_wait_seconds=1, stats=None):
+        """A FederatedTaskMonitor over the sites, stop() it when done."""
+        return FederatedTaskMonitor(self, max_wait_seconds, stats)
+
+    def close(self):
+        """Log out the sessions this federation logged in."""
+        with self._lock:
+            owned = [si for si in self._sessions.values()
+                     if si._stub in self._owned]
+            self._owned.clear()
+        for si in owned:
+            connect.Disconnect(si)
+
+
+class FederatedTaskMonitor(object):
+    """Tracks tasks of any site, one TaskMonitor per site underneath.
+
+    Each site's monitor is created and started when the first task of that
+    site is added. Callbacks are called as callback(task, state, error)
+    from the thread of the task's site; Federation.site_of(task) tells the
+    site.
+    """
+
+    def __init__(self, federation, max_wait_seconds=1, stats=None):
+        self.federation = federation
+        self._max_wait_seconds = max_wait_seconds
+        self._stats = stats
+        self._lock = threading.Lock()
+        self._monitors = {}
+
+    def _monitor(self, site):
+        with self._lock:
+            monitor = self._monitors.get(site)
+            if monitor is None:
+                monitor = task_extensions.TaskMonitor(
+                    self.federation.session(site), self._max_wait_seconds,
+                    self._stats)
+                monitor.start()
+                self._monitors[site] = monitor
+            return monitor
+
+    def add(self, task, callback):
+        """Start tracking a task of any site, see TaskMonitor.add."""
+        site = self.federation.site_of(task)
+        if site is None:
+            raise ValueError('%s does not belong to a site of the '
+                             'federation' % task)
+        self._monitor(site).add(task, callback)
+
+    def __len__(self):
+        with self._lock:
+            monitors = list(self._monitors.values())
+        return sum(len(m) for m in monitors)
+
+    def wait(self):
+        """Block until every task added so far, on every site, completed.
+        """
+        with self._lock:
+            monitors = list(self._monitors.values())
+        for monitor in monitors:
+            monitor.wait()
+
+    def stop(self):
+        """Stop every site's monitor."""
+        with self._lock:
+            monitors, self._monitors = list(self._monitors.values()), {}
+        for monitor in monitors:
+            monitor.stop()
+
+
+def _fan_out(names, function):
+    # function(name) for every name at once, ([(name, value)], {name: error})
+    names = list(names)
+    if not names:
+        return [], {}
+
+    def call(name):
+        try:
+            return name, function(name), None
+        except Exception as e:
+            return name, None, e
+
+    pool = ThreadPool(len(names))
+    try:
+        outcomes = pool.map(call, names)
+    finally:
+        pool.terminate()
+    return ([(name, value) for name, value, error in outcomes
+             if error is None],
+            dict((name, error) for name, _, error in outcomes
+                 if error is not None))
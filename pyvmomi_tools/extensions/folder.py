@@ -18,7 +18,210 @@ pyvmomi library.
 """
 __author__ = "VMware, Inc."
 
+import math
+from multiprocessing.pool import ThreadPool
+
+from six.moves import queue
+
 from pyVmomi import vim
+from pyVmomi import vmodl
+
+from pyvmomi_tools.extensions import custom_fields
+from pyvmomi_tools.extensions import profiling
+
+# containers per RetrievePropertiesEx call in a parallel traversal
+DEFAULT_BATCH_SIZE = 50
+
+# A Datacenter's folders in the order the serial walk visits them last to
+# first, with the entity types that can live below each one.
+_DATACENTER_FOLDERS = [
+    ('datastoreFolder', (vim.Folder, vim.Datastore)),
+    ('hostFolder', (vim.Folder, vim.ComputeResource, vim.HostSystem)),
+    ('networkFolder', (vim.Folder, vim.Network,
+                       vim.DistributedVirtualSwitch)),
+    ('vmFolder', (vim.Folder, vim.VirtualMachine, vim.VirtualApp)),
+]
+
+# the path names of a Datacenter's folders, FindChild only sees the vm and
+# host folders as its children
+_DATACENTER_PATH_NAMES = {
+    'vm': 'vmFolder',
+    'host': 'hostFolder',
+    'datastore': 'datastoreFolder',
+    'network': 'networkFolder',
+}
+
+
+def _content(mobj):
+    si = vim.ServiceInstance('ServiceInstance', mobj._stub)
+    return si.content
+
+
+def _may_contain(reachable, types):
+    # True when an entity of one of types could be one of reachable
+    for reachable_type in reachable:
+        for target_type in types:
+            if (issubclass(reachable_type, target_type) or
+                    issubclass(target_type, reachable_type)):
+                return True
+    return False
+
+
+def _child_paths(types=None):
+    """The (container type, property path) pairs a search descends into.
+
+    Without types this is a Folder's childEntity and all four of a
+    Datacenter's folders. With types, Datacenter folders that cannot hold
+    those types are pruned, and vApps and compute resources are opened up
+    when virtual machines or hosts are wanted since that is where they live.
+    """
+    paths = [(vim.Folder, 'childEntity')]
+    for path, reachable in _DATACENTER_FOLDERS:
+        if not types or _may_contain(reachable, types):
+            paths.append((vim.Datacenter, path))
+    if types:
+        if _may_contain((vim.VirtualMachine, vim.VirtualApp), types):
+            paths.append((vim.VirtualApp, 'vm'))
+            paths.append((vim.VirtualApp, 'resourcePool'))
+        if _may_contain((vim.HostSystem,), types):
+            paths.append((vim.ComputeResource, 'host'))
+    return paths
+
+
+def _is_container(entity, paths):
+    for container_type, path in paths:
+        if isinstance(entity, container_type):
+            return True
+    return False
+
+
+def _child_traversal_specs(paths):
+    # one level deep traversal of each path
+    traversal_spec = vmodl.query.PropertyCollector.TraversalSpec
+    return [traversal_spec(name='%s_%s' % (container_type.__name__, path),
+                           type=container_type, path=path, skip=False)
+            for container_type, path in paths]
+
+
+def _children(property_collector, containers, paths):
+    """Fetch the children of containers and their names in one round trip.
+
+    :rtype types.ListType: contains [(<vim.ManagedEntity>, name)]
+    """
+    collector = vmodl.query.PropertyCollector
+    select_set = _child_traversal_specs(paths)
+    obj_specs = [collector.ObjectSpec(obj=c, skip=True, selectSet=select_set)
+                 for c in containers]
+    prop_spec = collector.PropertySpec(type=vim.ManagedEntity,
+                                       pathSet=['name'])
+    filter_spec = collector.FilterSpec(objectSet=obj_specs,
+                                       propSet=[prop_spec])
+
+    children = []
+    with profiling.span('find_by.children', containers=len(containers)) as s:
+        result = property_collector.RetrievePropertiesEx(
+            [filter_spec], collector.RetrieveOptions())
+        while result:
+            for obj_content in result.objects:
+                name = None
+                for prop in obj_content.propSet or []:
+                    name = prop.val
+                children.append((obj_content.obj, name))
+            if not result.token:
+                break
+            result = property_collector.ContinueRetrievePropertiesEx(
+                result.token)
+        s.set(children=len(children))
+    return children
+
+
+def _parallel_find_by(folder, matcher, workers, batch_size, types=None,
+                      names=False):
+    """Breadth first search expanding sibling subtrees on a thread pool.
+
+    matcher is called as matcher(entity, name) from the worker threads.
+    Matches are streamed to the caller as they are found, as (entity, name)
+    pairs with names, closing the generator stops the traversal.
+    """
+    property_collector = _content(folder).propertyCollector
+    paths = _child_paths(types)
+    results = queue.Queue()
+
+    def expand(containers, parent):
+        try:
+            found, frontier = [], []
+            with profiling.span('find_by.expand', parent=parent,
+                                containers=len(containers)):
+                for entity, name in _children(property_collector,
+                                              containers, paths):
+                    if not types or isinstance(entity, types):
+                        with profiling.span('find_by.matcher'):
+                            matched = matcher(entity, name)
+                        if matched:
+                            found.append((entity, name) if names
+                                         else entity)
+                            continue
+                    if _is_container(entity, paths):
+                        frontier.append(entity)
+            results.put((found, frontier, None))
+        except Exception as e:
+            results.put((None, None, e))
+
+    pool = ThreadPool(workers)
+    pending = [0]
+    # the caller runs between yields, so this span is kept off its stack
+    traversal = profiling.span('find_by', detached=True, workers=workers)
+
+    def submit(containers):
+        # spread narrow frontiers over the workers, cap wide ones by batch
+        size = int(math.ceil(len(containers) / float(workers)))
+        size = max(1, min(batch_size, size))
+        for i in range(0, len(containers), size):
+            pool.apply_async(expand, (containers[i:i + size], traversal.id))
+            pending[0] += 1
+
+    try:
+        with traversal:
+            submit([folder])
+            while pending[0]:
+                found, frontier, error = results.get()
+                pending[0] -= 1
+                if error is not None:
+                    raise error
+                submit(frontier)
+                for entity in found:
+                    yield entity
+    finally:
+        pool.terminate()
+
+
+def _serial_find_by(folder, matcher_method, types, names, *args, **kwargs):
+    paths = _child_paths(types)
+    # copy, the list pyVmomi hands back must not be consumed in place
+    entity_stack = list(folder.childEntity)
+
+    while entity_stack:
+        entity = entity_stack.pop()
+        if not types or isinstance(entity, types):
+            if names:
+                name = entity.name
+                with profiling.span('find_by.matcher'):
+                    matched = matcher_method(entity, name, *args, **kwargs)
+            else:
+                with profiling.span('find_by.matcher'):
+                    matched = matcher_method(entity, *args, **kwargs)
+            if matched:
+                yield (entity, name) if names else entity
+                continue
+        for container_type, path in paths:
+            if isinstance(entity, container_type):
+                with profiling.span('find_by.children', path=path):
+                    children = getattr(entity, path)
+                # a Datacenter's folders are single references
+                if isinstance(children, list):
+                    entity_stack.extend(children)
+                elif children is not None:
+                    entity_stack.append(children)
 
 
 def find_by(folder, matcher_method, *args, **kwargs):
@@ -44,6 +247,43 @@ def find_by(folder, matcher_method, *args, **kwargs):
             print entity
             # do stuff...
 
+    Type pruning:
+    =============
+
+    code::
+        for vm in folder.find_by(matcher, types=[vim.VirtualMachine]):
+            print vm
+
+    Passing types only calls the matcher on entities of those types and only
+    descends into branches that can hold them. For virtual machines that is
+    the vmFolder trees plus vApps, for hosts the hostFolder trees plus
+    compute resources.
+
+    Parallel traversal:
+    ===================
+
+    code::
+        for entity in folder.find_by(matcher, workers=8):
+            print entity
+
+    Passing workers expands sibling subtrees concurrently on a thread pool
+    of that size. Each worker fetches the children of a batch of containers
+    in a single property collector call and runs the matcher on them, so
+    the matcher must be thread safe. Matches stream back in no particular
+    order as they are found.
+
+    Names:
+    ======
+
+    code::
+        for vm, name in folder.find_by(lambda e, name: name.startswith('w'),
+                                       names=True, workers=8):
+            print name
+
+    Passing names=True hands the matcher each entity's name as its second
+    argument and yields (entity, name) pairs. A parallel traversal fetches
+    the names with the children, the serial walk reads them one by one.
+
     :type folder: vim.Folder
     :param folder: The top most folder to recursively search for the child.
 
@@ -51,27 +291,43 @@ def find_by(folder, matcher_method, *args, **kwargs):
     :param matcher_method: Method to call to examine the entity it must \
     return a True value on match.
 
+    :type types: types.ListType
+    :param types: keyword only, the vim.ManagedEntity subclasses to look \
+    for. The default None examines every entity.
+
+    :type workers: types.IntType
+    :param workers: keyword only, the number of traversal threads. The \
+    default None walks the tree serially.
+
+    :type batch_size: types.IntType
+    :param batch_size: keyword only, the most containers a worker expands \
+    per call in a parallel traversal.
+
+    :type names: types.BooleanType
+    :param names: keyword only, pass names to the matcher and yield \
+    (entity, name) pairs.
+
     :rtype generator:
     :return: generator that produces vm.ManagedObject items.
     """
-    entity_stack = folder.childEntity
+    types = kwargs.pop('types', None)
+    workers = kwargs.pop('workers', None)
+    batch_size = kwargs.pop('batch_size', DEFAULT_BATCH_SIZE)
+    names = kwargs.pop('names', False)
+    if types:
+        types = tuple(types)
+    if workers:
+        def matcher(entity, name):
+            if names:
+                return matcher_method(entity, name, *args, **kwargs)
+            return matcher_method(entity, *args, **kwargs)
+        return _parallel_find_by(folder, matcher, workers, batch_size, types,
+                                 names)
+    return _serial_find_by(folder, matcher_method, types, names, *args,
+                           **kwargs)
 
-    while entity_stack:
-        entity = entity_stack.pop()
-        if matcher_method(entity, *args, **kwargs):
-            yield entity
-        elif isinstance(entity, vim.Datacenter):
-            # add this vim.DataCenter's folders to our search
-            entity_stack.append(entity.datastoreFolder)
-            entity_stack.append(entity.hostFolder)
-            entity_stack.append(entity.networkFolder)
-            entity_stack.append(entity.vmFolder)
-        elif hasattr(entity, 'childEntity'):
-            # add all child entities from this object to our search
-            entity_stack.extend(entity.childEntity)
-
-
-def find_all_by_name(folder, name):
+
+def find_all_by_name(folder, name, workers=None, types=None):
     """Search for all entities with name.
 
     This method will search within the folder for any object with the name
@@ -83,34 +339,285 @@ def find_all_by_name(folder, name):
     :type name: types.StringTypes
     :param name: Name of the child you are looking for, assumed to be unique.
 
+    :type workers: types.IntType
+    :param workers: search with a parallel traversal of this many threads.
+
+    :type types: types.ListType
+    :param types: only look for entities of these types.
+
     :rtype types.ListType: contains [<vim.ManagedEntity>]
     :return: all the entities found with the name 'name'.
     """
+    if types:
+        types = tuple(types)
+
+    if workers:
+        # names come back with the traversal, no per entity name fetch
+        return list(_parallel_find_by(folder, lambda e, n: n == name,
+                                      workers, DEFAULT_BATCH_SIZE, types))
+
     # return all entities by running the generator to it's end
-    return list(find_by(folder, lambda e: e.name == name))
+    return list(find_by(folder, lambda e: e.name == name, types=types))
 
 
-def find_by_name(folder, name):
+def find_by_name(folder, name, path=False, workers=None, types=None):
     """Search for an entity by name.
 
     This method will search within the folder for an object with the name
     supplied.
 
+    With path=True the name is read as a '/' separated inventory path
+    relative to the folder, for example 'dc/vm/folder/name', and only the
+    named branch is walked. See find_by_path.
+
     :type folder: vim.Folder
     :param folder: The top most folder to recursively search for the child.
 
     :type name: types.StringTypes
     :param name: Name of the child you are looking for, assumed to be unique.
 
+    :type path: types.BooleanType
+    :param path: treat name as an inventory path.
+
+    :type workers: types.IntType
+    :param workers: search with a parallel traversal of this many threads, \
+    the traversal stops at the first match.
+
+    :type types: types.ListType
+    :param types: only look for entities of these types.
+
     :rtype vim.ManagedEntity:
     :return: the one entity or None if no entity found.
     """
+    if path:
+        return find_by_path(folder, name)
+
+    if types:
+        types = tuple(types)
+
+    if workers:
+        entities = _parallel_find_by(folder, lambda e, n: n == name,
+                                     workers, DEFAULT_BATCH_SIZE, types)
+        try:
+            for entity in entities:
+                return entity
+        finally:
+            entities.close()
+        # nothing found, the serial walk would find nothing either
+        return None
+
     # return only the first entity...
-    for entity in find_by(folder, lambda e: e.name == name):
+    for entity in find_by(folder, lambda e: e.name == name, types=types):
+        return entity
+
+
+def _search_index(folder):
+    return _content(folder).searchIndex
+
+
+def _is_root(folder):
+    return folder.parent is None
+
+
+def _contains(folder, entity):
+    # walk up from entity, VMs inside a vApp hang off parentVApp instead
+    while entity is not None:
+        if entity.id == folder.id:
+            return True
+        parent = entity.parent
+        if parent is None and isinstance(entity, vim.VirtualMachine):
+            parent = entity.parentVApp
+        entity = parent
+    return False
+
+
+def _scoped(folder, entities):
+    # the search index covers the whole inventory, drop anything that does
+    # not live under folder. The root folder contains everything.
+    if _is_root(folder):
+        return [e for e in entities if e is not None]
+    return [e for e in entities if e is not None and _contains(folder, e)]
+
+
+def _first(entities):
+    for entity in entities:
         return entity
 
 
+def find_by_path(folder, path):
+    """Find an entity by its inventory path relative to folder.
+
+    The path is made of entity names separated by '/', a Datacenter's
+    folders are named 'vm', 'host', 'datastore' and 'network'. From the root
+    folder this is a single FindByInventoryPath call, otherwise one FindChild
+    call, or one read of a Datacenter's folder, is made per path element.
+
+    code::
+        vm = root_folder.find_by_path('dc/vm/folder/name')
+
+    :type folder: vim.Folder
+    :param folder: the folder the path starts at.
+
+    :type path: types.StringTypes
+    :param path: the inventory path, e.g. 'dc/vm/folder/name'.
+
+    :rtype vim.ManagedEntity:
+    :return: the entity or None if nothing is at the path.
+    """
+    search_index = _search_index(folder)
+    names = [n for n in path.split('/') if n]
+    if _is_root(folder):
+        return search_index.FindByInventoryPath('/'.join(names))
+
+    entity = folder
+    for name in names:
+        if isinstance(entity, vim.Datacenter) and \
+                name in _DATACENTER_PATH_NAMES:
+            entity = getattr(entity, _DATACENTER_PATH_NAMES[name])
+        else:
+            entity = search_index.FindChild(entity, name)
+        if entity is None:
+            return None
+    return entity
+
+
+def find_by_uuid(folder, uuid, vm_search=True, instance_uuid=False):
+    """Find a virtual machine or host by its uuid.
+
+    Backed by SearchIndex.FindByUuid from the root folder, or FindAllByUuid
+    when the result must be checked against a sub-folder.
+
+    :type folder: vim.Folder
+    :param folder: the folder to search within.
+
+    :type uuid: types.StringTypes
+    :param uuid: the BIOS uuid, or instance uuid when instance_uuid is True.
+
+    :type vm_search: types.BooleanType
+    :param vm_search: True for virtual machines, False for hosts.
+
+    :type instance_uuid: types.BooleanType
+    :param instance_uuid: search virtual machines by instance uuid.
+
+    :rtype vim.ManagedEntity:
+    :return: the entity or None if no entity found.
+    """
+    if _is_root(folder):
+        return _search_index(folder).FindByUuid(None, uuid, vm_search,
+                                                instance_uuid)
+    return _first(find_all_by_uuid(folder, uuid, vm_search, instance_uuid))
+
+
+def find_all_by_uuid(folder, uuid, vm_search=True, instance_uuid=False):
+    """Find all virtual machines or hosts with a uuid.
+
+    :type folder: vim.Folder
+    :param folder: the folder to search within.
+
+    :type uuid: types.StringTypes
+    :param uuid: the BIOS uuid, or instance uuid when instance_uuid is True.
+
+    :type vm_search: types.BooleanType
+    :param vm_search: True for virtual machines, False for hosts.
+
+    :type instance_uuid: types.BooleanType
+    :param instance_uuid: search virtual machines by instance uuid.
+
+    :rtype types.ListType: contains [<vim.ManagedEntity>]
+    :return: all the entities found with the uuid.
+    """
+    entities = _search_index(folder).FindAllByUuid(None, uuid, vm_search,
+                                                   instance_uuid)
+    return _scoped(folder, entities)
+
+
+def find_by_ip(folder, ip, vm_search=True):
+    """Find a virtual machine or host by ip address.
+
+    Virtual machines are only found by ip when VMware Tools is running.
+
+    :type folder: vim.Folder
+    :param folder: the folder to search within.
+
+    :type ip: types.StringTypes
+    :param ip: the ip address.
+
+    :type vm_search: types.BooleanType
+    :param vm_search: True for virtual machines, False for hosts.
+
+    :rtype vim.ManagedEntity:
+    :return: the entity or None if no entity found.
+    """
+    search_index = _search_index(folder)
+    if _is_root(folder):
+        return search_index.FindByIp(None, ip, vm_search)
+    return _first(_scoped(folder, search_index.FindAllByIp(None, ip,
+                                                           vm_search)))
+
+
+def find_by_dns_name(folder, dns_name, vm_search=True):
+    """Find a virtual machine or host by its fully qualified dns name.
+
+    Virtual machines are only found by dns name when VMware Tools is running.
+
+    :type folder: vim.Folder
+    :param folder: the folder to search within.
+
+    :type dns_name: types.StringTypes
+    :param dns_name: the fully qualified dns name.
+
+    :type vm_search: types.BooleanType
+    :param vm_search: True for virtual machines, False for hosts.
+
+    :rtype vim.ManagedEntity:
+    :return: the entity or None if no entity found.
+    """
+    search_index = _search_index(folder)
+    if _is_root(folder):
+        return search_index.FindByDnsName(None, dns_name, vm_search)
+    return _first(_scoped(folder, search_index.FindAllByDnsName(None,
+                                                                dns_name,
+                                                                vm_search)))
+
+
+def find_by_custom_value(folder, name, value, obj_type=None):
+    """Find the entities below folder with a custom attribute set to value.
+
+    Answered from the session's shared custom_fields index, built with one
+    bulk retrieval on first use and kept current from its update stream.
+    The index also tracks parents, so limiting the result to folder takes
+    no round trips.
+
+    code::
+        vms = root_folder.find_by_custom_value('owner', 'alice',
+                                               vim.VirtualMachine)
+
+    :type folder: vim.Folder
+    :param folder: the folder to search below.
+
+    :type name: types.StringTypes
+    :param name: the custom attribute name.
+
+    :type value: types.StringTypes
+    :param value: the exact value.
+
+    :type obj_type: type
+    :param obj_type: only entities of this type.
+
+    :rtype types.ListType: contains [<vim.ManagedEntity>]
+    """
+    si = vim.ServiceInstance('ServiceInstance', folder._stub)
+    index = custom_fields.custom_attribute_index(si)
+    return index.find(name, value, obj_type, container=folder)
+
+
 # injection into the core vim.Folder class....
 vim.Folder.find_by = find_by
 vim.Folder.find_by_name = find_by_name
 vim.Folder.find_all_by_name = find_all_by_name
+vim.Folder.find_by_path = find_by_path
+vim.Folder.find_by_uuid = find_by_uuid
+vim.Folder.find_all_by_uuid = find_all_by_uuid
+vim.Folder.find_by_ip = find_by_ip
+vim.Folder.find_by_dns_name = find_by_dns_name
+vim.Folder.find_by_custom_value = find_by_custom_value
@@ -0,0 +1,367 @@
+# Copyright (c) 2014 VMware, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module implements bulk file transfers to and from virtual machine
+guests.
+
+Each guest transfer is a SOAP call returning a URL on the ESXi host, then an
+HTTP PUT or GET of the data. HostConnectionPool keeps keep-alive
+connections per host, streams the data in chunks so files never have to fit
+in memory and caps the transfers running against each host.
+transfer_files runs many transfers at once over one pool.
+
+code::
+    auth = vim.vm.guest.NamePasswordAuthentication(username='root',
+                                                   password='secret')
+    vm.upload_to_guest(auth, 'setup.sh', '/tmp/setup.sh')
+
+    results = transfer_files([GuestTransfer(vm, auth, UPLOAD, 'setup.sh',
+                                            '/tmp/setup.sh')
+                              for vm in vms], max_per_host=4)
+
+The pool only speaks HTTP(S) to the URLs it is given, so it can be tried
+against any local HTTP server.
+"""
+__author__ = "VMware, Inc."
+
+import collections
+import contextlib
+import os
+import socket
+import tempfile
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+from six.moves import http_client
+from six.moves.urllib.parse import urlsplit
+
+from pyVmomi import vim
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+DEFAULT_MAX_PER_HOST = 4
+
+UPLOAD = 'upload'
+DOWNLOAD = 'download'
+
+GuestTransfer = collections.namedtuple('GuestTransfer',
+                                       ['vm', 'auth', 'direction',
+                                        'local_path', 'guest_path'])
+TransferResult = collections.namedtuple('TransferResult',
+                                        ['transfer', 'size', 'seconds',
+                                         'error'])
+
+
+class GuestTransferError(Exception):
+    """The host refused a guest file transfer."""
+
+    def __init__(self, url, status, reason, body=b''):
+        Exception.__init__(self, 'HTTP %s %s for %s: %s' %
+                           (status, reason, url.split('?')[0],
+                            body[:200].decode('utf-8', 'replace')))
+        self.status = status
+
+
+# errors of a kept alive connection the server has since closed
+_STALE = (http_client.BadStatusLine, http_client.CannotSendRequest,
+          socket.error)
+
+
+class HostConnectionPool(object):
+    """Keep-alive HTTP connections per host with a per host limit.
+
+    Thread safe. At most max_per_host requests run against one host at a
+    time, further requests wait for a connection to come back.
+    """
+
+    def __init__(self, max_per_host=DEFAULT_MAX_PER_HOST, timeout=60,
+                 ssl_context=None):
+        """
+        :type max_per_host: types.IntType
+        :param max_per_host: the most concurrent requests per host.
+
+        :type timeout: types.IntType
+        :param timeout: socket timeout in seconds.
+
+        :type ssl_context: ssl.SSLContext
+        :param ssl_context: for https, e.g. the connection's own context to \
+        accept the same certificates.
+        """
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.ssl_context = ssl_context
+        self._lock = threading.Lock()
+        # (scheme, host, port) -> [idle connection]
+        self._idle = {}
+        self._limits = {}
+        self.connections_opened = 0
+
+    def _connect(self, key):
+        scheme, host, port = key
+        with self._lock:
+            self.connections_opened += 1
+        if scheme == 'https':
+            return http_client.HTTPSConnection(host, port,
+                                               timeout=self.timeout,
+                                               context=self.ssl_context)
+        return http_client.HTTPConnection(host, port, timeout=self.timeout)
+
+    @contextlib.contextmanager
+    def _slot(self, key):
+        with self._lock:
+            limit = self._limits.get(key)
+            if limit is None:
+                limit = threading.BoundedSemaphore(self.max_per_host)
+                self._limits[key] = limit
+        limit.acquire()
+        try:
+            yield
+        finally:
+            limit.release()
+
+    def _request(self, url, send, receive):
+        # send(conn, path) writes the request, receive(response) reads it
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.hostname,
+               parts.port or (443 if parts.scheme == 'https' else 80))
+        path = parts.path + ('?' + parts.query if parts.query else '')
+        with self._slot(key):
+            with self._lock:
+                idle = self._idle.get(key)
+                conn = idle.pop() if idle else None
+            reused = conn is not None
+            while True:
+                if conn is None:
+                    conn = self._connect(key)
+                try:
+                    send(conn, path)
+                    response = conn.getresponse()
+                except _STALE:
+                    conn.close()
+                    if not reused:
+                        raise
+                    # retry once on a new connection
+                    conn, reused = None, False
+                    continue
+                try:
+                    result = receive(response)
+                except Exception:
+                    conn.close()
+                    raise
+                with self._lock:
+                    self._idle.setdefault(key, []).append(conn)
+                return result
+
+    def put(self, url, source, size, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Stream size bytes from source to url with an HTTP PUT.
+
+        :type source: file
+        :param source: a binary file object, seekable to allow a retry.
+
+        :rtype types.IntType:
+        :return: the bytes sent.
+        """
+        start = source.tell()
+
+        def send(conn, path):
+            source.seek(start)
+            conn.putrequest('PUT', path, skip_accept_encoding=True)
+            conn.putheader('Content-Type', 'application/octet-stream')
+            conn.putheader('Content-Length', str(size))
+            conn.endheaders()
+            remaining = size
+            while remaining > 0:
+                chunk = source.read(min(chunk_size, remaining))
+                if not chunk:
+                    raise IOError('%s ended %d bytes early' %
+                                  (getattr(source, 'name', 'source'),
+                                   remaining))
+                conn.send(chunk)
+                remaining -= len(chunk)
+
+        def receive(response):
+            body = response.read()
+            if response.status >= 300:
+                raise GuestTransferError(url, response.status,
+                                         response.reason, body)
+            return size
+
+        return self._request(url, send, receive)
+
+    def get(self, url, destination, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Stream the body of an HTTP GET of url into destination.
+
+        :type destination: file
+        :param destination: a binary file object.
+
+        :rtype types.IntType:
+        :return: the bytes received.
+        """
+        start = destination.tell()
+
+        def send(conn, path):
+            conn.request('GET', path)
+
+        def receive(response):
+            if response.status >= 300:
+                raise GuestTransferError(url, response.status,
+                                         response.reason, response.read())
+            destination.seek(start)
+            received = 0
+            while True:
+                chunk = response.read(chunk_size)
+                if not chunk:
+                    break
+                destination.write(chunk)
+                received += len(chunk)
+            return received
+
+        return self._request(url, send, receive)
+
+    def close(self):
+        """Close the idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for conn in connections:
+                conn.close()
+
+
+def _url(vm, url):
+    # ESXi answers with '*' for the host it was reached at
+    if '://*' in url:
+        host = vm._stub.host
+        if not host.endswith(']'):
+            host = host.rsplit(':', 1)[0]
+        url = url.replace('://*', '://' + host, 1)
+    return url
+
+
+# os.rename does not overwrite on Windows, os.replace is python 3 only
+_replace = getattr(os, 'replace', os.rename)
+
+
+def _file_manager(vm):
+    si = vim.ServiceInstance('ServiceInstance', vm._stub)
+    return si.content.guestOperationsManager.fileManager
+
+
+def _pool_for(vm, pool, max_per_host=DEFAULT_MAX_PER_HOST):
+    if pool is not None:
+        return pool
+    scheme_args = getattr(vm._stub, 'schemeArgs', None) or {}
+    return HostConnectionPool(max_per_host,
+                              ssl_context=scheme_args.get('context'))
+
+
+def upload_to_guest(vm, auth, local_path, guest_path, overwrite=True,
+                    pool=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Copy a local file into the guest.
+
+    :type auth: vim.vm.guest.GuestAuthentication
+    :param auth: the guest credentials.
+
+    :type pool: HostConnectionPool
+    :param pool: share connections between transfers, default a new pool.
+
+    :rtype types.IntType:
+    :return: the bytes sent.
+    """
+    size = os.path.getsize(local_path)
+    url = _url(vm, _file_manager(vm).InitiateFileTransferToGuest(
+        vm, auth, guest_path, vim.vm.guest.FileManager.FileAttributes(),
+        size, overwrite))
+    with open(local_path, 'rb') as source:
+        return _pool_for(vm, pool).put(url, source, size, chunk_size)
+
+
+def download_from_guest(vm, auth, guest_path, local_path, pool=None,
+                        chunk_size=DEFAULT_CHUNK_SIZE):
+    """Copy a file out of the guest, see upload_to_guest.
+
+    The file is written next to local_path and renamed over it once the
+    transfer completes, a failed transfer leaves local_path untouched.
+
+    :rtype types.IntType:
+    :return: the bytes received.
+    """
+    info = _file_manager(vm).InitiateFileTransferFromGuest(vm, auth,
+                                                           guest_path)
+    directory, name = os.path.split(os.path.abspath(local_path))
+    fd, partial_path = tempfile.mkstemp(prefix='.' + name + '.',
+                                        suffix='.part', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as destination:
+            size = _pool_for(vm, pool).get(_url(vm, info.url), destination,
+                                           chunk_size)
+        _replace(partial_path, local_path)
+    except BaseException:
+        os.remove(partial_path)
+        raise
+    return size
+
+
+def transfer_files(transfers, max_per_host=DEFAULT_MAX_PER_HOST, workers=16,
+                   pool=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Run many guest transfers at once.
+
+    :type transfers: types.ListType
+    :param transfers: GuestTransfer tuples.
+
+    :type max_per_host: types.IntType
+    :param max_per_host: the most transfers against one ESXi host at once, \
+    when no pool is given.
+
+    :type workers: types.IntType
+    :param workers: the most transfers at once overall.
+
+    :rtype types.ListType: contains [<TransferResult>] in the order given
+    """
+    transfers = list(transfers)
+    if not transfers:
+        return []
+    own_pool = pool is None
+    pool = _pool_for(transfers[0].vm, pool, max_per_host)
+
+    def run(transfer):
+        started = time.time()
+        try:
+            if transfer.direction == UPLOAD:
+                size = upload_to_guest(transfer.vm, transfer.auth,
+                                       transfer.local_path,
+                                       transfer.guest_path, pool=pool,
+                                       chunk_size=chunk_size)
+            else:
+                size = download_from_guest(transfer.vm, transfer.auth,
+                                           transfer.guest_path,
+                                           transfer.local_path, pool=pool,
+                                           chunk_size=chunk_size)
+            return TransferResult(transfer, size, time.time() - started,
+                                  None)
+        except Exception as e:
+            return TransferResult(transfer, None, time.time() - started, e)
+
+    threads = ThreadPool(min(workers, len(transfers)))
+    try:
+        return threads.map(run, transfers)
+    finally:
+        threads.terminate()
+        if own_pool:
+            pool.close()
+
+
+# NOTE: This kind of injection usually goes at the *bottom* of a file.
+vim.VirtualMachine.upload_to_guest = upload_to_guest
+vim.VirtualMachine.download_from_guest = download_from_guest
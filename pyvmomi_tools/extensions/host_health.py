@@ -0,0 +1,262 @@
+# Copyright (c) 2014 VMware, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module implements fleet wide host health sweeps.
+
+Touching runtime, summary.quickStats and overallStatus host by host costs
+several round trips per host. A HostHealthSweeper retrieves just the
+properties it needs for every host below a container in one paged
+retrieval, derives each host's health with array operations over the whole
+fleet and compares the result with its previous sweep, so only the hosts
+that changed are reported. Requires numpy.
+
+code::
+    sweeper = HostHealthSweeper(si)
+    while True:
+        for change in sweeper.sweep():
+            print change.name, change.field, change.old, change.new
+        time.sleep(300)
+
+Health is 'critical' when overallStatus is red, the host is not connected
+or its CPU or memory usage is at or above the critical ratio, 'warning'
+when overallStatus is yellow or gray or usage is at or above the warning
+ratio, and 'ok' otherwise.
+"""
+__author__ = "VMware, Inc."
+
+import collections
+
+from pyVmomi import vim
+
+from pyvmomi_tools.extensions import property_collector
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+HEALTH = ('ok', 'warning', 'critical')
+OK, WARNING, CRITICAL = range(len(HEALTH))
+
+STATUS = ('green', 'yellow', 'red', 'gray')
+CONNECTION_STATES = ('connected', 'notResponding', 'disconnected')
+
+_PATHS = ['name', 'overallStatus', 'runtime.connectionState',
+          'runtime.inMaintenanceMode', 'summary.quickStats.overallCpuUsage',
+          'summary.quickStats.overallMemoryUsage',
+          'summary.quickStats.uptime', 'summary.hardware.cpuMhz',
+          'summary.hardware.numCpuCores', 'summary.hardware.memorySize']
+
+# the columns compared between sweeps
+DIFF_FIELDS = ('health', 'overall_status', 'connection_state',
+               'in_maintenance')
+
+HealthChange = collections.namedtuple('HealthChange',
+                                      ['host', 'name', 'field', 'old',
+                                       'new'])
+HealthChange.__doc__ = """A host whose health changed between sweeps.
+
+field is one of DIFF_FIELDS, or 'host' with old or new None for a host that
+appeared or disappeared.
+"""
+
+
+def _code(value, names):
+    # the index of a string enum value, len(names) when unknown
+    try:
+        return names.index(str(value))
+    except ValueError:
+        return len(names)
+
+
+class HealthSweep(object):
+    """One sweep over the fleet as parallel arrays, one row per host.
+
+    hosts, ids and names are lists; overall_status and connection_state
+    are codes into STATUS and CONNECTION_STATES, in_maintenance is bool,
+    cpu_ratio and memory_ratio are usage over capacity (NaN when unknown)
+    and health is a code into HEALTH.
+    """
+
+    def __init__(self, rows, cpu_warning, cpu_critical, memory_warning,
+                 memory_critical):
+        self.hosts = [host for host, _ in rows]
+        self.ids = [host.id for host in self.hosts]
+        self.names = [props.get('name') for _, props in rows]
+
+        def column(path, default):
+            return [props.get(path, default) for _, props in rows]
+
+        self.overall_status = numpy.array(
+            [_code(s, STATUS) for s in column('overallStatus', None)],
+            dtype=numpy.int8)
+        self.connection_state = numpy.array(
+            [_code(s, CONNECTION_STATES)
+             for s in column('runtime.connectionState', None)],
+            dtype=numpy.int8)
+        self.in_maintenance = numpy.array(
+            column('runtime.inMaintenanceMode', False), dtype=bool)
+        self.uptime = numpy.array(
+            column('summary.quickStats.uptime', numpy.nan), dtype=float)
+
+        cpu_used = numpy.array(
+            column('summary.quickStats.overallCpuUsage', numpy.nan),
+            dtype=float)
+        cpu_capacity = (numpy.array(column('summary.hardware.cpuMhz', 0),
+                                    dtype=float) *
+                        numpy.array(column('summary.hardware.numCpuCores', 0),
+                                    dtype=float))
+        memory_used = numpy.array(
+            column('summary.quickStats.overallMemoryUsage', numpy.nan),
+            dtype=float)
+        memory_capacity = numpy.array(
+            column('summary.hardware.memorySize', 0),
+            dtype=float) / (1024 * 1024)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            self.cpu_ratio = numpy.where(cpu_capacity > 0,
+                                         cpu_used / cpu_capacity, numpy.nan)
+            self.memory_ratio = numpy.where(memory_capacity > 0,
+                                            memory_used / memory_capacity,
+                                            numpy.nan)
+
+        # comparisons with NaN are False, unknown usage is not a problem
+        with numpy.errstate(invalid='ignore'):
+            critical = ((self.overall_status == STATUS.index('red')) |
+                        (self.connection_state != 0) |
+                        (self.cpu_ratio >= cpu_critical) |
+                        (self.memory_ratio >= memory_critical))
+            warning = ((self.overall_status == STATUS.index('yellow')) |
+                       (self.overall_status == STATUS.index('gray')) |
+                       (self.cpu_ratio >= cpu_warning) |
+                       (self.memory_ratio >= memory_warning))
+        self.health = numpy.where(critical, CRITICAL,
+                                  numpy.where(warning, WARNING, OK)
+                                  ).astype(numpy.int8)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def counts(self):
+        """The number of hosts per health, {'ok': n, ...}."""
+        counts = numpy.bincount(self.health, minlength=len(HEALTH))
+        return dict((name, int(counts[i])) for i, name in enumerate(HEALTH))
+
+    def value(self, field, row):
+        """The readable value of field for a row."""
+        raw = getattr(self, field)[row]
+        if field == 'health':
+            return HEALTH[raw]
+        if field == 'overall_status':
+            return STATUS[raw] if raw < len(STATUS) else None
+        if field == 'connection_state':
+            return CONNECTION_STATES[raw] \
+                if raw < len(CONNECTION_STATES) else None
+        return raw.item() if hasattr(raw, 'item') else raw
+
+    def diff(self, previous):
+        """What changed since previous, hosts that did not change are
+        skipped.
+
+        :type previous: HealthSweep
+        :param previous: an earlier sweep, None reports nothing.
+
+        :rtype types.ListType: contains [<HealthChange>]
+        """
+        if previous is None:
+            return []
+        changes = []
+        previous_rows = dict((host_id, row)
+                             for row, host_id in enumerate(previous.ids))
+        rows, old_rows = [], []
+        for row, host_id in enumerate(self.ids):
+            old_row = previous_rows.pop(host_id, None)
+            if old_row is None:
+                changes.append(HealthChange(self.hosts[row], self.names[row],
+                                            'host', None,
+                                            self.value('health', row)))
+            else:
+                rows.append(row)
+                old_rows.append(old_row)
+        for old_row in sorted(previous_rows.values()):
+            changes.append(HealthChange(previous.hosts[old_row],
+                                        previous.names[old_row], 'host',
+                                        previous.value('health', old_row),
+                                        None))
+
+        rows = numpy.array(rows, dtype=int)
+        old_rows = numpy.array(old_rows, dtype=int)
+        for field in DIFF_FIELDS:
+            changed = (getattr(self, field)[rows] !=
+                       getattr(previous, field)[old_rows])
+            for i in numpy.nonzero(changed)[0]:
+                row, old_row = rows[i], old_rows[i]
+                changes.append(HealthChange(self.hosts[row], self.names[row],
+                                            field,
+                                            previous.value(field, old_row),
+                                            self.value(field, row)))
+        return changes
+
+
+class HostHealthSweeper(object):
+    """Sweeps all hosts below a container, see the module docs."""
+
+    def __init__(self, si, container=None, cpu_warning=0.85,
+                 cpu_critical=0.95, memory_warning=0.85,
+                 memory_critical=0.95,
+                 page_size=property_collector.DEFAULT_PAGE_SIZE):
+        """
+        :type si: vim.ServiceInstance
+        :param si: the connection.
+
+        :type container: vim.ManagedEntity
+        :param container: sweep the hosts below this, default the root \
+        folder.
+
+        :type cpu_warning: types.FloatType
+        :param cpu_warning: the CPU usage over capacity ratio that makes a \
+        host a warning, likewise for the other thresholds.
+
+        :raises ImportError: when numpy is not installed.
+        """
+        if numpy is None:
+            raise ImportError('HostHealthSweeper requires numpy')
+        self._pc = si.content.propertyCollector
+        self._container = container or si.content.rootFolder
+        self._thresholds = (cpu_warning, cpu_critical, memory_warning,
+                            memory_critical)
+        self._page_size = page_size
+        self.last = None
+
+    def collect(self):
+        """Retrieve and evaluate the fleet without comparing.
+
+        :rtype HealthSweep:
+        """
+        rows = list(self._pc.iter_properties(self._container,
+                                             vim.HostSystem, _PATHS,
+                                             self._page_size))
+        return HealthSweep(rows, *self._thresholds)
+
+    def sweep(self):
+        """Collect the fleet and return what changed since the last sweep.
+
+        The first sweep reports no changes, see self.last for the state.
+
+        :rtype types.ListType: contains [<HealthChange>]
+        """
+        current = self.collect()
+        changes = current.diff(self.last)
+        self.last = current
+        return changes
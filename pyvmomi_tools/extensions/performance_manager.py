@@ -0,0 +1,254 @@
+# Copyright (c) 2014 VMware, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module implements bulk statistics collection extensions for the
+vim.PerformanceManager object in the pyvmomi library.
+
+methods
+=======
+
+counter_ids
+-----------
+
+code::
+    perf_manager = si.content.perfManager
+    ids = perf_manager.counter_ids(['cpu.usage.average'])
+
+Maps dotted counter names (group.name.rollup) to counter ids. The counter
+table is fetched once per connection and cached.
+
+query_stats
+-----------
+
+code::
+    stats = perf_manager.query_stats(vms, ['cpu.usage.average',
+                                           'mem.active.average'],
+                                     max_sample=15)
+    print stats.values.shape   # (len(vms), 2, number of samples)
+
+Splits the entities into as few QueryPerf calls as the server allows, runs
+those calls on a thread pool and parses the CSV formatted results straight
+into a numpy array. Requires numpy.
+"""
+__author__ = "VMware, Inc."
+
+import collections
+import math
+import threading
+from multiprocessing.pool import ThreadPool
+
+from pyVmomi import vim
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# The vCenter advanced setting limiting the number of metrics (entities times
+# counters) a single QueryPerf call may ask for. A value <= 0 means no limit.
+MAX_QUERY_METRICS_KEY = 'config.vpxd.stats.maxQueryMetrics'
+DEFAULT_MAX_QUERY_METRICS = 256
+
+# counter tables keyed by (stub, moId) of the owning PerformanceManager
+_counter_cache = {}
+_counter_cache_lock = threading.Lock()
+
+
+PerfStats = collections.namedtuple('PerfStats',
+                                   ['entities', 'counters', 'timestamps',
+                                    'values'])
+PerfStats.__doc__ = """Statistics for many entities as a single array.
+
+values is a float numpy array shaped (entity, counter, time). Samples an
+entity did not report are NaN. timestamps is a numpy datetime64 array for
+the last axis.
+"""
+
+
+def _counter_name(counter):
+    return '%s.%s.%s' % (counter.groupInfo.key, counter.nameInfo.key,
+                         counter.rollupType)
+
+
+def counter_ids(perf_manager, names=None):
+    """Look up performance counter ids by name.
+
+    The first call per connection reads perf_manager.perfCounter and caches
+    the whole name to id table, later calls are answered locally.
+
+    :type perf_manager: vim.PerformanceManager
+    :param perf_manager: the performance manager for the connection.
+
+    :type names: types.ListType
+    :param names: dotted counter names such as 'cpu.usage.average', when
+    None the whole table is returned.
+
+    :rtype types.DictType:
+    :return: counter name to counter id.
+
+    :raises KeyError: when a name is not a known counter.
+    """
+    key = (perf_manager._stub, perf_manager.id)
+    with _counter_cache_lock:
+        table = _counter_cache.get(key)
+        if table is None:
+            table = dict((_counter_name(c), c.key)
+                         for c in perf_manager.perfCounter)
+            _counter_cache[key] = table
+
+    if names is None:
+        return dict(table)
+    return dict((name, table[name]) for name in names)
+
+
+def _max_query_metrics(perf_manager):
+    si = vim.ServiceInstance('ServiceInstance', perf_manager._stub)
+    try:
+        option = si.content.setting.QueryView(MAX_QUERY_METRICS_KEY)
+    except vim.fault.InvalidName:
+        return DEFAULT_MAX_QUERY_METRICS
+    if not option:
+        return DEFAULT_MAX_QUERY_METRICS
+    return int(option[0].value)
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _parse_timestamps(sample_info_csv):
+    # sampleInfoCSV is a flat "interval,timestamp,interval,timestamp..." list
+    if not sample_info_csv:
+        return []
+    return [t.rstrip('Z') for t in sample_info_csv.split(',')[1::2]]
+
+
+def query_stats(perf_manager, entities, counter_names, interval_id=20,
+                start_time=None, end_time=None, max_sample=None,
+                max_query_metrics=None, workers=4):
+    """Collect statistics for many entities into one numpy array.
+
+    Only the aggregate instance of each counter is collected. The entities
+    are split into chunks small enough for the server's maxQueryMetrics
+    limit, the counters too when there are more of them than the limit, and
+    the chunks are queried concurrently.
+
+    :type perf_manager: vim.PerformanceManager
+    :param perf_manager: the performance manager for the connection.
+
+    :type entities: types.ListType
+    :param entities: the vim.ManagedEntity objects to query.
+
+    :type counter_names: types.ListType
+    :param counter_names: dotted counter names such as 'cpu.usage.average'.
+
+    :type interval_id: types.IntType
+    :param interval_id: sampling period in seconds, 20 is real-time.
+
+    :type max_query_metrics: types.IntType
+    :param max_query_metrics: metrics allowed per QueryPerf call, read from
+    the server when None. A value <= 0 means no limit.
+
+    :type workers: types.IntType
+    :param workers: number of concurrent QueryPerf calls.
+
+    :rtype PerfStats:
+    :return: the collected statistics.
+
+    :raises ImportError: when numpy is not installed.
+    """
+    if numpy is None:
+        raise ImportError('query_stats requires numpy')
+
+    entities = list(entities)
+    counter_names = list(counter_names)
+    ids = counter_ids(perf_manager, counter_names)
+    if not entities or not counter_names:
+        return PerfStats(entities, counter_names,
+                         numpy.array([], dtype='datetime64[s]'),
+                         numpy.full((len(entities), len(counter_names), 0),
+                                    numpy.nan))
+    metric_ids = [vim.PerformanceManager.MetricId(counterId=ids[name],
+                                                  instance='')
+                  for name in counter_names]
+
+    if max_query_metrics is None:
+        max_query_metrics = _max_query_metrics(perf_manager)
+    if max_query_metrics > 0:
+        # more counters than the limit need several calls per entity
+        metric_chunks = list(_chunks(metric_ids, max_query_metrics))
+        chunks = [(entity_chunk, metric_chunk)
+                  for metric_chunk in metric_chunks
+                  for entity_chunk in _chunks(
+                      entities,
+                      max(1, max_query_metrics // len(metric_chunk)))]
+    else:
+        # no server limit, just spread the entities across the workers
+        chunk_size = max(1, int(math.ceil(len(entities) / float(workers))))
+        chunks = [(entity_chunk, metric_ids)
+                  for entity_chunk in _chunks(entities, chunk_size)]
+
+    def query(chunk):
+        entity_chunk, metric_chunk = chunk
+        specs = [vim.PerformanceManager.QuerySpec(entity=entity,
+                                                  metricId=metric_chunk,
+                                                  intervalId=interval_id,
+                                                  startTime=start_time,
+                                                  endTime=end_time,
+                                                  maxSample=max_sample,
+                                                  format='csv')
+                 for entity in entity_chunk]
+        return perf_manager.QueryPerf(querySpec=specs) or []
+
+    pool = ThreadPool(max(1, min(workers, len(chunks))))
+    try:
+        results = pool.map(query, chunks)
+    finally:
+        pool.close()
+        pool.join()
+
+    # first pass collects the time axis, the union of all sample times
+    metrics = [m for result in results for m in result]
+    samples = set()
+    for metric in metrics:
+        samples.update(_parse_timestamps(metric.sampleInfoCSV))
+    timestamps = sorted(samples)
+    time_index = dict((t, i) for i, t in enumerate(timestamps))
+    entity_index = dict((e.id, i) for i, e in enumerate(entities))
+    counter_index = dict((ids[name], i)
+                         for i, name in enumerate(counter_names))
+
+    values = numpy.full((len(entities), len(counter_names), len(timestamps)),
+                        numpy.nan)
+    for metric in metrics:
+        row = entity_index[metric.entity.id]
+        columns = [time_index[t]
+                   for t in _parse_timestamps(metric.sampleInfoCSV)]
+        for series in metric.value:
+            if not series.value:
+                continue
+            data = numpy.array(series.value.split(','), dtype=float)
+            # -1 is how the server reports a sample with no data
+            data[data == -1] = numpy.nan
+            values[row, counter_index[series.id.counterId], columns] = data
+
+    return PerfStats(entities, counter_names,
+                     numpy.array(timestamps, dtype='datetime64[s]'), values)
+
+
+vim.PerformanceManager.counter_ids = counter_ids
+vim.PerformanceManager.query_stats = query_stats
@@ -0,0 +1,253 @@
+# Copyright (c) 2014 VMware, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module implements a small workflow engine running the same steps on
+many managed entities at once.
+
+Chaining tasks with success callbacks works on one virtual machine at a
+time. A Pipeline declares the steps once, as a sequence or as a DAG, and
+runs them for every entity, different entities being at different steps at
+the same time. Each step may cap how many entities run it concurrently, a
+failed step only stops the entity it failed for, and task completions come
+from one shared TaskMonitor instead of a blocking wait per task.
+
+code::
+    def power_off(vm):
+        if vm.runtime.powerState == vim.VirtualMachinePowerState.poweredOn:
+            return vm.PowerOff()
+
+    pipeline = Pipeline.sequence([
+        Step('off', power_off),
+        Step('reconfigure',
+             lambda vm: vm.ReconfigVM_Task(vim.vm.ConfigSpec(numCPUs=2)),
+             concurrency=20),
+        Step('snapshot',
+             lambda vm: vm.CreateSnapshot('before', '', False, False),
+             concurrency=10),
+        Step('on', lambda vm: vm.PowerOn()),
+    ])
+    results = pipeline.run(vms)
+
+A step action takes the entity and returns a vim.Task to wait for, or None
+when there is nothing to wait for.
+"""
+__author__ = "VMware, Inc."
+
+import collections
+import time
+from multiprocessing.pool import ThreadPool
+
+from six.moves import queue
+
+from pyVmomi import vim
+
+from pyvmomi_tools.extensions import task as task_extensions
+
+EntityResult = collections.namedtuple('EntityResult',
+                                      ['entity', 'completed', 'failed_step',
+                                       'error', 'seconds'])
+EntityResult.__doc__ = """The outcome of a pipeline for one entity.
+
+completed lists the names of the steps that finished, failed_step and error
+are None unless a step failed, seconds is the time from the entity's first
+step starting to its last step ending.
+"""
+
+
+class Step(object):
+    """One named action in a pipeline.
+
+    :type name: types.StringTypes
+    :param name: unique within the pipeline.
+
+    :type action: types.FunctionType
+    :param action: called as action(entity), returns a vim.Task or None.
+
+    :type requires: types.ListType
+    :param requires: names of the steps that must complete first.
+
+    :type concurrency: types.IntType
+    :param concurrency: the most entities running this step at once, \
+    None for no limit.
+    """
+
+    def __init__(self, name, action, requires=(), concurrency=None):
+        self.name = name
+        self.action = action
+        self.requires = tuple(requires)
+        self.concurrency = concurrency
+
+
+class _EntityState(object):
+
+    def __init__(self, entity):
+        self.entity = entity
+        self.completed = []
+        self.started = set()
+        self.failed_step = None
+        self.error = None
+        self.began = None
+        self.ended = None
+
+
+class Pipeline(object):
+    """Runs a DAG of steps for many entities, see the module docs."""
+
+    def __init__(self, steps, workers=8, si=None):
+        """
+        :type steps: types.ListType
+        :param steps: the Step objects, any order.
+
+        :type workers: types.IntType
+        :param workers: threads calling step actions, the calls that start \
+        the tasks.
+
+        :type si: vim.ServiceInstance
+        :param si: the connection the tasks belong to, default GetSi().
+
+        :raises ValueError: for unknown requirements or a cycle.
+        """
+        self.steps = dict((step.name, step) for step in steps)
+        for step in steps:
+            for name in step.requires:
+                if name not in self.steps:
+                    raise ValueError('step %s requires unknown step %s' %
+                                     (step.name, name))
+        self.order = self._topological_order()
+        self.workers = workers
+        self.si = si
+
+    @classmethod
+    def sequence(cls, steps, **kwargs):
+        """A pipeline where each step requires the one before it."""
+        chained = []
+        previous = None
+        for step in steps:
+            requires = step.requires + ((previous,) if previous else ())
+            chained.append(Step(step.name, step.action, requires,
+                                step.concurrency))
+            previous = step.name
+        return cls(chained, **kwargs)
+
+    def _topological_order(self):
+        order, visiting, done = [], set(), set()
+
+        def visit(name):
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError('steps form a cycle through %s' % name)
+            visiting.add(name)
+            for required in self.steps[name].requires:
+                visit(required)
+            visiting.discard(name)
+            done.add(name)
+            order.append(name)
+
+        for name in sorted(self.steps):
+            visit(name)
+        return order
+
+    def run(self, entities):
+        """Run every step for every entity and wait for all to finish.
+
+        :type entities: types.ListType
+        :param entities: the managed entities to run the steps for.
+
+        :rtype types.ListType: contains [<EntityResult>]
+        :return: one result per entity, in the order given.
+        """
+        states = [_EntityState(entity) for entity in entities]
+        events = queue.Queue()
+        running = dict((name, 0) for name in self.order)
+        # per step, the entities whose requirements are met
+        ready = dict((name, collections.deque()) for name in self.order)
+        for index in range(len(states)):
+            self._queue_ready(states, index, ready)
+
+        monitor = task_extensions.TaskMonitor(self.si)
+        monitor.start()
+        pool = ThreadPool(self.workers)
+
+        def start(index, name):
+            state = states[index]
+
+            def done(task, task_state, error):
+                if task_state != vim.TaskInfo.State.success and error is None:
+                    error = RuntimeError('task %s did not succeed' % task)
+                events.put((index, name, error))
+
+            try:
+                task = self.steps[name].action(state.entity)
+                if task is None:
+                    events.put((index, name, None))
+                else:
+                    monitor.add(task, done)
+            except Exception as e:
+                events.put((index, name, e))
+
+        active = 0
+        try:
+            while True:
+                for name in self.order:
+                    limit = self.steps[name].concurrency
+                    while ready[name] and (limit is None or
+                                           running[name] < limit):
+                        index = ready[name].popleft()
+                        state = states[index]
+                        if state.failed_step is not None:
+                            # failed in another branch while this one waited
+                            continue
+                        if state.began is None:
+                            state.began = time.time()
+                        running[name] += 1
+                        active += 1
+                        pool.apply_async(start, (index, name))
+                if not active:
+                    break
+
+                index, name, error = events.get()
+                running[name] -= 1
+                active -= 1
+                state = states[index]
+                state.ended = time.time()
+                if error is not None:
+                    # isolate the failure, this entity takes no more steps,
+                    # and report the first of parallel failures
+                    if state.failed_step is None:
+                        state.failed_step = name
+                        state.error = error
+                else:
+                    state.completed.append(name)
+                    self._queue_ready(states, index, ready)
+        finally:
+            pool.terminate()
+            monitor.stop()
+
+        return [EntityResult(s.entity, s.completed, s.failed_step, s.error,
+                             (s.ended - s.began) if s.began else 0.0)
+                for s in states]
+
+    def _queue_ready(self, states, index, ready):
+        state = states[index]
+        if state.failed_step is not None:
+            return
+        completed = set(state.completed)
+        for name in self.order:
+            if name in state.started:
+                continue
+            if all(r in completed for r in self.steps[name].requires):
+                state.started.add(name)
+                ready[name].append(index)
@@ -0,0 +1,247 @@
+# Copyright (c) 2014 VMware, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module implements fanning work out over worker processes, each with
+its own vSphere session.
+
+Once the network is no longer the bottleneck bulk jobs are bound by
+pyVmomi's XML parsing, which threads cannot spread over cores. A
+ProcessExecutor starts worker processes that each log in once, splits the
+managed objects to work on into shards by their id and hands the shards to
+the workers. Managed objects cross the process boundary as (type, id)
+references and results come back as plain, picklable Record tuples.
+
+code::
+    def power_on(vm):
+        vm.PowerOn().wait()
+
+    with ProcessExecutor('vcenter', 'user', 'secret', processes=8) as pool:
+        for record in pool.map(power_on, vms):
+            if record.error:
+                print record.id, record.error
+
+        for record in pool.retrieve_properties(vms, ['name', 'summary']):
+            print record.id, record.value['name']
+
+Functions given to map run in the workers, so they must be defined at the
+top level of a module. They are called with the object resolved against
+the worker's own session; worker_si() returns that session.
+"""
+__author__ = "VMware, Inc."
+
+import collections
+import multiprocessing
+import multiprocessing.util
+import zlib
+
+from pyVim import connect
+from pyVmomi import vmodl
+from pyVmomi import VmomiSupport
+
+from pyvmomi_tools.extensions import export
+from pyvmomi_tools.extensions import property_collector
+
+DEFAULT_SHARDS_PER_PROCESS = 4
+
+Record = collections.namedtuple('Record', ['type', 'id', 'value', 'error'])
+Record.__doc__ = """The result of working on one managed object.
+
+type is the vmodl type name such as 'vim.VirtualMachine', value the plain
+result (see export.to_plain) and error a description of the exception
+raised, or None.
+"""
+
+# the session of the current worker process
+_worker_si = None
+
+
+def ref(managed_object):
+    """A picklable (type name, id) reference to a managed object."""
+    return (VmomiSupport.Type(managed_object).__name__, managed_object._moId)
+
+
+def resolve(reference, si):
+    """The managed object for a reference made by ref, bound to si."""
+    type_name, mo_id = reference
+    return VmomiSupport.GetVmodlType(type_name)(mo_id, si._stub)
+
+
+def worker_si():
+    """The session of the worker process a mapped function runs in."""
+    return _worker_si
+
+
+def shard(references, count):
+    """Split references into at most count shards by a hash of their id.
+
+    The same id always lands in the same shard, whatever the order.
+
+    :rtype types.ListType: contains lists of references
+    """
+    shards = [[] for _ in range(count)]
+    for reference in references:
+        index = zlib.crc32(reference[1].encode('utf-8')) & 0xffffffff
+        shards[index % count].append(reference)
+    return [s for s in shards if s]
+
+
+# the error of a Record for an object deleted before or during the work
+_DELETED = 'ManagedObjectNotFound: the object has been deleted'
+
+
+def _describe(error):
+    return '%s: %s' % (error.__class__.__name__,
+                       getattr(error, 'msg', None) or error)
+
+
+def _init_worker(connect_kwargs):
+    global _worker_si
+    _worker_si = connect.SmartConnect(**connect_kwargs)
+    # pool workers leave through os._exit, atexit handlers never run
+    multiprocessing.util.Finalize(None, connect.Disconnect,
+                                  args=(_worker_si,), exitpriority=10)
+
+
+def _map_shard(arguments):
+    function, references, args = arguments
+    records = []
+    for type_name, mo_id in references:
+        try:
+            value = function(resolve((type_name, mo_id), _worker_si), *args)
+            records.append(Record(type_name, mo_id, export.to_plain(value),
+                                  None))
+        except Exception as e:
+            records.append(Record(type_name, mo_id, None, _describe(e)))
+    return records
+
+
+def _retrieve_shard(arguments):
+    references, path_set, page_size = arguments
+    objects = [resolve(r, _worker_si) for r in references]
+    types = set(VmomiSupport.Type(o) for o in objects)
+    prop_set = [vmodl.query.PropertyCollector.PropertySpec(
+        type=t, pathSet=path_set) for t in types]
+
+    records = []
+    left = set(references)
+    pc = _worker_si.content.propertyCollector
+    try:
+        for obj_content in property_collector.iter_object_contents(
+                pc, objects, prop_set, page_size):
+            reference = ref(obj_content.obj)
+            left.discard(reference)
+            values = dict((p.name, export.to_plain(p.val))
+                          for p in obj_content.propSet or [])
+            error = None
+            if obj_content.missingSet:
+                error = '; '.join('%s: %s' % (m.path, _describe(m.fault))
+                                  for m in obj_content.missingSet)
+            records.append(Record(reference[0], reference[1], values, error))
+        # the objects left out were deleted
+        error = _DELETED
+    except vmodl.MethodFault as e:
+        # not about one of the objects, the rest of the shard is lost
+        error = _describe(e)
+    return records + [Record(type_name, mo_id, None, error)
+                      for type_name, mo_id in references
+                      if (type_name, mo_id) in left]
+
+
+class ProcessExecutor(object):
+    """Worker processes with a session each, see the module docs."""
+
+    def __init__(self, host, user, pwd, port=443, processes=None,
+                 shards_per_process=DEFAULT_SHARDS_PER_PROCESS,
+                 **connect_kwargs):
+        """
+        :type host: types.StringTypes
+        :param host: the vCenter or ESX host each worker logs in to.
+
+        :type processes: types.IntType
+        :param processes: the number of workers, default one per core.
+
+        :type shards_per_process: types.IntType
+        :param shards_per_process: shards per worker, more shards even out \
+        uneven work at the cost of more messages.
+
+        :param connect_kwargs: passed on to SmartConnect.
+
+        :raises vim.fault.InvalidLogin: when the credentials are rejected, \
+        before any worker starts.
+        """
+        connect_kwargs.update(host=host, user=user, pwd=pwd, port=int(port))
+        # a worker failing to log in is replaced by another failing one and
+        # the work never completes, check the credentials here once
+        connect.Disconnect(connect.SmartConnect(**connect_kwargs))
+        self.processes = processes or multiprocessing.cpu_count()
+        self.shards_per_process = shards_per_process
+        self._pool = multiprocessing.Pool(self.processes, _init_worker,
+                                          (connect_kwargs,))
+
+    def _shards(self, objects):
+        references = [o if isinstance(o, tuple) else ref(o) for o in objects]
+        return shard(references, self.processes * self.shards_per_process)
+
+    def map(self, function, objects, *args):
+        """Call function(obj, *args) for every object in the workers.
+
+        :type function: types.FunctionType
+        :param function: a top level function, its result is passed through \
+        export.to_plain.
+
+        :type objects: types.ListType
+        :param objects: managed objects or references made by ref.
+
+        :rtype types.GeneratorType: yields <Record> as shards complete
+        """
+        work = [(function, s, args) for s in self._shards(objects)]
+        for records in self._pool.imap_unordered(_map_shard, work):
+            for record in records:
+                yield record
+
+    def retrieve_properties(self, objects, path_set,
+                            page_size=property_collector.DEFAULT_PAGE_SIZE):
+        """Retrieve properties of many objects, parsing in the workers.
+
+        Each shard is one paged RetrievePropertiesEx in one worker.
+
+        :type objects: types.ListType
+        :param objects: managed objects or references made by ref.
+
+        :type path_set: types.ListType
+        :param path_set: the property paths to retrieve.
+
+        :rtype types.GeneratorType: yields <Record> with value a dict of \
+        path to plain value
+        """
+        work = [(s, list(path_set), page_size)
+                for s in self._shards(objects)]
+        for records in self._pool.imap_unordered(_retrieve_shard, work):
+            for record in records:
+                yield record
+
+    def close(self):
+        """Let the workers finish, log out and exit."""
+        self._pool.close()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if exc_info[0] is None:
+            self.close()
+        else:
+            self._pool.terminate()
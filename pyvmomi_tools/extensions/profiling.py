@@ -0,0 +1,386 @@
+# Copyright (c) 2014 VMware, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module implements optional profiling spans for the pyvmomi_tools
+helpers.
+
+When wait_for_task or find_by is slow it helps to know where the time goes:
+waiting on the network, parsing the SOAP response, running matchers or
+running callbacks. With a Profiler enabled the helpers record a span for
+each of those phases, with the span that was running when it started as its
+parent, and the timeline can be saved in the Chrome trace format to view in
+chrome://tracing or https://ui.perfetto.dev.
+
+code::
+    profiler = profiling.enable()
+    vm = si.content.rootFolder.find_by_name('my-vm', workers=8)
+    vm.PowerOn().wait()
+    profiling.disable()
+    profiler.save('find-and-power-on.json')
+    print profiler.summary()
+
+Spans recorded:
+
+* find_by, find_by.expand, find_by.children: a traversal, one step of it
+  and the property fetch behind the step
+* find_by.matcher: one matcher call
+* property_collector.page: one RetrievePropertiesEx page
+* task.wait, task.update: one wait and each WaitForUpdates call in it
+* task.poll, task.callback: one poll loop and each callback it runs
+* task_monitor.update, task_monitor.callback: the same for TaskMonitor
+* soap.<method>: a SOAP call including the response parse, and soap.parse
+  the parse alone, so network and server time is the difference
+
+Code may add its own spans with span(). While no profiler is enabled span()
+hands back a shared do nothing object and the SOAP hooks are not installed,
+so the cost is one global lookup per span.
+"""
+__author__ = "VMware, Inc."
+
+import collections
+import functools
+import itertools
+import json
+import os
+import threading
+import time
+
+from pyVmomi import SoapAdapter
+
+# the profiler spans are recorded into, None when profiling is off
+_profiler = None
+
+_clock = getattr(time, 'perf_counter', time.time)
+
+DEFAULT_CATEGORY = 'pyvmomi_tools'
+
+# spans kept by default, later spans are counted in Profiler.dropped
+DEFAULT_MAX_SPANS = 1000000
+
+Span = collections.namedtuple('Span', ['id', 'parent', 'name', 'category',
+                                       'thread', 'start', 'end', 'args',
+                                       'detached'])
+Span.__doc__ = """One finished span.
+
+start and end are in seconds on the profiler's clock, thread is the ident of
+the thread it ran on and parent the id of the enclosing span or None.
+detached spans were not on their thread's stack, see span().
+"""
+
+
+class _NullSpan(object):
+    """What span() returns while profiling is off."""
+    __slots__ = ()
+    id = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set(self, **args):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _ActiveSpan(object):
+    __slots__ = ('profiler', 'id', 'parent', 'name', 'category', 'args',
+                 'detached', 'start')
+
+    def __init__(self, profiler, name, category, parent, detached, args):
+        self.profiler = profiler
+        self.id = next(profiler._ids)
+        self.parent = parent
+        self.name = name
+        self.category = category
+        self.detached = detached
+        self.args = args
+        self.start = None
+
+    def set(self, **args):
+        """Add arguments to the span, shown with it in the trace."""
+        self.args.update(args)
+
+    def __enter__(self):
+        stack = self.profiler._stack()
+        if self.parent is None and stack:
+            self.parent = stack[-1].id
+        if not self.detached:
+            stack.append(self)
+        self.start = _clock()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        end = _clock()
+        if not self.detached:
+            stack = self.profiler._stack()
+            if stack and stack[-1] is self:
+                stack.pop()
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.profiler._record(Span(self.id, self.parent, self.name,
+                                   self.category,
+                                   threading.current_thread().ident,
+                                   self.start, end, self.args,
+                                   self.detached))
+        return False
+
+
+class Profiler(object):
+    """A thread safe recorder of spans, see the module docs."""
+
+    def __init__(self, max_spans=DEFAULT_MAX_SPANS):
+        """
+        :type max_spans: types.IntType
+        :param max_spans: the most spans to keep, None for no limit.
+        """
+        self.max_spans = max_spans
+        self.spans = []
+        self.dropped = 0
+        self.origin = _clock()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _record(self, span):
+        with self._lock:
+            if self.max_spans is not None and \
+                    len(self.spans) >= self.max_spans:
+                self.dropped += 1
+            else:
+                self.spans.append(span)
+
+    def span(self, name, category=DEFAULT_CATEGORY, parent=None,
+             detached=False, **args):
+        """A span to use as a context manager, see the module level span()."""
+        return _ActiveSpan(self, name, category, parent, detached, args)
+
+    def current(self):
+        """The id of the innermost open span on this thread, or None."""
+        stack = self._stack()
+        return stack[-1].id if stack else None
+
+    def summary(self):
+        """Count, total and self seconds per span name.
+
+        Self time is the span's time less that of its children on the same
+        thread, so for soap.<method> it is the time not spent parsing.
+
+        :rtype types.DictType:
+        :return: {name: {'count': n, 'total': seconds, 'self': seconds}}
+        """
+        with self._lock:
+            spans = list(self.spans)
+        threads = dict((span.id, span.thread) for span in spans)
+        child_time = collections.defaultdict(float)
+        for span in spans:
+            if span.parent is not None and not span.detached and \
+                    threads.get(span.parent) == span.thread:
+                child_time[span.parent] += span.end - span.start
+        totals = {}
+        for span in spans:
+            total = totals.setdefault(span.name,
+                                      {'count': 0, 'total': 0.0,
+                                       'self': 0.0})
+            seconds = span.end - span.start
+            total['count'] += 1
+            total['total'] += seconds
+            total['self'] += seconds - child_time[span.id]
+        return totals
+
+    def chrome_trace(self):
+        """The spans as a Chrome trace event document.
+
+        Spans become complete ('X') events on their thread. Detached spans
+        become async begin and end events so they do not break the nesting
+        of the thread they ran on. Every event's args carry the span id and
+        its parent's id.
+
+        :rtype types.DictType:
+        """
+        with self._lock:
+            spans = list(self.spans)
+        pid = os.getpid()
+        events = []
+        for span in spans:
+            args = dict(span.args)
+            args['id'] = span.id
+            args['parent'] = span.parent
+            ts = (span.start - self.origin) * 1e6
+            common = {'name': span.name, 'cat': span.category, 'pid': pid,
+                      'tid': span.thread}
+            if span.detached:
+                events.append(dict(common, ph='b', id=span.id, ts=ts,
+                                   args=args))
+                events.append(dict(common, ph='e', id=span.id,
+                                   ts=(span.end - self.origin) * 1e6))
+            else:
+                events.append(dict(common, ph='X', ts=ts,
+                                   dur=(span.end - span.start) * 1e6,
+                                   args=args))
+        events.sort(key=lambda event: event['ts'])
+        return {'traceEvents': events, 'displayTimeUnit': 'ms',
+                'otherData': {'dropped': self.dropped}}
+
+    def save(self, path):
+        """Write chrome_trace() as JSON to path."""
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f, default=str)
+
+
+def span(name, category=DEFAULT_CATEGORY, parent=None, detached=False,
+         **args):
+    """A span timing the block it is used on, when profiling is enabled.
+
+    code::
+        with profiling.span('inventory.report', vms=len(vms)) as s:
+            ...
+            s.set(rows=len(rows))
+
+    :type name: types.StringTypes
+    :param name: what the span times.
+
+    :type parent: types.IntType
+    :param parent: the id of the parent span, default the innermost open \
+    span on this thread. Pass current() from the submitting thread for \
+    work handed to another thread.
+
+    :type detached: types.BooleanType
+    :param detached: do not make this the current span of the thread, for \
+    spans around generators whose caller runs while the span is open.
+
+    :param args: shown with the span in the trace.
+    """
+    profiler = _profiler
+    if profiler is None:
+        return _NULL_SPAN
+    return profiler.span(name, category, parent, detached, **args)
+
+
+def traced(name, category=DEFAULT_CATEGORY):
+    """A decorator running every call of the function in a span.
+
+    :type name: types.StringTypes
+    :param name: the span name.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _profiler is None:
+                return func(*args, **kwargs)
+            with span(name, category):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def current():
+    """The id of the innermost open span on this thread, or None."""
+    profiler = _profiler
+    if profiler is None:
+        return None
+    return profiler.current()
+
+
+def enabled():
+    """True while a profiler is enabled."""
+    return _profiler is not None
+
+
+def enable(profiler=None, soap=True):
+    """Start recording spans.
+
+    :type profiler: Profiler
+    :param profiler: where to record, default a new Profiler.
+
+    :type soap: types.BooleanType
+    :param soap: also record soap.<method> and soap.parse spans for every \
+    call on every connection.
+
+    :rtype Profiler:
+    :return: the enabled profiler.
+    """
+    global _profiler
+    if profiler is None:
+        profiler = Profiler()
+    _profiler = profiler
+    if soap:
+        _install_soap_hooks()
+    else:
+        _uninstall_soap_hooks()
+    return profiler
+
+
+def disable():
+    """Stop recording spans and remove the SOAP hooks.
+
+    :rtype Profiler:
+    :return: the profiler that was enabled, or None.
+    """
+    global _profiler
+    profiler, _profiler = _profiler, None
+    _uninstall_soap_hooks()
+    return profiler
+
+
+# the unwrapped methods while the SOAP hooks are installed
+_soap_originals = None
+# held while the hooks are installed or removed, enable() and disable()
+# racing on two threads must not wrap a hook or lose the originals
+_soap_lock = threading.Lock()
+
+
+def _install_soap_hooks():
+    global _soap_originals
+    with _soap_lock:
+        if _soap_originals is not None:
+            return
+        invoke = SoapAdapter.SoapStubAdapter.InvokeMethod
+        deserialize = SoapAdapter.SoapResponseDeserializer.Deserialize
+
+        def invoke_method(stub, mo, info, args, *rest):
+            with span('soap.%s' % info.wsdlName, 'soap',
+                      mo=getattr(mo, '_moId', None)):
+                return invoke(stub, mo, info, args, *rest)
+
+        def parse(deserializer, response, *rest):
+            with span('soap.parse', 'parse'):
+                return deserialize(deserializer, response, *rest)
+
+        # installed on the classes, so a RateLimiter on a connection wraps
+        # these and its waits are not counted in the spans
+        SoapAdapter.SoapStubAdapter.InvokeMethod = invoke_method
+        SoapAdapter.SoapResponseDeserializer.Deserialize = parse
+        _soap_originals = (invoke, deserialize)
+
+
+def _uninstall_soap_hooks():
+    global _soap_originals
+    with _soap_lock:
+        if _soap_originals is None:
+            return
+        invoke, deserialize = _soap_originals
+        SoapAdapter.SoapStubAdapter.InvokeMethod = invoke
+        SoapAdapter.SoapResponseDeserializer.Deserialize = deserialize
+        _soap_originals = None
@@ -12,6 +12,53 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+"""
+This module implements extensions to the vim.PropertyCollector object in the
+pyvmomi library.
+
+methods
+=======
+
+build_object_filter
+-------------------
+
+Creates a filter collecting all property changes of one managed object.
+
+iter_properties
+---------------
+
+code::
+    pc = si.content.propertyCollector
+    for vm, props in pc.iter_properties(si.content.rootFolder,
+                                        vim.VirtualMachine,
+                                        ['name', 'runtime.powerState']):
+        print vm.id, props['name']
+
+Retrieves properties of every object of a type below a container in pages
+of RetrievePropertiesEx results, only one page is held in memory at a time.
+
+iter_object_properties
+----------------------
+
+code::
+    for vm, props in pc.iter_object_properties(vms, vim.VirtualMachine,
+                                               ['snapshot']):
+        ...
+
+The same for a list of objects already at hand, in one paged retrieval.
+iter_object_contents does that for objects of mixed types and produces the
+ObjectContent with its missingSet.
+"""
+__author__ = "VMware, Inc."
+
+from pyVmomi import vim
+from pyVmomi import vmodl
+
+from pyvmomi_tools.extensions import profiling
+
+# objects per RetrievePropertiesEx page
+DEFAULT_PAGE_SIZE = 1000
+
 
 def _build_filter_spec(managed_object):
     managed_class = managed_object.__class__
@@ -35,5 +82,166 @@ def build_object_filter(property_collector, managed_object):
     return pfilter
 
 
+def _build_view_filter_spec(view, obj_type, path_set):
+    collector = vmodl.query.PropertyCollector
+    traversal_spec = collector.TraversalSpec(name='traverseView',
+                                             path='view', skip=False,
+                                             type=vim.view.ContainerView)
+    obj_spec = collector.ObjectSpec(obj=view, skip=True,
+                                    selectSet=[traversal_spec])
+    prop_spec = collector.PropertySpec(type=obj_type, pathSet=path_set,
+                                       all=False)
+    return collector.FilterSpec(objectSet=[obj_spec], propSet=[prop_spec])
+
+
+def iter_pages(property_collector, filter_spec, page_size=DEFAULT_PAGE_SIZE):
+    """A generator of RetrievePropertiesEx result pages for a filter spec.
+
+    Continues with ContinueRetrievePropertiesEx until the server has no more
+    results. Closing the generator early cancels the remaining results.
+
+    :type property_collector: vim.PropertyCollector
+    :param property_collector: the collector to retrieve with.
+
+    :type filter_spec: vmodl.query.PropertyCollector.FilterSpec
+    :param filter_spec: what to retrieve.
+
+    :type page_size: types.IntType
+    :param page_size: the most objects per page.
+
+    :rtype generator:
+    :return: generator that produces lists of ObjectContent.
+    """
+    options = vmodl.query.PropertyCollector.RetrieveOptions(
+        maxObjects=page_size)
+    with profiling.span('property_collector.page', page=0):
+        result = property_collector.RetrievePropertiesEx([filter_spec],
+                                                         options)
+    token = None
+    page = 0
+    try:
+        while result:
+            token = result.token
+            yield result.objects
+            if not token:
+                break
+            page += 1
+            with profiling.span('property_collector.page', page=page):
+                result = property_collector.ContinueRetrievePropertiesEx(
+                    token)
+            token = None
+    finally:
+        if token:
+            property_collector.CancelRetrievePropertiesEx(token)
+
+
+def iter_properties(property_collector, container, obj_type, path_set,
+                    page_size=DEFAULT_PAGE_SIZE):
+    """A generator of the properties of every obj_type below container.
+
+    A recursive container view is created for the duration of the
+    retrieval. Property paths may be nested, e.g. 'summary.config.numCpu'.
+    Properties that are unset on an object are missing from its dict.
+
+    :type property_collector: vim.PropertyCollector
+    :param property_collector: the collector to retrieve with.
+
+    :type container: vim.ManagedEntity
+    :param container: a Folder, Datacenter, ComputeResource or ResourcePool.
+
+    :type obj_type: type
+    :param obj_type: the managed object type, e.g. vim.VirtualMachine.
+
+    :type path_set: types.ListType
+    :param path_set: the property paths to retrieve.
+
+    :type page_size: types.IntType
+    :param page_size: the most objects per RetrievePropertiesEx page.
+
+    :rtype generator:
+    :return: generator that produces (vim.ManagedObject, dict) tuples.
+    """
+    si = vim.ServiceInstance('ServiceInstance', property_collector._stub)
+    view = si.content.viewManager.CreateContainerView(container, [obj_type],
+                                                      True)
+    try:
+        filter_spec = _build_view_filter_spec(view, obj_type, list(path_set))
+        for page in iter_pages(property_collector, filter_spec, page_size):
+            for obj_content in page:
+                props = dict((p.name, p.val)
+                             for p in obj_content.propSet or [])
+                yield obj_content.obj, props
+    finally:
+        view.Destroy()
+
+
+def iter_object_properties(property_collector, objects, obj_type, path_set,
+                           page_size=DEFAULT_PAGE_SIZE):
+    """A generator of the properties of the given objects.
+
+    Objects deleted before or during the retrieval are left out instead of
+    failing it.
+
+    :type objects: types.ListType
+    :param objects: managed objects, all of obj_type.
+
+    See iter_properties for the other arguments and the results.
+    """
+    prop_set = [vmodl.query.PropertyCollector.PropertySpec(
+        type=obj_type, pathSet=list(path_set))]
+    for obj_content in iter_object_contents(property_collector, objects,
+                                            prop_set, page_size):
+        props = dict((p.name, p.val) for p in obj_content.propSet or [])
+        yield obj_content.obj, props
+
+
+def iter_object_contents(property_collector, objects, prop_set,
+                         page_size=DEFAULT_PAGE_SIZE):
+    """A generator of the ObjectContent of the given objects.
+
+    Like iter_object_properties, for objects of any types given a
+    PropertySpec each. The missingSet of each ObjectContent holds the paths
+    that could not be read.
+
+    :type prop_set: types.ListType
+    :param prop_set: the vmodl.query.PropertyCollector.PropertySpec list.
+
+    :rtype generator:
+    :return: generator that produces ObjectContent objects.
+    """
+    collector = vmodl.query.PropertyCollector
+    objects = list(objects)
+    done = set()
+    while objects:
+        filter_spec = collector.FilterSpec(
+            objectSet=[collector.ObjectSpec(obj=obj) for obj in objects],
+            propSet=prop_set)
+        try:
+            for page in iter_pages(property_collector, filter_spec,
+                                   page_size):
+                for obj_content in page:
+                    done.add(obj_content.obj)
+                    if _not_found(obj_content):
+                        continue
+                    yield obj_content
+            return
+        except vmodl.fault.ManagedObjectNotFound as e:
+            # one deleted object fails the whole retrieval, retry without
+            # it and without the objects already produced
+            if e.obj not in objects:
+                raise
+            done.add(e.obj)
+            objects = [obj for obj in objects if obj not in done]
+
+
+def _not_found(obj_content):
+    return any(isinstance(missing.fault, vmodl.fault.ManagedObjectNotFound)
+               for missing in obj_content.missingSet or [])
+
+
 # inject into the PropertyCollector class
 vim.PropertyCollector.build_object_filter = build_object_filter
+vim.PropertyCollector.iter_pages = iter_pages
+vim.PropertyCollector.iter_properties = iter_properties
+vim.PropertyCollector.iter_object_properties = iter_object_properties
+vim.PropertyCollector.iter_object_contents = iter_object_contents
@@ -0,0 +1,202 @@
+# Copyright (c) 2014 VMware, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module implements a client side rate limiter for vSphere API calls.
+
+Scaling out workers can flood a vCenter and degrade it for everyone. A
+RateLimiter holds one token bucket per method class, 'task' for calls that
+create a task and 'read' for everything else, and is installed on a
+connection's SOAP stub so every call made on that connection, by the
+pyvmomi_tools helpers or anything else, takes a token first. One limiter may
+be installed on many connections and used from many threads, the limits
+then apply to all of them together.
+
+code::
+    limiter = RateLimiter(read_rate=50, task_rate=5)
+    limiter.install(si)
+    ...
+    print limiter.metrics()
+
+Property reads such as vm.name are calls too and count as reads.
+"""
+__author__ = "VMware, Inc."
+
+import threading
+import time
+
+from pyVmomi import vim
+
+READ = 'read'
+TASK = 'task'
+
+
+class TokenBucket(object):
+    """A thread safe token bucket.
+
+    Callers reserve a token under a lock and sleep outside of it, so waiting
+    callers are served in order and never hold each other up.
+    """
+
+    def __init__(self, rate, burst=None):
+        """
+        :type rate: types.FloatType
+        :param rate: tokens added per second.
+
+        :type burst: types.IntType
+        :param burst: most tokens the bucket holds, default one second's \
+        worth.
+        """
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1, rate))
+        self._tokens = self.burst
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Take a token, returning how long to wait before using it."""
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self.burst,
+                               self._tokens +
+                               (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self):
+        """Block until a token is available.
+
+        :rtype types.FloatType:
+        :return: the seconds spent waiting.
+        """
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class _Metrics(object):
+
+    def __init__(self):
+        self.calls = 0
+        self.waited_calls = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def record(self, wait):
+        self.calls += 1
+        if wait > 0:
+            self.waited_calls += 1
+            self.wait_seconds += wait
+            self.max_wait_seconds = max(self.max_wait_seconds, wait)
+
+    def as_dict(self):
+        return {'calls': self.calls,
+                'waited_calls': self.waited_calls,
+                'wait_seconds': self.wait_seconds,
+                'max_wait_seconds': self.max_wait_seconds}
+
+
+def classify(info):
+    """The method class of a pyVmomi method info, TASK or READ."""
+    if info.result is vim.Task or info.wsdlName.endswith('_Task'):
+        return TASK
+    return READ
+
+
+class RateLimiter(object):
+    """Token bucket limits per method class, see the module docs."""
+
+    def __init__(self, read_rate=None, task_rate=None, read_burst=None,
+                 task_burst=None):
+        """
+        :type read_rate: types.FloatType
+        :param read_rate: read calls per second, None for no limit.
+
+        :type task_rate: types.FloatType
+        :param task_rate: task creating calls per second, None for no limit.
+        """
+        self._buckets = {}
+        if read_rate:
+            self._buckets[READ] = TokenBucket(read_rate, read_burst)
+        if task_rate:
+            self._buckets[TASK] = TokenBucket(task_rate, task_burst)
+        self._metrics = {READ: _Metrics(), TASK: _Metrics()}
+        self._lock = threading.Lock()
+
+    def acquire(self, method_class):
+        """Block until a call of method_class may be made."""
+        bucket = self._buckets.get(method_class)
+        wait = bucket.acquire() if bucket is not None else 0.0
+        with self._lock:
+            self._metrics[method_class].record(wait)
+        return wait
+
+    def metrics(self):
+        """Call counts and time spent waiting per method class.
+
+        :rtype types.DictType:
+        :return: {'read': {...}, 'task': {...}} with calls, waited_calls, \
+        wait_seconds and max_wait_seconds.
+        """
+        with self._lock:
+            return dict((name, m.as_dict())
+                        for name, m in self._metrics.items())
+
+    def install(self, si_or_stub):
+        """Route every call made through a connection past this limiter.
+
+        :type si_or_stub: vim.ServiceInstance
+        :param si_or_stub: the connection, or its SOAP stub.
+        """
+        stub = getattr(si_or_stub, '_stub', si_or_stub)
+        uninstall(stub)
+        # only a method set on the stub itself is captured, the class's is
+        # looked up per call so hooks installed on the class later, such
+        # as the profiling ones, still run
+        invoke = stub.__dict__.get('InvokeMethod')
+        limiter = self
+
+        def invoke_method(mo, info, args, *rest):
+            limiter.acquire(classify(info))
+            if invoke is not None:
+                return invoke(mo, info, args, *rest)
+            return type(stub).InvokeMethod(stub, mo, info, args, *rest)
+
+        # accessors call self.InvokeMethod, so property reads come through
+        # here as well
+        stub.InvokeMethod = invoke_method
+        stub._rate_limiter = (self, invoke)
+
+
+def uninstall(si_or_stub):
+    """Remove any rate limiter installed on a connection."""
+    stub = getattr(si_or_stub, '_stub', si_or_stub)
+    installed = getattr(stub, '_rate_limiter', None)
+    if installed is not None:
+        if installed[1] is not None:
+            stub.InvokeMethod = installed[1]
+        else:
+            del stub.InvokeMethod
+        del stub._rate_limiter
+
+
+def installed_limiter(si_or_stub):
+    """The RateLimiter installed on a connection, or None."""
+    stub = getattr(si_or_stub, '_stub', si_or_stub)
+    installed = getattr(stub, '_rate_limiter', None)
+    return installed[0] if installed is not None else None
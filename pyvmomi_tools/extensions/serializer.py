@@ -0,0 +1,258 @@
+# Copyright (c) 2014 VMware, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module implements a compact serialization of pyVmomi values for caches
+and inter-process messages.
+
+Data objects and managed object references do not pickle, and SOAP XML is
+large and slow to produce and parse. dumps turns any property value into
+nested lists of plain values plus a table of the types used. The table has
+one entry per data object type and set of properties set, so a data object
+is stored as the index of its entry followed by just its values, and a
+managed object as its type's index and its id. The
+result is written as JSON or pickle, loads rebuilds the pyVmomi objects.
+
+code::
+    data = serializer.dumps(vm.config)
+    config = serializer.loads(data)
+
+    data = serializer.dumps(objects, fmt=serializer.PICKLE)
+    objects = serializer.loads(data, stub=si._stub, fmt=serializer.PICKLE)
+
+Managed objects are rebuilt bound to the stub given to loads, or unbound.
+Unset properties and empty arrays both come back unset.
+
+Unpickling runs code chosen by whoever wrote the data, so loads only reads
+pickle when asked to with fmt=PICKLE. Use it for data this process or a
+trusted peer wrote.
+"""
+__author__ = "VMware, Inc."
+
+import base64
+import datetime
+import json
+import pickle
+
+import six
+
+from pyVmomi import Iso8601
+from pyVmomi import VmomiSupport
+from pyVmomi import vim
+
+JSON = 'json'
+PICKLE = 'pickle'
+FORMATS = (JSON, PICKLE)
+
+# bumped whenever the encoding changes
+VERSION = 1
+
+# tags of the encoded non plain values, [tag, ...]
+_LIST = 0
+_DATA = 1
+_MANAGED = 2
+_DATETIME = 3
+_BINARY = 4
+_TYPE = 5
+_WRAPPED = 6
+_ARRAY = 7
+
+# values of these exact types are stored as they are
+_PLAIN = frozenset([type(None), bool, float, six.text_type] +
+                   list(six.integer_types) +
+                   ([str] if six.PY2 else []))
+
+# data object type -> its property names, computed once per type
+_properties = {}
+
+
+def _property_names(cls):
+    names = _properties.get(cls)
+    if names is None:
+        names = tuple(p.name for p in cls._GetPropertyList())
+        _properties[cls] = names
+    return names
+
+
+class _Encoder(object):
+
+    def __init__(self):
+        self.table = []
+        self._index = {}
+
+    def _type(self, key, name, names=()):
+        index = self._index.get(key)
+        if index is None:
+            index = len(self.table)
+            self.table.append([name] + list(names))
+            self._index[key] = index
+        return index
+
+    def encode(self, value):
+        cls = type(value)
+        if cls in _PLAIN:
+            return value
+        if isinstance(value, VmomiSupport.DataObject):
+            names, items = [], []
+            for name in _property_names(cls):
+                item = getattr(value, name)
+                if item is None or (isinstance(item, list) and not item):
+                    continue
+                names.append(name)
+                items.append(self.encode(item))
+            # one table entry per type and set of properties, objects of
+            # the same shape share it and store their values only
+            names = tuple(names)
+            return [_DATA, self._type((cls, names),
+                                      VmomiSupport.GetVmodlName(cls),
+                                      names)] + items
+        if isinstance(value, vim.ManagedObject):
+            return [_MANAGED, self._class(cls), value._moId]
+        if isinstance(value, list):
+            items = [self.encode(item) for item in value]
+            if cls is list:
+                return [_LIST] + items
+            return [_ARRAY, self._class(cls)] + items
+        if isinstance(value, datetime.datetime):
+            return [_DATETIME, Iso8601.ISO8601Format(value)]
+        if isinstance(value, VmomiSupport.binary):
+            return [_BINARY, base64.b64encode(value).decode('ascii')]
+        if isinstance(value, type):
+            return [_TYPE, self._class(value)]
+        for base in (bool, float, six.text_type) + six.integer_types:
+            if isinstance(value, base):
+                # enums and the sized numbers are subclasses of plain types
+                return [_WRAPPED, self._class(cls), base(value)]
+        raise TypeError('cannot serialize %r' % (value,))
+
+    def _class(self, cls):
+        return self._type(cls, VmomiSupport.GetVmodlName(cls))
+
+
+# data object type -> (default values, [(array property, array type)])
+_defaults = {}
+
+
+def _new(cls):
+    # cls() without checking every default value again
+    defaults = _defaults.get(cls)
+    if defaults is None:
+        template = cls()
+        arrays = [(p.name, p.type) for p in cls._GetPropertyList()
+                  if issubclass(p.type, list)]
+        values = dict((p.name, getattr(template, p.name))
+                      for p in cls._GetPropertyList())
+        for name, _ in arrays:
+            del values[name]
+        defaults = _defaults[cls] = (values, arrays)
+    obj = cls.__new__(cls)
+    obj.__dict__.update(defaults[0])
+    for name, array_type in defaults[1]:
+        obj.__dict__[name] = array_type()
+    return obj
+
+
+class _Decoder(object):
+
+    def __init__(self, table, stub):
+        self.stub = stub
+        self.types = [VmomiSupport.GetVmodlType(entry[0]) for entry in table]
+        self.names = [entry[1:] for entry in table]
+
+    def decode(self, value):
+        if not isinstance(value, list):
+            return value
+        tag = value[0]
+        if tag == _DATA:
+            index = value[1]
+            obj = _new(self.types[index])
+            # the values were checked when the original was built
+            attributes = obj.__dict__
+            for name, item in zip(self.names[index], value[2:]):
+                attributes[name] = self.decode(item)
+            return obj
+        if tag == _MANAGED:
+            return self.types[value[1]](value[2], self.stub)
+        if tag == _LIST:
+            return [self.decode(item) for item in value[1:]]
+        if tag == _ARRAY:
+            return self.types[value[1]](self.decode(item)
+                                        for item in value[2:])
+        if tag == _DATETIME:
+            return Iso8601.ParseISO8601(value[1])
+        if tag == _BINARY:
+            return VmomiSupport.binary(base64.b64decode(value[1]))
+        if tag == _TYPE:
+            return self.types[value[1]]
+        if tag == _WRAPPED:
+            return self.types[value[1]](value[2])
+        raise ValueError('unknown tag %r' % (tag,))
+
+
+def encode(value):
+    """The plain form of value, a [version, type table, body] list."""
+    encoder = _Encoder()
+    body = encoder.encode(value)
+    return [VERSION, encoder.table, body]
+
+
+def decode(encoded, stub=None):
+    """The value of a plain form made by encode.
+
+    :type stub: pyVmomi.SoapStubAdapter
+    :param stub: the stub managed objects are bound to, e.g. si._stub.
+    """
+    version, table, body = encoded
+    if version != VERSION:
+        raise ValueError('cannot decode version %s, expected %s' %
+                         (version, VERSION))
+    return _Decoder(table, stub).decode(body)
+
+
+def dumps(value, fmt=JSON):
+    """Serialize a pyVmomi value.
+
+    :type fmt: types.StringTypes
+    :param fmt: JSON for a compact JSON text, PICKLE for pickle bytes.
+
+    :rtype types.StringTypes:
+    """
+    encoded = encode(value)
+    if fmt == JSON:
+        return json.dumps(encoded, separators=(',', ':'))
+    if fmt == PICKLE:
+        return pickle.dumps(encoded, pickle.HIGHEST_PROTOCOL)
+    raise ValueError('unknown format %s, use one of %s' %
+                     (fmt, ', '.join(FORMATS)))
+
+
+def loads(data, stub=None, fmt=JSON):
+    """Rebuild a value serialized by dumps.
+
+    :type stub: pyVmomi.SoapStubAdapter
+    :param stub: the stub managed objects are bound to, e.g. si._stub.
+
+    :type fmt: types.StringTypes
+    :param fmt: the format dumps wrote, PICKLE only for trusted data.
+    """
+    if fmt == JSON:
+        if isinstance(data, six.binary_type):
+            data = data.decode('utf-8')
+        encoded = json.loads(data)
+    elif fmt == PICKLE:
+        encoded = pickle.loads(data)
+    else:
+        raise ValueError('unknown format %s, use one of %s' %
+                         (fmt, ', '.join(FORMATS)))
+    return decode(encoded, stub)
@@ -0,0 +1,275 @@
+# Copyright (c) 2014 VMware, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module implements a snapshot index for many virtual machines and bulk
+snapshot removal.
+
+Finding a snapshot by name means walking snapshot.rootSnapshotList one lazy
+fetch at a time, per virtual machine. index_snapshots retrieves the snapshot
+trees and file layouts of many virtual machines in one paged retrieval and
+flattens each tree into a SnapshotIndex that answers lookups locally.
+
+code::
+    indexes = index_snapshots(vms)
+    old = [entry for index in indexes.values()
+           for entry in index.older_than(datetime.timedelta(days=30))]
+    results = remove_snapshots(old, max_concurrency=20)
+
+    vm.snapshot_index().by_name('before upgrade')
+
+A snapshot's size is its state and memory files plus the delta disks it
+added to its parent's disk chains, all from layoutEx. It is None when the
+layout does not mention the snapshot.
+"""
+__author__ = "VMware, Inc."
+
+import collections
+import datetime
+
+from six.moves import queue
+
+from pyVmomi import vim
+from pyVmomi import vmodl
+
+from pyvmomi_tools.extensions import property_collector
+from pyvmomi_tools.extensions import task as task_extensions
+
+SnapshotEntry = collections.namedtuple('SnapshotEntry',
+                                       ['vm', 'snapshot', 'id', 'name',
+                                        'description', 'create_time',
+                                        'state', 'path', 'parent', 'size'])
+SnapshotEntry.__doc__ = """One snapshot of a virtual machine.
+
+snapshot is the vim.vm.Snapshot, path the names from the root snapshot down
+to this one, parent the parent vim.vm.Snapshot or None and size in bytes.
+"""
+
+
+class SnapshotIndex(object):
+    """The flattened snapshot tree of one virtual machine."""
+
+    def __init__(self, vm, entries, current=None):
+        """
+        :type entries: types.ListType
+        :param entries: SnapshotEntry tuples, parents before children.
+
+        :type current: vim.vm.Snapshot
+        :param current: the snapshot the virtual machine runs from.
+        """
+        self.vm = vm
+        self.entries = list(entries)
+        self.current = current
+        self._by_name = collections.defaultdict(list)
+        for entry in self.entries:
+            self._by_name[entry.name].append(entry)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def by_name(self, name):
+        """The snapshots called name, names need not be unique.
+
+        :rtype types.ListType: contains [<SnapshotEntry>]
+        """
+        return list(self._by_name.get(name, ()))
+
+    def by_age(self):
+        """The snapshots oldest first."""
+        return sorted(self.entries, key=lambda e: e.create_time)
+
+    def older_than(self, age, now=None):
+        """The snapshots created more than age ago, oldest first.
+
+        :type age: datetime.timedelta
+        :param age: the minimum age.
+
+        :type now: datetime.datetime
+        :param now: the time to measure from, default the current UTC time.
+        """
+        if now is None:
+            now = datetime.datetime.utcnow()
+        return [e for e in self.by_age() if _naive(e.create_time) < now - age]
+
+    def by_size(self):
+        """The snapshots largest first, those of unknown size last."""
+        return sorted(self.entries, key=lambda e: -1 if e.size is None
+                      else e.size, reverse=True)
+
+    def total_size(self):
+        """The bytes used by all snapshots of known size."""
+        return sum(e.size for e in self.entries if e.size is not None)
+
+
+def _naive(value):
+    # the UTC time without tzinfo, snapshot times come with a timezone
+    if value is not None and value.tzinfo is not None:
+        value = (value - value.utcoffset()).replace(tzinfo=None)
+    return value
+
+
+def _layouts(layout):
+    # file sizes, disk chains and layouts per snapshot from a FileLayoutEx
+    if layout is None or not layout.snapshot:
+        return {}, {}, {}
+    file_sizes = dict((f.key, f.size or 0) for f in layout.file or [])
+    chains = {}
+    for snapshot_layout in layout.snapshot:
+        chains[snapshot_layout.key.id] = dict(
+            (disk.key, [list(unit.fileKey) for unit in disk.chain or []])
+            for disk in snapshot_layout.disk or [])
+    return file_sizes, chains, dict((s.key.id, s) for s in layout.snapshot)
+
+
+def _flatten(vm, info, layout):
+    file_sizes, chains, layouts = _layouts(layout)
+    entries = []
+
+    def walk(trees, path, parent):
+        for tree in trees or []:
+            here = path + (tree.name,)
+            size = None
+            snapshot_layout = layouts.get(tree.snapshot.id)
+            if snapshot_layout is not None:
+                keys = set(k for k in (snapshot_layout.dataKey,
+                                       snapshot_layout.memoryKey)
+                           if k is not None and k >= 0)
+                parent_chains = chains.get(parent.id, {}) if parent else {}
+                for disk_key, chain in chains[tree.snapshot.id].items():
+                    # the first unit of a chain is the base disk
+                    inherited = set(k for unit in
+                                    parent_chains.get(disk_key, chain[:1])
+                                    for k in unit)
+                    keys.update(k for unit in chain for k in unit
+                                if k not in inherited)
+                size = sum(file_sizes.get(k, 0) for k in keys)
+            entries.append(SnapshotEntry(vm, tree.snapshot, tree.snapshot.id,
+                                         tree.name, tree.description,
+                                         tree.createTime, tree.state, here,
+                                         parent, size))
+            walk(tree.childSnapshotList, here, tree.snapshot)
+
+    walk(info.rootSnapshotList if info is not None else None, (), None)
+    return entries
+
+
+def index_snapshots(vms, page_size=property_collector.DEFAULT_PAGE_SIZE):
+    """Build the snapshot indexes of many virtual machines at once.
+
+    :type vms: types.ListType
+    :param vms: the vim.VirtualMachine objects, all on one connection.
+
+    :rtype types.DictType:
+    :return: {vm id: SnapshotIndex}, virtual machines without snapshots \
+    have an empty index and deleted ones none.
+    """
+    vms = list(vms)
+    if not vms:
+        return {}
+    si = vim.ServiceInstance('ServiceInstance', vms[0]._stub)
+    pc = si.content.propertyCollector
+    indexes = {}
+    for vm, props in pc.iter_object_properties(vms, vim.VirtualMachine,
+                                               ['snapshot', 'layoutEx'],
+                                               page_size):
+        info = props.get('snapshot')
+        indexes[vm.id] = SnapshotIndex(
+            vm, _flatten(vm, info, props.get('layoutEx')),
+            info.currentSnapshot if info is not None else None)
+    return indexes
+
+
+def snapshot_index(vm):
+    """The SnapshotIndex of one virtual machine.
+
+    :raises vmodl.fault.ManagedObjectNotFound: when vm has been deleted.
+    """
+    indexes = index_snapshots([vm])
+    if vm.id not in indexes:
+        raise vmodl.fault.ManagedObjectNotFound(obj=vm)
+    return indexes[vm.id]
+
+
+def remove_snapshots(entries, max_concurrency=8, remove_children=False,
+                     consolidate=True, si=None):
+    """Remove many snapshots, at most one at a time per virtual machine.
+
+    A virtual machine runs one snapshot operation at a time, so the
+    snapshots of each virtual machine are removed in turn, deepest first,
+    with up to max_concurrency virtual machines being worked on at once.
+    Completions come from one TaskMonitor.
+
+    :type entries: types.ListType
+    :param entries: the SnapshotEntry tuples to remove.
+
+    :type max_concurrency: types.IntType
+    :param max_concurrency: the most RemoveSnapshot_Task running at once.
+
+    :type remove_children: types.BooleanType
+    :param remove_children: also remove each snapshot's subtree.
+
+    :type consolidate: types.BooleanType
+    :param consolidate: consolidate the disks after removing.
+
+    :type si: vim.ServiceInstance
+    :param si: the connection, default GetSi().
+
+    :rtype types.DictType:
+    :return: {snapshot id: (SnapshotEntry, state, error)}
+    """
+    per_vm = collections.OrderedDict()
+    for entry in sorted(entries, key=lambda e: -len(e.path)):
+        per_vm.setdefault(entry.vm.id, collections.deque()).append(entry)
+    waiting = collections.deque(per_vm)
+    events = queue.Queue()
+    results = {}
+    active = 0
+
+    monitor = task_extensions.TaskMonitor(si)
+    monitor.start()
+    try:
+        while waiting or active:
+            while waiting and active < max_concurrency:
+                vm_id = waiting.popleft()
+                entry = per_vm[vm_id].popleft()
+                try:
+                    remove_task = entry.snapshot.RemoveSnapshot_Task(
+                        remove_children, consolidate)
+                except vmodl.MethodFault as e:
+                    results[entry.id] = (entry, vim.TaskInfo.State.error, e)
+                    if per_vm[vm_id]:
+                        waiting.append(vm_id)
+                    continue
+                monitor.add(remove_task,
+                            lambda t, state, error, entry=entry:
+                            events.put((entry, state, error)))
+                active += 1
+            if not active:
+                break
+
+            entry, state, error = events.get()
+            active -= 1
+            results[entry.id] = (entry, state, error)
+            if per_vm[entry.vm.id]:
+                waiting.append(entry.vm.id)
+    finally:
+        monitor.stop()
+    return results
+
+
+# NOTE: This kind of injection usually goes at the *bottom* of a file.
+vim.VirtualMachine.snapshot_index = snapshot_index
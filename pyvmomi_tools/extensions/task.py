@@ -17,12 +17,112 @@ This module implements helper functions for vim.Task
 """
 __author__ = "VMware, Inc."
 
+import math
+import threading
 import time
 
 import pyVim.connect as connect
 from pyVmomi import vim
 from pyVmomi import vmodl
 
+from pyvmomi_tools.extensions import profiling
+
+# how often a wait with a cancel_token checks the token, in seconds
+CANCEL_CHECK_SECONDS = 1
+
+
+class TaskTimeoutError(Exception):
+    """Raised when a task is still running at its wait's deadline."""
+
+    def __init__(self, task):
+        super(TaskTimeoutError, self).__init__(
+            'gave up waiting for task %s' % task)
+        self.task = task
+
+
+class TaskCancelledError(Exception):
+    """Raised when a wait is abandoned through its cancellation token."""
+
+    def __init__(self, task):
+        super(TaskCancelledError, self).__init__(
+            'stopped waiting for task %s' % task)
+        self.task = task
+
+
+class CancellationToken(object):
+    """A thread safe flag used to abandon waits from another thread.
+
+    code::
+        token = CancellationToken()
+        worker = threading.Thread(target=task.wait,
+                                  kwargs={'cancel_token': token})
+        worker.start()
+        ...
+        token.cancel()  # the wait raises TaskCancelledError
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def wait(self, timeout=None):
+        """Sleep until cancelled or timeout seconds have passed.
+
+        :rtype types.BooleanType:
+        :return: True when cancelled.
+        """
+        return self._event.wait(timeout)
+
+
+def _deadline(kwargs):
+    # the earliest of the timeout and deadline kwargs as a time.time() value
+    deadline = kwargs.get('deadline')
+    timeout = kwargs.get('timeout')
+    if timeout is not None:
+        expires = time.time() + timeout
+        deadline = expires if deadline is None else min(deadline, expires)
+    return deadline
+
+
+def _record(stats, task, info):
+    # the TaskInfo from the update is complete when its state is final,
+    # only fetch it when all we saw was the state
+    if info is None or info.completeTime is None:
+        info = task.info
+    stats.record_info(info)
+
+
+def _no_op(task, *args):
+    pass
+
+
+def _callback(kwargs, name, span_name='task.callback'):
+    # the callback for kwargs[name], run in a span while profiling
+    callback = kwargs.get(name, _no_op)
+    if callback is _no_op or not profiling.enabled():
+        return callback
+
+    def profiled(*args):
+        with profiling.span(span_name, state=name):
+            return callback(*args)
+    return profiled
+
+
+def _give_up(task, error, cancel_task):
+    if cancel_task:
+        try:
+            task.CancelTask()
+        except vmodl.MethodFault:
+            # not cancelable or already complete, the error still stands
+            pass
+    raise error
+
 
 def build_task_filter(task):
     """A helper that builds a filter for a particular task object.
@@ -46,6 +146,7 @@ def build_task_filter(task):
     return filter
 
 
+@profiling.traced('task.wait')
 def wait_for_task(task, *args, **kwargs):
     """A helper method for blocking 'wait' based on the task class.
 
@@ -92,45 +193,99 @@ def wait_for_task(task, *args, **kwargs):
     if the task is observed leaving queued and entering running, then the
     callback for 'running' is fired.
 
+    use with a timeout
+    ==================
+
+    code::
+        rename_task.wait(timeout=60, cancel_task=True)
+
+    Gives up with TaskTimeoutError once 60 seconds have passed, asking the
+    server to cancel the task first. The server side wait is bounded with
+    WaitForUpdatesEx maxWaitSeconds so the thread is never stuck past the
+    deadline. An absolute time.time() value may be passed as deadline
+    instead, and a CancellationToken as cancel_token to abandon the wait
+    from another thread with TaskCancelledError.
+
+    recording timing statistics
+    ===========================
+
+    code::
+        rename_task.wait(stats=task_stats.TaskStats())
+
+    On completion the task's queue time, run time and notification lag are
+    recorded into the given TaskStats, see the task_stats module.
+
     :type task: vim.Task
     :param task: any subclass of the vim.Task object
 
     :rtype None: returns or raises exception
 
     :raises vim.RuntimeFault:
+    :raises TaskTimeoutError: when the timeout or deadline passes.
+    :raises TaskCancelledError: when cancel_token is cancelled.
     """
 
-    def no_op(task, *args):
-        pass
+    deadline = _deadline(kwargs)
+    cancel_token = kwargs.get('cancel_token')
+    cancel_task = kwargs.get('cancel_task', False)
+    stats = kwargs.get('stats')
 
-    queued_callback = kwargs.get('queued', no_op)
-    running_callback = kwargs.get('running', no_op)
-    success_callback = kwargs.get('success', no_op)
-    error_callback = kwargs.get('error', no_op)
+    queued_callback = _callback(kwargs, 'queued')
+    running_callback = _callback(kwargs, 'running')
+    success_callback = _callback(kwargs, 'success')
+    error_callback = _callback(kwargs, 'error')
 
     si = connect.GetSi()
     pc = si.content.propertyCollector
     filter = build_task_filter(task)
 
     try:
-        version, state = None, None
+        version, state, info = None, None, None
 
         # Loop looking for updates till the state moves to a completed state.
         waiting = True
         while waiting:
-            update = pc.WaitForUpdates(version)
+            max_wait = None
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    _give_up(task, TaskTimeoutError(task), cancel_task)
+                max_wait = int(math.ceil(remaining))
+            if cancel_token is not None:
+                if cancel_token.cancelled:
+                    _give_up(task, TaskCancelledError(task), cancel_task)
+                max_wait = min(max_wait or CANCEL_CHECK_SECONDS,
+                               CANCEL_CHECK_SECONDS)
+
+            with profiling.span('task.update', max_wait=max_wait):
+                if max_wait is None:
+                    update = pc.WaitForUpdates(version)
+                else:
+                    update = pc.WaitForUpdatesEx(
+                        version,
+                        vmodl.query.PropertyCollector.WaitOptions(
+                            maxWaitSeconds=max_wait))
+            if update is None:
+                # nothing changed within max_wait, re-check the limits
+                continue
             version = update.version
             for filterSet in update.filterSet:
                 for objSet in filterSet.objectSet:
                     task = objSet.obj
                     for change in objSet.changeSet:
                         if change.name == 'info':
+                            info = change.val
                             state = change.val.state
                         elif change.name == 'info.state':
                             state = change.val
                         else:
                             continue
 
+                        if (stats is not None and state in
+                                (vim.TaskInfo.State.success,
+                                 vim.TaskInfo.State.error)):
+                            _record(stats, task, info)
+
                         if state == vim.TaskInfo.State.success:
                             success_callback(task, *args)
                             waiting = False
@@ -150,6 +305,7 @@ def wait_for_task(task, *args, **kwargs):
             filter.Destroy()
 
 
+@profiling.traced('task.poll')
 def poll_task(task, *args, **kwargs):
     """A helper method for polling state changes on the task class.
 
@@ -254,25 +410,38 @@ def poll_task(task, *args, **kwargs):
     appearing on the VM's runtime. Use a periodic task to poll for such a
     change in state and handle things.
 
+    Limiting the wait
+    =================
+    code::
+        power_on_task.poll(timeout=300, cancel_task=True)
+
+    timeout, deadline, cancel_token and cancel_task work as they do for
+    wait_for_task. The sleep between polls is cut short at the deadline and
+    when cancel_token is cancelled.
+    So does stats, recording the task's timings on completion.
+
     :type task: vim.Task
     :param task: any subclass of the vim.Task object
 
     :rtype None: returns or raises exception
 
     :raises vim.RuntimeFault:
+    :raises TaskTimeoutError: when the timeout or deadline passes.
+    :raises TaskCancelledError: when cancel_token is cancelled.
     """
 
-    def no_op(task, *args):
-        pass
-
     sleep_seconds = kwargs.get('sleep_seconds', 1)
+    deadline = _deadline(kwargs)
+    cancel_token = kwargs.get('cancel_token')
+    cancel_task = kwargs.get('cancel_task', False)
+    stats = kwargs.get('stats')
 
-    queued_callback = kwargs.get('queued', no_op)
-    running_callback = kwargs.get('running', no_op)
-    success_callback = kwargs.get('success', no_op)
-    error_callback = kwargs.get('error', no_op)
+    queued_callback = _callback(kwargs, 'queued')
+    running_callback = _callback(kwargs, 'running')
+    success_callback = _callback(kwargs, 'success')
+    error_callback = _callback(kwargs, 'error')
 
-    periodic_callback = kwargs.get('periodic', no_op)
+    periodic_callback = _callback(kwargs, 'periodic')
 
     last_state = None
     while True:
@@ -281,6 +450,10 @@ def poll_task(task, *args, **kwargs):
         if last_state != task.info.state:
             last_state = task.info.state
 
+            if stats is not None and last_state in (
+                    vim.TaskInfo.State.success, vim.TaskInfo.State.error):
+                _record(stats, task, None)
+
             if last_state == vim.TaskInfo.State.success:
                 success_callback(task, *args)
                 return
@@ -295,8 +468,195 @@ def poll_task(task, *args, **kwargs):
                 error_callback(task, *args)
                 raise task.info.error
 
-        if sleep_seconds is not None:
-            time.sleep(sleep_seconds)
+        if cancel_token is not None and cancel_token.cancelled:
+            _give_up(task, TaskCancelledError(task), cancel_task)
+
+        sleep = sleep_seconds
+        if deadline is not None:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                _give_up(task, TaskTimeoutError(task), cancel_task)
+            sleep = min(sleep or 0, remaining)
+
+        if sleep is not None:
+            with profiling.span('task.sleep'):
+                if cancel_token is None:
+                    time.sleep(sleep)
+                elif cancel_token.wait(sleep):
+                    # cancelled while sleeping, no need to poll again
+                    _give_up(task, TaskCancelledError(task), cancel_task)
+
+
+class TaskMonitor(object):
+    """Tracks the completion of many tasks with a single update loop.
+
+    Waiting on each task with wait_for_task ties up one thread and one
+    WaitForUpdates call per task. A TaskMonitor owns a private property
+    collector, adds a small filter per task and runs one WaitForUpdatesEx
+    loop on a background thread. When a task reaches success or error its
+    callback fires from that thread and the task's filter is destroyed.
+
+    code::
+        monitor = TaskMonitor()
+        monitor.start()
+        for vm in vms:
+            monitor.add(vm.PowerOn(), on_done)
+        monitor.wait()
+        monitor.stop()
+
+    Callbacks are called as callback(task, state, error) where error is the
+    task's fault or None. Callbacks must not raise.
+    """
+
+    # TaskInfo paths needed for TaskStats.record
+    _STATS_PATHS = ['info.descriptionId', 'info.entity', 'info.queueTime',
+                    'info.startTime', 'info.completeTime']
+
+    def __init__(self, si=None, max_wait_seconds=1, stats=None):
+        """
+        :type si: vim.ServiceInstance
+        :param si: the connection the tasks belong to, default GetSi().
+
+        :type max_wait_seconds: types.IntType
+        :param max_wait_seconds: the longest a single WaitForUpdatesEx call \
+        blocks, bounds how long stop() takes.
+
+        :type stats: task_stats.TaskStats
+        :param stats: record the timings of every completed task here, the \
+        timestamps come with the same updates as the state.
+        """
+        if si is None:
+            si = connect.GetSi()
+        collector = si.content.propertyCollector
+        self._pc = collector.CreatePropertyCollector()
+        self._wait_options = vmodl.query.PropertyCollector.WaitOptions(
+            maxWaitSeconds=max_wait_seconds)
+        self._lock = threading.Condition()
+        self._pending = {}
+        self._stopping = False
+        self._thread = None
+        self._stats = stats
+        # task id -> latest value per path, only touched by the loop thread
+        self._values = {}
+        self._path_set = ['info.state', 'info.error']
+        if stats is not None:
+            self._path_set += self._STATS_PATHS
+        self.error = None
+
+    def add(self, task, callback):
+        """Start tracking a task.
+
+        :type task: vim.Task
+        :param task: the task to track.
+
+        :type callback: types.FunctionType
+        :param callback: called as callback(task, state, error) once the \
+        task has completed.
+        """
+        collector = vmodl.query.PropertyCollector
+        filter_spec = collector.FilterSpec(
+            objectSet=[collector.ObjectSpec(obj=task)],
+            propSet=[collector.PropertySpec(type=vim.Task,
+                                            pathSet=self._path_set)])
+        with self._lock:
+            if self.error is not None:
+                raise self.error
+            self._pending[task.id] = (task, callback, None)
+        pfilter = self._pc.CreateFilter(filter_spec, True)
+        with self._lock:
+            if task.id in self._pending:
+                self._pending[task.id] = (task, callback, pfilter)
+            else:
+                # completed before CreateFilter returned
+                pfilter.Destroy()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+    def start(self):
+        """Run the update loop on a daemon thread."""
+        # the loop's spans belong to whatever span started the monitor
+        self._thread = threading.Thread(target=self._run,
+                                        args=(profiling.current(),))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def wait(self):
+        """Block until every task added so far has completed."""
+        with self._lock:
+            while self._pending and self.error is None:
+                self._lock.wait(1)
+            if self.error is not None:
+                raise self.error
+
+    def stop(self):
+        """Stop the update loop and destroy the private property collector.
+        """
+        self._stopping = True
+        if self._thread is not None:
+            self._thread.join()
+        try:
+            self._pc.Destroy()
+        except vmodl.MethodFault:
+            pass
+
+    def _complete(self, task_id, state, error, destroy=True):
+        with self._lock:
+            task, callback, pfilter = self._pending.pop(task_id,
+                                                        (None, None, None))
+            self._lock.notify_all()
+        if task is None:
+            return
+        if destroy and pfilter is not None:
+            pfilter.Destroy()
+        with profiling.span('task_monitor.callback', state=str(state)):
+            callback(task, state, error)
+
+    def _run(self, parent=None):
+        with profiling.span('task_monitor', parent=parent):
+            self._loop()
+
+    def _loop(self):
+        version = None
+        try:
+            while not self._stopping:
+                with profiling.span('task_monitor.update'):
+                    update = self._pc.WaitForUpdatesEx(version,
+                                                       self._wait_options)
+                if update is None:
+                    continue
+                version = update.version
+                for filter_set in update.filterSet:
+                    for obj_set in filter_set.objectSet:
+                        self._handle(obj_set)
+        except Exception as e:
+            # fail everything still pending so no one waits forever
+            with self._lock:
+                self.error = e
+                pending = list(self._pending.keys())
+            self._values.clear()
+            for task_id in pending:
+                self._complete(task_id, None, e, destroy=False)
+
+    def _handle(self, obj_set):
+        if obj_set.kind == 'leave':
+            self._values.pop(obj_set.obj.id, None)
+            return
+        # updates after the first only carry what changed, keep the rest
+        values = self._values.setdefault(obj_set.obj.id, {})
+        for change in obj_set.changeSet:
+            values[change.name] = change.val
+        state = values.get('info.state')
+        if state in (vim.TaskInfo.State.success, vim.TaskInfo.State.error):
+            del self._values[obj_set.obj.id]
+            if self._stats is not None:
+                self._stats.record(values.get('info.descriptionId'),
+                                   values.get('info.entity'),
+                                   values.get('info.queueTime'),
+                                   values.get('info.startTime'),
+                                   values.get('info.completeTime'))
+            self._complete(obj_set.obj.id, state, values.get('info.error'))
 
 
 # NOTE: This kind of injection usually goes at the *bottom* of a file.
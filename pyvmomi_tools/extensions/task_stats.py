@@ -0,0 +1,217 @@
+# Copyright (c) 2014 VMware, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module implements task lifecycle timing statistics.
+
+A task's TaskInfo carries queueTime, startTime and completeTime. From them a
+TaskStats records, per task type (descriptionId) and entity type:
+
+* queue: startTime - queueTime, time spent waiting in the server's queue
+* run: completeTime - startTime, time spent executing
+* lag: when the client saw the completion minus completeTime, the delay
+  added by notification and the client itself
+
+code::
+    stats = TaskStats()
+    vm.PowerOn().wait(stats=stats)
+    monitor = TaskMonitor(stats=stats)
+    ...
+    print stats.snapshot()
+    print stats.prometheus_text()
+
+Lag compares the client clock against the server's. Pass the result of
+measure_clock_offset(si) as clock_offset to correct for skew.
+"""
+__author__ = "VMware, Inc."
+
+import datetime
+import threading
+import time
+
+# upper bounds of the histogram buckets in seconds, the last is +Inf
+DEFAULT_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600,
+                   float('inf'))
+
+PHASES = ('queue', 'run', 'lag')
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def _seconds(value):
+    # an aware or naive UTC datetime as seconds since the epoch
+    if value is None:
+        return None
+    if value.tzinfo is not None:
+        value = (value - value.utcoffset()).replace(tzinfo=None)
+    return (value - _EPOCH).total_seconds()
+
+
+def measure_clock_offset(si):
+    """Estimate how far the server clock is ahead of the client clock.
+
+    :type si: vim.ServiceInstance
+    :param si: the connection.
+
+    :rtype types.FloatType:
+    :return: server time minus client time in seconds.
+    """
+    before = time.time()
+    server = _seconds(si.CurrentTime())
+    after = time.time()
+    return server - (before + after) / 2.0
+
+
+class Histogram(object):
+    """A cumulative bucket histogram with a sum and a count."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def as_dict(self):
+        return {'buckets': list(zip(self.buckets, self.counts)),
+                'sum': self.sum,
+                'count': self.count}
+
+
+class TaskStats(object):
+    """Thread safe queue, run and lag histograms keyed by task type."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, clock_offset=0.0):
+        """
+        :type buckets: types.TupleType
+        :param buckets: histogram bucket upper bounds in seconds.
+
+        :type clock_offset: types.FloatType
+        :param clock_offset: server minus client clock, see \
+        measure_clock_offset.
+        """
+        self.buckets = buckets
+        self.clock_offset = clock_offset
+        self._lock = threading.Lock()
+        # (description id, entity type) -> {phase: Histogram}
+        self._histograms = {}
+
+    def record(self, description_id, entity, queue_time, start_time,
+               complete_time, observed=None):
+        """Record one completed task.
+
+        :type description_id: types.StringTypes
+        :param description_id: TaskInfo.descriptionId.
+
+        :type entity: vim.ManagedEntity
+        :param entity: TaskInfo.entity, may be None.
+
+        :type queue_time: datetime.datetime
+        :param queue_time: TaskInfo.queueTime.
+
+        :type start_time: datetime.datetime
+        :param start_time: TaskInfo.startTime, None if it never started.
+
+        :type complete_time: datetime.datetime
+        :param complete_time: TaskInfo.completeTime.
+
+        :type observed: types.FloatType
+        :param observed: time.time() when the client saw the completion, \
+        default now.
+        """
+        if observed is None:
+            observed = time.time()
+        entity_type = entity.__class__.__name__ if entity is not None \
+            else 'None'
+        queued = _seconds(queue_time)
+        started = _seconds(start_time)
+        completed = _seconds(complete_time)
+
+        samples = {}
+        if queued is not None and started is not None:
+            samples['queue'] = started - queued
+        if started is not None and completed is not None:
+            samples['run'] = completed - started
+        if completed is not None:
+            samples['lag'] = max(0.0, observed + self.clock_offset -
+                                 completed)
+
+        with self._lock:
+            histograms = self._histograms.get((description_id, entity_type))
+            if histograms is None:
+                histograms = dict((phase, Histogram(self.buckets))
+                                  for phase in PHASES)
+                self._histograms[(description_id, entity_type)] = histograms
+            for phase, value in samples.items():
+                histograms[phase].observe(value)
+
+    def record_info(self, info, observed=None):
+        """Record a completed task from its vim.TaskInfo."""
+        self.record(info.descriptionId, info.entity, info.queueTime,
+                    info.startTime, info.completeTime, observed)
+
+    def snapshot(self):
+        """A copy of the current histograms.
+
+        :rtype types.DictType:
+        :return: {(description id, entity type): {phase: {'buckets': \
+        [(bound, cumulative count)], 'sum': seconds, 'count': n}}}
+        """
+        with self._lock:
+            return dict((key, dict((phase, h.as_dict())
+                                   for phase, h in histograms.items()))
+                        for key, histograms in self._histograms.items())
+
+    def prometheus_text(self, prefix='pyvmomi_task'):
+        """The histograms in the Prometheus text exposition format.
+
+        :rtype types.StringTypes:
+        """
+        snapshot = self.snapshot()
+        helps = {'queue': 'Seconds tasks spent queued on the server.',
+                 'run': 'Seconds tasks spent running on the server.',
+                 'lag': 'Seconds from task completion to the client '
+                        'seeing it.'}
+        lines = []
+        for phase in PHASES:
+            metric = '%s_%s_seconds' % (prefix, phase)
+            lines.append('# HELP %s %s' % (metric, helps[phase]))
+            lines.append('# TYPE %s histogram' % metric)
+            # a task without a descriptionId has None, which does not sort
+            # against strings
+            keys = sorted(snapshot,
+                          key=lambda k: tuple(x or '' for x in k))
+            for (description_id, entity_type) in keys:
+                histogram = snapshot[(description_id, entity_type)][phase]
+                labels = 'description_id="%s",entity_type="%s"' % (
+                    _escape(description_id), _escape(entity_type))
+                for bound, count in histogram['buckets']:
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append('%s_bucket{%s,le="%s"} %d' %
+                                 (metric, labels, le, count))
+                lines.append('%s_sum{%s} %r' %
+                             (metric, labels, histogram['sum']))
+                lines.append('%s_count{%s} %d' %
+                             (metric, labels, histogram['count']))
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
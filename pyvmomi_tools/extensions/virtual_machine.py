@@ -47,12 +47,392 @@ hard_reboot
 
 A blocking call to the ResetVM_Task method. Relies on the task extensions.
 
+queue_reconfig
+--------------
+
+code::
+    batcher = ReconfigBatcher(max_concurrency=16)
+    for vm in vms:
+        vm.queue_reconfig(batcher, memoryMB=4096)
+        vm.queue_reconfig(batcher, numCPUs=2)
+        vm.queue_reconfig(batcher, extraConfig=[
+            vim.option.OptionValue(key='foo', value='bar')])
+    results = batcher.flush()
+
+Queues config edits per virtual machine. Edits to the same machine are
+merged into one VirtualMachineConfigSpec, and flush submits a single
+ReconfigVM_Task per machine with bounded concurrency. Setting a field to two
+different values, or editing one device twice, raises ReconfigConflict.
+
+bulk_clone
+----------
+
+code::
+    results, per_minute = template.bulk_clone(
+        ['web-%03d' % i for i in range(200)], vm_folder,
+        hosts=cluster.host, datastores=cluster.datastore,
+        max_per_datastore=4)
+
+Clones a template many times, spreading the clones round robin across the
+hosts and to the least busy datastore, with at most max_per_datastore clones
+writing to any one datastore. Pass a snapshot for linked clones. Returns a
+CloneResult per clone and the sustained clones per minute.
+
 """
 __author__ = "VMware, Inc."
 
+import collections
+import copy
+import threading
+import time
+
 from pyVmomi import vim
+from pyVmomi import vmodl
+
+from pyvmomi_tools.extensions import task as task_extensions
+
+
+class ReconfigConflict(ValueError):
+    """Raised when queued edits set the same setting to different values."""
+
+
+def _same(a, b):
+    # pyVmomi data objects do not compare by value, their repr does
+    if isinstance(a, vmodl.DynamicData):
+        return repr(a) == repr(b)
+    return a == b
+
+
+def _unset(value):
+    return value is None or (isinstance(value, list) and not value)
+
+
+def _merged(path, current, value):
+    """current with the set fields of value, nested data objects such as
+    cpuAllocation merged field by field.
+
+    :raises ReconfigConflict: when a field is set to two different values.
+    """
+    if current is None:
+        return value
+    if not (isinstance(current, vmodl.DynamicData) and
+            type(current) is type(value)):
+        if not _same(current, value):
+            raise ReconfigConflict('%s set to %r and %r' %
+                                   (path, current, value))
+        return current
+    merged = type(current)()
+    for prop in current._GetPropertyList():
+        name = prop.name
+        if name in ('dynamicType', 'dynamicProperty'):
+            continue
+        old, new = getattr(current, name), getattr(value, name)
+        if _unset(new):
+            setattr(merged, name, old)
+        elif _unset(old):
+            setattr(merged, name, new)
+        else:
+            setattr(merged, name, _merged('%s.%s' % (path, name), old, new))
+    return merged
+
+
+def _device_changes(queued, changes):
+    """changes, ready to append to the queued deviceChange entries.
+
+    An existing device may only be edited or removed once per batch. New
+    devices carry temporary negative keys that separately built edits often
+    share, colliding ones are renumbered below every key in use, along with
+    the controllerKey references to them from the same edit.
+
+    :raises ReconfigConflict:
+    """
+    add = vim.vm.device.VirtualDeviceSpec.Operation.add
+    edited = set(c.device.key for c in queued if c.operation != add)
+    added = set(c.device.key for c in queued if c.operation == add)
+    lowest = min([c.device.key for c in list(queued) + list(changes)
+                  if c.device.key is not None] + [0])
+    renumbered = {}
+    for change in changes:
+        key = change.device.key
+        if change.operation != add:
+            if key in edited:
+                raise ReconfigConflict('device %s changed twice' % key)
+            edited.add(key)
+        elif key is not None and key < 0 and key in added:
+            lowest -= 1
+            renumbered[key] = lowest
+    if not renumbered:
+        return list(changes)
+
+    result = []
+    for change in changes:
+        device = change.device
+        if change.operation == add and (device.key in renumbered or
+                                        device.controllerKey in renumbered):
+            # the caller's objects stay as they were
+            change = copy.deepcopy(change)
+            device = change.device
+            if device.key in renumbered:
+                device.key = renumbered[device.key]
+            if device.controllerKey in renumbered:
+                device.controllerKey = renumbered[device.controllerKey]
+        result.append(change)
+    return result
+
+
+def _merge(target, spec):
+    """Merge the set fields of spec into target, in place.
+
+    extraConfig entries merge by key and deviceChange entries append, see
+    _device_changes. Nested data objects merge field by field and any other
+    field may be set again only to the same value.
+
+    :raises ReconfigConflict:
+    """
+    for prop in spec._GetPropertyList():
+        name = prop.name
+        if name in ('dynamicType', 'dynamicProperty'):
+            continue
+        value = getattr(spec, name)
+        if _unset(value):
+            continue
+
+        if name == 'extraConfig':
+            merged = dict((o.key, o) for o in target.extraConfig)
+            for option in value:
+                known = merged.get(option.key)
+                if known is not None and not _same(known.value,
+                                                   option.value):
+                    raise ReconfigConflict(
+                        'extraConfig %s set to %r and %r' %
+                        (option.key, known.value, option.value))
+                merged[option.key] = option
+            target.extraConfig = list(merged.values())
+        elif name == 'deviceChange':
+            target.deviceChange = list(target.deviceChange) + \
+                _device_changes(target.deviceChange, value)
+        elif isinstance(value, list):
+            setattr(target, name, list(getattr(target, name)) + value)
+        else:
+            setattr(target, name, _merged(name, getattr(target, name),
+                                          value))
+
+
+class ReconfigBatcher(object):
+    """Coalesces config edits into one reconfigure task per machine."""
+
+    def __init__(self, max_concurrency=16, si=None):
+        """
+        :type max_concurrency: types.IntType
+        :param max_concurrency: the most reconfigure tasks running at once.
+
+        :type si: vim.ServiceInstance
+        :param si: the connection the machines belong to, default GetSi().
+        """
+        self.max_concurrency = max_concurrency
+        self.si = si
+        self._lock = threading.Lock()
+        # vm id -> (vm, vim.vm.ConfigSpec)
+        self._pending = {}
+
+    def add(self, vm, spec=None, **fields):
+        """Queue an edit for vm.
+
+        :type vm: vim.VirtualMachine
+        :param vm: the machine to reconfigure.
+
+        :type spec: vim.vm.ConfigSpec
+        :param spec: the edit, or pass ConfigSpec fields as keywords.
+
+        :raises ReconfigConflict: when the edit contradicts a queued one, \
+        the queued edits are left unchanged.
+        """
+        if spec is None:
+            spec = vim.vm.ConfigSpec(**fields)
+        with self._lock:
+            queued = self._pending.get(vm.id)
+            merged = vim.vm.ConfigSpec()
+            if queued is not None:
+                _merge(merged, queued[1])
+            _merge(merged, spec)
+            self._pending[vm.id] = (vm, merged)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self):
+        """Submit one reconfigure task per machine and wait for them all.
+
+        :rtype types.DictType:
+        :return: vm id -> (vim.VirtualMachine, vim.TaskInfo.State, fault or \
+        None).
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+
+        results = {}
+        slots = threading.BoundedSemaphore(self.max_concurrency)
+        monitor = task_extensions.TaskMonitor(self.si)
+        monitor.start()
+
+        def done(vm):
+            def callback(task, state, error):
+                results[vm.id] = (vm, state, error)
+                slots.release()
+            return callback
+
+        try:
+            for vm, spec in pending.values():
+                slots.acquire()
+                try:
+                    reconfig_task = vm.ReconfigVM_Task(spec=spec)
+                except vmodl.MethodFault as e:
+                    results[vm.id] = (vm, vim.TaskInfo.State.error, e)
+                    slots.release()
+                    continue
+                monitor.add(reconfig_task, done(vm))
+            monitor.wait()
+        finally:
+            monitor.stop()
+        return results
+
+
+CloneResult = collections.namedtuple('CloneResult',
+                                     ['name', 'host', 'datastore', 'state',
+                                      'error', 'seconds'])
+
+
+def bulk_clone(template, names, folder, hosts, datastores, snapshot=None,
+               max_per_datastore=4, power_on=False, si=None):
+    """Clone template once per name, spread over hosts and datastores.
+
+    Every host should be able to reach every datastore. Clones are started
+    in the order of names, each waiting for a datastore with a free slot, and
+    completions are tracked by a single TaskMonitor.
+
+    :type template: vim.VirtualMachine
+    :param template: the virtual machine or template to clone.
+
+    :type names: types.ListType
+    :param names: one name per clone.
+
+    :type folder: vim.Folder
+    :param folder: the vm folder the clones go in.
+
+    :type hosts: types.ListType
+    :param hosts: vim.HostSystem targets, used round robin.
+
+    :type datastores: types.ListType
+    :param datastores: vim.Datastore targets.
+
+    :type snapshot: vim.vm.Snapshot
+    :param snapshot: make linked clones off this snapshot of template.
+
+    :type max_per_datastore: types.IntType
+    :param max_per_datastore: the most clones in flight per datastore.
+
+    :type power_on: types.BooleanType
+    :param power_on: power the clones on once created.
+
+    :type si: vim.ServiceInstance
+    :param si: the connection, default GetSi().
+
+    :rtype types.TupleType:
+    :return: the list of CloneResult in the order of names and the clones \
+    per minute achieved.
+
+    :raises ValueError: when names, hosts or datastores is empty, or \
+    max_per_datastore is less than 1.
+    """
+    names = list(names)
+    hosts = list(hosts)
+    datastores = list(datastores)
+    if not names:
+        raise ValueError('no names to clone to')
+    if not hosts:
+        raise ValueError('no hosts to clone to')
+    if not datastores:
+        raise ValueError('no datastores to clone to')
+    if max_per_datastore < 1:
+        raise ValueError('max_per_datastore must be at least 1')
+    # one resource pool lookup per host rather than per clone
+    pools = dict((h.id, h.parent.resourcePool) for h in hosts)
+
+    lock = threading.Condition()
+    in_flight = dict((d.id, 0) for d in datastores)
+    assigned = dict((d.id, 0) for d in datastores)
+    results = [None] * len(names)
+
+    def place():
+        # least busy datastore with a free slot, ties go to the least used
+        with lock:
+            while True:
+                free = [d for d in datastores
+                        if in_flight[d.id] < max_per_datastore]
+                if free:
+                    datastore = min(free, key=lambda d: (in_flight[d.id],
+                                                         assigned[d.id]))
+                    in_flight[datastore.id] += 1
+                    assigned[datastore.id] += 1
+                    return datastore
+                lock.wait()
+
+    def release(datastore):
+        with lock:
+            in_flight[datastore.id] -= 1
+            lock.notify_all()
+
+    def done(index, name, host, datastore, started):
+        def callback(task, state, error):
+            results[index] = CloneResult(name, host, datastore, state, error,
+                                         time.time() - started)
+            release(datastore)
+        return callback
+
+    monitor = task_extensions.TaskMonitor(si)
+    monitor.start()
+    began = time.time()
+    try:
+        for index, name in enumerate(names):
+            host = hosts[index % len(hosts)]
+            datastore = place()
+            relocate = vim.vm.RelocateSpec(host=host, datastore=datastore,
+                                           pool=pools[host.id])
+            if snapshot is not None:
+                relocate.diskMoveType = 'createNewChildDiskBacking'
+            spec = vim.vm.CloneSpec(location=relocate, snapshot=snapshot,
+                                    powerOn=power_on, template=False)
+            started = time.time()
+            try:
+                clone_task = template.CloneVM_Task(folder=folder, name=name,
+                                                   spec=spec)
+            except vmodl.MethodFault as e:
+                results[index] = CloneResult(name, host, datastore,
+                                             vim.TaskInfo.State.error, e, 0.0)
+                release(datastore)
+                continue
+            monitor.add(clone_task,
+                        done(index, name, host, datastore, started))
+        monitor.wait()
+    finally:
+        monitor.stop()
+
+    elapsed = time.time() - began
+    # a clone whose task never reported back has no result
+    succeeded = sum(1 for r in results
+                    if r is not None and r.state == vim.TaskInfo.State.success)
+    return results, (succeeded * 60.0 / elapsed if elapsed else 0.0)
+
+
+def queue_reconfig(vm, batcher, spec=None, **fields):
+    """Queue a config edit for this machine on batcher, see ReconfigBatcher.
+    """
+    batcher.add(vm, spec, **fields)
 
 vim.VirtualMachine.power_on = lambda self: self.PowerOn().wait()
 vim.VirtualMachine.power_off = lambda self: self.PowerOff().wait()
 vim.VirtualMachine.soft_reboot = lambda self: self.RebootGuest()
-vim.VirtualMachine.hard_reboot = lambda self: self.ResetVM().wait()
+vim.VirtualMachine.hard_reboot = lambda self: self.ResetVM_Task().wait()
+vim.VirtualMachine.queue_reconfig = queue_reconfig
+vim.VirtualMachine.bulk_clone = bulk_clone
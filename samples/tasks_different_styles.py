@@ -1,10 +1,8 @@
 from __future__ import print_function
 
-import atexit
 import argparse
 import sys
 
-from pyVim import connect
 from pyVmomi import vim
 
 from pyvmomi_tools import cli
@@ -25,12 +23,8 @@ def get_args():
 
 args = get_args()
 
-# form a connection...
-si = connect.SmartConnect(host=args.host, user=args.user, pwd=args.password,
-                          port=args.port)
-
-# doing this means you don't need to remember to disconnect your script/objects
-atexit.register(connect.Disconnect, si)
+# form a connection, disconnecting at exit unless --session-cache is given
+si = cli.session.connect(args)
 
 
 # search the whole inventory tree recursively... a brutish but effective tactic
@@ -20,13 +20,11 @@ of tasks in an asynchronous way. And how to answer virtual machine
 questions in the middle of power operations.
 """
 
-import atexit
 import argparse
 from six import PY2
 import sys
 import textwrap
 
-from pyVim import connect
 from pyVmomi import vim
 
 from pyvmomi_tools import cli
@@ -50,12 +48,8 @@ def get_args():
 
 args = get_args()
 
-# form a connection...
-si = connect.SmartConnect(host=args.host, user=args.user, pwd=args.password,
-                          port=args.port)
-
-# doing this means you don't need to remember to disconnect your script/objects
-atexit.register(connect.Disconnect, si)
+# form a connection, disconnecting at exit unless --session-cache is given
+si = cli.session.connect(args)
 
 # search the whole inventory tree recursively... a brutish but effective tactic
 vm = si.content.rootFolder.find_by_name(args.name)
@@ -34,8 +34,16 @@ setup(name='pyvmomi-tools',
       author='VMware, Inc.',
       author_email='hartsocks@vmware.com',
       url='https://github.com/vmware/pyvmomi-tools',
-      packages=['pyvmomi_tools'],
+      packages=['pyvmomi_tools',
+                'pyvmomi_tools.cli',
+                'pyvmomi_tools.extensions'],
+      entry_points={
+          'console_scripts': [
+              'pyvmomi-tools = pyvmomi_tools.cli.main:main',
+          ],
+      },
       install_requires=required,
+      extras_require={'metrics': ['numpy']},
       dependency_links=['https://github.com/vmware/pyvmomi',
                         'https://github.com/kevin1024/vcrpy'],
       license='Apache',
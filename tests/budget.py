@@ -0,0 +1,242 @@
+# Copyright (c) 2014 VMware, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Round trip budgets for the hot paths, replayed from recorded SOAP traffic.
+
+Each test records its own cassette: logging in, then the operations under
+test. The number of HTTP round trips and the bytes sent and received by each
+measured operation are kept in fixtures/budgets.json. Replaying checks both
+exactly, a change that adds a call fails with vcrpy refusing an unrecorded
+request and one that drops a call fails the budget. No server is needed to
+replay.
+
+The committed cassettes were recorded against the in-process stand-in in
+fake_vcenter.py. To re-record, after a change that is meant to alter the
+traffic, delete the cassettes and run the tests with
+
+code::
+    PYVMOMI_TOOLS_RECORD_HOST=stand-in python -m unittest discover -s tests
+
+To record against a lab vCenter instead, create a powered off virtual
+machine named VM_NAME and run
+
+code::
+    PYVMOMI_TOOLS_RECORD_HOST=vcenter.example.com \
+    PYVMOMI_TOOLS_RECORD_USER=administrator@vsphere.local \
+    PYVMOMI_TOOLS_RECORD_PASSWORD=secret \
+    python -m unittest discover -s tests
+
+The password is scrubbed from the recording. Tests without a cassette are
+skipped when not recording.
+"""
+__author__ = "VMware, Inc."
+
+import contextlib
+import json
+import os
+import re
+
+import testtools
+import vcr
+from six.moves import http_client
+
+from pyVim import connect
+from pyVmomi import SoapAdapter
+
+from tests import fake_vcenter
+
+VM_NAME = 'pyvmomi-tools-budget'
+ANNOTATION = 'pyvmomi-tools round trip budget'
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+CASSETTES = os.path.join(FIXTURES, 'cassettes')
+BUDGETS = os.path.join(FIXTURES, 'budgets.json')
+
+# PYVMOMI_TOOLS_RECORD_HOST value that records against fake_vcenter
+STAND_IN = 'stand-in'
+
+SCRUBBED_PASSWORD = 'scrubbed'
+_PASSWORD = re.compile(br'(<password(?:\s[^>]*)?>).*?(</password>)', re.DOTALL)
+
+
+def _recording():
+    host = os.environ.get('PYVMOMI_TOOLS_RECORD_HOST')
+    if not host:
+        return None
+    if host == STAND_IN:
+        return {'protocol': 'http', 'host': '127.0.0.1', 'port': None,
+                'user': 'budget', 'password': 'budget'}
+    return {'protocol': 'https',
+            'host': host,
+            'port': int(os.environ.get('PYVMOMI_TOOLS_RECORD_PORT', 443)),
+            'user': os.environ['PYVMOMI_TOOLS_RECORD_USER'],
+            'password': os.environ['PYVMOMI_TOOLS_RECORD_PASSWORD']}
+
+
+def _scrub(request):
+    if request.body:
+        request.body = _PASSWORD.sub(
+            br'\g<1>' + SCRUBBED_PASSWORD.encode() + br'\g<2>',
+            request.body)
+    return request
+
+
+def _load_budgets():
+    try:
+        with open(BUDGETS) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {'connections': {}, 'budgets': {}}
+
+
+def _save_budgets(budgets):
+    with open(BUDGETS, 'w') as f:
+        json.dump(budgets, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+recorder = vcr.VCR(cassette_library_dir=CASSETTES,
+                   serializer='yaml',
+                   record_mode='none',
+                   match_on=['method', 'scheme', 'host', 'port', 'path',
+                             'body'],
+                   before_record_request=_scrub,
+                   decode_compressed_response=True)
+
+
+def _size(request, response):
+    return len(request.body or b'') + len(response['body']['string'] or b'')
+
+
+class Meter(object):
+    """Counts the round trips and bytes of a cassette as it is used."""
+
+    def __init__(self, cassette, recording):
+        self.cassette = cassette
+        self.recording = recording
+
+    def totals(self):
+        """Round trips and bytes so far.
+
+        :rtype types.TupleType:
+        """
+        if self.recording:
+            played = [(request, response, 1)
+                      for request, response in self.cassette.data]
+        else:
+            played = [(self.cassette.data[index][0],
+                       self.cassette.data[index][1], count)
+                      for index, count in self.cassette.play_counts.items()]
+        return (sum(count for _, _, count in played),
+                sum(count * _size(request, response)
+                    for request, response, count in played))
+
+
+class FakeClock(object):
+    """Stands in for the time module, sleeping moves the clock instead."""
+
+    def __init__(self, now=1388534400.0):
+        self.now = now
+        self.slept = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@contextlib.contextmanager
+def _connection_classes():
+    # pyVmomi and pyVim bound the connection classes when they were
+    # imported, point them at the ones vcrpy has just patched in
+    modules = (SoapAdapter, connect)
+    bound = [(m.HTTPConnection, m.HTTPSConnection) for m in modules]
+    for module in modules:
+        module.HTTPConnection = http_client.HTTPConnection
+        module.HTTPSConnection = http_client.HTTPSConnection
+    try:
+        yield
+    finally:
+        for module, (http, https) in zip(modules, bound):
+            module.HTTPConnection, module.HTTPSConnection = http, https
+
+
+class BudgetTestCase(testtools.TestCase):
+    """Base for tests that hold operations to a recorded budget."""
+
+    @contextlib.contextmanager
+    def session(self, name):
+        """Log in inside the cassette name and yield the service instance.
+
+        The login itself is not measured.
+        """
+        recording = _recording()
+        budgets = _load_budgets()
+        path = os.path.join(CASSETTES, name + '.yaml')
+        stand_in = None
+        if recording is None:
+            connection = budgets['connections'].get(name)
+            if not os.path.exists(path) or connection is None:
+                self.skipTest('no recording for %s, see tests/budget.py' %
+                              name)
+            target = dict(connection, password=SCRUBBED_PASSWORD)
+        else:
+            target = recording
+            if target['port'] is None:
+                stand_in = fake_vcenter.FakeVCenter(VM_NAME).start()
+                self.addCleanup(stand_in.stop)
+                target = dict(target, port=stand_in.port)
+
+        mode = 'once' if recording is not None else 'none'
+        with recorder.use_cassette(name + '.yaml',
+                                   record_mode=mode) as cassette:
+            with _connection_classes():
+                si = connect.SmartConnect(protocol=target['protocol'],
+                                          host=target['host'],
+                                          port=target['port'],
+                                          user=target['user'],
+                                          pwd=target['password'],
+                                          disableSslCertValidation=True)
+                self._meter = Meter(cassette, recording is not None)
+                self._budgets = budgets
+                try:
+                    yield si
+                finally:
+                    connect.Disconnect(si)
+
+        if recording is not None:
+            budgets['connections'][name] = dict(
+                (key, target[key])
+                for key in ('protocol', 'host', 'port', 'user'))
+            _save_budgets(budgets)
+        else:
+            self.assertTrue(cassette.all_played,
+                            '%s made fewer calls than recorded' % name)
+
+    @contextlib.contextmanager
+    def budget(self, name):
+        """Hold the calls made in the block to the budget called name."""
+        trips, size = self._meter.totals()
+        yield
+        end_trips, end_size = self._meter.totals()
+        spent = {'round_trips': end_trips - trips,
+                 'bytes': end_size - size}
+        if self._meter.recording:
+            self._budgets['budgets'][name] = spent
+        else:
+            self.assertEqual(self._budgets['budgets'].get(name), spent,
+                             'round trip budget of %s changed' % name)
@@ -0,0 +1,545 @@
+# Copyright (c) 2014 VMware, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+An in-process stand-in for a vCenter, enough of one to record the round trip
+budget cassettes against.
+
+FakeVCenter serves the SOAP API over plain HTTP on a local port. Requests
+are parsed and responses written with pyVmomi's own serializers, so the
+traffic is what a client sends and receives, and everything it answers is
+deterministic: the same calls give the same bytes on every run.
+
+The inventory is one datacenter holding two folders of virtual machines, one
+of them named budget.VM_NAME. Supported are logging in and out, Fetch of any
+property, RetrievePropertiesEx over traversal specs, property filters with
+WaitForUpdates and WaitForUpdatesEx, ReconfigVM_Task, which only records the
+annotation, and the power tasks.
+
+Tasks move from queued to running to success one step each time a client
+looks at them, through a Fetch of info or an update, so waits need a fixed
+number of calls rather than a fixed amount of time.
+"""
+__author__ = "VMware, Inc."
+
+import copy
+import datetime
+import threading
+from xml.parsers.expat import ParserCreate
+
+from six.moves import BaseHTTPServer
+from six.moves import socketserver
+
+from pyVmomi import SoapAdapter
+from pyVmomi import VmomiSupport
+from pyVmomi import vim
+from pyVmomi import vmodl
+
+# the API version offered, pinned so requests do not change with pyVmomi
+VERSION = 'vim.version.v8_0_0_0'
+NAMESPACE = 'urn:vim25'
+SESSION_COOKIE = 'vmware_soap_session="52a1b2c3-fake-session"'
+
+# every timestamp the stand-in hands out
+EPOCH = datetime.datetime(2014, 1, 1)
+
+_TASK_STATES = [vim.TaskInfo.State.queued, vim.TaskInfo.State.running,
+                vim.TaskInfo.State.success]
+
+_FETCH_PARAMS = [VmomiSupport.Object(name='prop', type=str, version=VERSION,
+                                     flags=0)]
+
+
+class _Fault(Exception):
+
+    def __init__(self, fault):
+        super(_Fault, self).__init__(fault)
+        self.fault = fault
+
+
+class _RequestDeserializer(SoapAdapter.ExpatDeserializerNSHandlers):
+    """Parses a SOAP request into its method name, _this and arguments."""
+
+    def __init__(self):
+        SoapAdapter.ExpatDeserializerNSHandlers.__init__(self)
+        self.method = None
+        self.params = {}
+        self.args = {}
+        self._parsers = []
+
+    def parse(self, body):
+        self.parser = ParserCreate(namespace_separator=SoapAdapter.NS_SEP)
+        self.parser.buffer_text = True
+        SoapAdapter.SetHandlers(self.parser, SoapAdapter.GetHandlers(self))
+        self.parser.Parse(body, True)
+        for name, deserializer in self._parsers:
+            value = deserializer.GetResult()
+            if issubclass(self.params[name], list):
+                self.args.setdefault(name, self.params[name]()).append(value)
+            else:
+                self.args[name] = value
+        return self.method, self.args
+
+    def StartElementHandler(self, tag, attr):
+        ns, name = tag.rsplit(SoapAdapter.NS_SEP, 1) \
+            if SoapAdapter.NS_SEP in tag else ('', tag)
+        if ns == SoapAdapter.XMLNS_SOAPENV:
+            return
+        if self.method is None:
+            self.method = name
+            self.params = {'_this': VmomiSupport.ManagedObject}
+            if name == 'Fetch':
+                params = _FETCH_PARAMS
+            else:
+                params = VmomiSupport.GetWsdlMethod(ns, name).info.params
+            for param in params:
+                self.params[param.name] = param.type
+            return
+        # hand the parameter element over to pyVmomi's deserializer
+        param_type = self.params[name]
+        if issubclass(param_type, list):
+            param_type = param_type.Item
+        deserializer = SoapAdapter.SoapDeserializer(version=VERSION)
+        deserializer.Deserialize(self.parser, param_type, False, self.nsMap)
+        deserializer.StartElementHandler(tag, attr)
+        self._parsers.append((name, deserializer))
+
+    def EndElementHandler(self, tag):
+        pass
+
+    def CharacterDataHandler(self, data):
+        pass
+
+
+def _envelope(body):
+    return (SoapAdapter.XML_HEADER + '\n' + SoapAdapter.SOAP_ENVELOPE_START +
+            SoapAdapter.SOAP_BODY_START + body + SoapAdapter.SOAP_BODY_END +
+            SoapAdapter.SOAP_ENVELOPE_END).encode('utf-8')
+
+
+_NS_MAP = dict(SoapAdapter.SOAP_NSMAP)
+_NS_MAP[NAMESPACE] = ''
+
+
+def _response(method, value, result_type, flags=0):
+    body = ''
+    if value is not None:
+        info = VmomiSupport.Object(name='returnval', type=result_type,
+                                   version=VERSION, flags=flags)
+        body = SoapAdapter.SerializeToStr(value, info, VERSION, _NS_MAP)
+    return _envelope('<{0}Response xmlns="{1}">{2}</{0}Response>'.format(
+        method, NAMESPACE, body))
+
+
+def _fault_response(fault):
+    name = fault._wsdlName
+    info = VmomiSupport.Object(name=name + 'Fault', type=fault.__class__,
+                               version=VERSION, flags=0)
+    detail = SoapAdapter.SerializeFaultDetail(fault, info, VERSION, _NS_MAP)
+    return _envelope(
+        '<soapenv:Fault><faultcode>ServerFaultCode</faultcode>'
+        '<faultstring>{0}</faultstring><detail>{1}</detail>'
+        '</soapenv:Fault>'.format(SoapAdapter.XmlEscape(fault.msg or name),
+                                  detail))
+
+
+class _Object(object):
+    """A managed object: its type, reference and property values."""
+
+    def __init__(self, obj_type, moid, **props):
+        self.type = obj_type
+        self.ref = obj_type(moid)
+        self.props = props
+
+
+class FakeVCenter(object):
+    """The stand-in, see the module docs.
+
+    code::
+        with FakeVCenter() as vcenter:
+            si = SmartConnect(protocol='http', host='127.0.0.1',
+                              port=vcenter.port, user='u', pwd='p')
+    """
+
+    def __init__(self, vm_name):
+        self._lock = threading.Lock()
+        self._objects = {}
+        self._filters = {}
+        self._tasks = {}
+        self._counters = {}
+        self._done = {}
+        # method names in the order they were called
+        self.requests = []
+        # virtual machine id -> annotation set by ReconfigVM_Task
+        self.annotations = {}
+        self._build(vm_name)
+        self._server = _Server(('127.0.0.1', 0), _Handler)
+        self._server.vcenter = self
+        self._thread = None
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _next_id(self, prefix):
+        self._counters[prefix] = self._counters.get(prefix, 0) + 1
+        return '%s-%d' % (prefix, self._counters[prefix])
+
+    def _add(self, obj_type, moid, **props):
+        obj = _Object(obj_type, moid, **props)
+        self._objects[moid] = obj
+        return obj.ref
+
+    def _ref(self, moid):
+        return self._objects[moid].ref
+
+    def _build(self, vm_name):
+        vms = []
+        for moid, name in (('vm-10', 'web-01'), ('vm-11', vm_name),
+                           ('vm-12', 'db-01')):
+            vms.append(self._add(
+                vim.VirtualMachine, moid, name=name,
+                parent=None,
+                runtime=vim.vm.RuntimeInfo(
+                    connectionState='connected',
+                    powerState=vim.VirtualMachinePowerState.poweredOff,
+                    faultToleranceState='notConfigured',
+                    toolsInstallerMounted=False, numMksConnections=0,
+                    recordReplayState='inactive', onlineStandby=False,
+                    consolidationNeeded=False)))
+        apps = self._add(vim.Folder, 'group-v20', name='apps',
+                         childEntity=vms[:1])
+        lab = self._add(vim.Folder, 'group-v21', name='lab',
+                        childEntity=vms[1:])
+        vm_folder = self._add(vim.Folder, 'group-v3', name='vm',
+                              childEntity=[apps, lab])
+        folders = {}
+        for path, moid in (('hostFolder', 'group-h4'),
+                           ('datastoreFolder', 'group-s5'),
+                           ('networkFolder', 'group-n6')):
+            folders[path] = self._add(vim.Folder, moid,
+                                      name=path[:-len('Folder')],
+                                      childEntity=[])
+        datacenter = self._add(vim.Datacenter, 'datacenter-2', name='dc',
+                               vmFolder=vm_folder, **folders)
+        root = self._add(vim.Folder, 'group-d1', name='Datacenters',
+                         childEntity=[datacenter])
+        for ref, parent in [(datacenter, root), (vm_folder, datacenter),
+                            (apps, vm_folder), (lab, vm_folder),
+                            (vms[0], apps), (vms[1], lab), (vms[2], lab)]:
+            self._objects[ref._moId].props['parent'] = parent
+        for folder in folders.values():
+            self._objects[folder._moId].props['parent'] = datacenter
+
+        self._add(vim.PropertyCollector, 'propertyCollector')
+        self._add(vim.SessionManager, 'SessionManager')
+        content = vim.ServiceInstanceContent(
+            rootFolder=root,
+            propertyCollector=self._ref('propertyCollector'),
+            sessionManager=self._ref('SessionManager'),
+            about=vim.AboutInfo(
+                name='VMware vCenter Server', fullName='Fake vCenter 8.0',
+                vendor='VMware, Inc.', version='8.0.0', build='0',
+                osType='linux-x64', productLineId='vpx',
+                apiType='VirtualCenter', apiVersion='8.0.0.0',
+                instanceUuid='00000000-0000-0000-0000-000000000000'))
+        self._add(vim.ServiceInstance, 'ServiceInstance', content=content)
+
+    # HTTP
+
+    def service_versions(self):
+        version_id = VmomiSupport.versionIdMap[VERSION]
+        return ('<?xml version="1.0" encoding="UTF-8" ?>\n'
+                '<namespaces version="1.0">\n'
+                ' <namespace>\n'
+                '  <name>urn:vim25</name>\n'
+                '  <version>%s</version>\n'
+                ' </namespace>\n'
+                '</namespaces>\n' % version_id).encode('utf-8')
+
+    def invoke(self, body):
+        """Answer a SOAP request.
+
+        :rtype types.TupleType:
+        :return: (HTTP status, response body)
+        """
+        method, args = _RequestDeserializer().parse(body)
+        with self._lock:
+            self.requests.append(method)
+            try:
+                handler = getattr(self, '_' + method, None)
+                if handler is None:
+                    raise _Fault(vmodl.fault.MethodNotFound(
+                        msg='%s is not supported' % method, method=method))
+                return 200, handler(method, **args)
+            except _Fault as e:
+                return 500, _fault_response(e.fault)
+            except Exception as e:
+                return 500, _fault_response(vmodl.fault.SystemError(
+                    msg=repr(e), reason=repr(e)))
+
+    def _method_response(self, method, value):
+        info = VmomiSupport.GetWsdlMethod(NAMESPACE, method).info
+        return _response(method, value, info.result, info.resultFlags)
+
+    # the service instance and sessions
+
+    def _RetrieveServiceContent(self, method, _this):
+        return self._method_response(
+            method, self._objects['ServiceInstance'].props['content'])
+
+    def _Login(self, method, _this, userName, password, locale=None):
+        session = vim.UserSession(
+            key='52a1b2c3-fake-session', userName=userName,
+            fullName=userName, loginTime=EPOCH, lastActiveTime=EPOCH,
+            locale='en', messageLocale='en', extensionSession=False,
+            ipAddress='127.0.0.1', userAgent='pyvmomi', callCount=0)
+        return self._method_response(method, session)
+
+    def _Logout(self, method, _this):
+        return self._method_response(method, None)
+
+    # properties
+
+    def _Fetch(self, method, _this, prop):
+        obj = self._objects.get(_this._moId)
+        if obj is None:
+            raise _Fault(vmodl.fault.ManagedObjectNotFound(obj=_this))
+        info = obj.type._GetPropertyInfo(prop)
+        if obj.type is vim.Task and prop == 'info':
+            value = self._observe(_this._moId)
+        else:
+            value = obj.props.get(prop)
+        return _response(method, value, info.type, info.flags)
+
+    def _property(self, moid, path):
+        obj = self._objects[moid]
+        value = obj.props.get(path.split('.', 1)[0])
+        if '.' in path:
+            for name in path.split('.')[1:]:
+                value = getattr(value, name, None) if value is not None \
+                    else None
+        return value
+
+    def _select(self, object_specs):
+        # the objects a list of ObjectSpec selects, in traversal order
+        selected = []
+
+        def visit(ref, skip, select_set, specs):
+            if not skip:
+                selected.append(ref)
+            for selection in select_set or []:
+                spec = selection
+                if not isinstance(spec,
+                                  vmodl.query.PropertyCollector.TraversalSpec):
+                    spec = specs[selection.name]
+                obj = self._objects[ref._moId]
+                if not issubclass(obj.type, spec.type):
+                    continue
+                children = obj.props.get(spec.path) or []
+                if not isinstance(children, list):
+                    children = [children]
+                for child in children:
+                    visit(child, spec.skip, spec.selectSet, specs)
+
+        for object_spec in object_specs:
+            specs = {}
+            for selection in object_spec.selectSet or []:
+                if selection.name:
+                    specs[selection.name] = selection
+            visit(object_spec.obj, object_spec.skip, object_spec.selectSet,
+                  specs)
+        return selected
+
+    def _contents(self, spec):
+        contents = []
+        for ref in self._select(spec.objectSet):
+            obj = self._objects[ref._moId]
+            for prop_spec in spec.propSet:
+                if not issubclass(obj.type, prop_spec.type):
+                    continue
+                paths = prop_spec.pathSet
+                if prop_spec.all:
+                    paths = sorted(obj.props)
+                contents.append(vmodl.query.PropertyCollector.ObjectContent(
+                    obj=ref,
+                    propSet=[vmodl.DynamicProperty(
+                        name=path, val=self._property(ref._moId, path))
+                        for path in paths]))
+                break
+        return contents
+
+    def _RetrievePropertiesEx(self, method, _this, specSet, options):
+        contents = []
+        for spec in specSet:
+            contents.extend(self._contents(spec))
+        if not contents:
+            return self._method_response(method, None)
+        return self._method_response(
+            method, vmodl.query.PropertyCollector.RetrieveResult(
+                objects=contents))
+
+    # property filters and updates
+
+    def _CreateFilter(self, method, _this, spec, partialUpdates):
+        moid = self._next_id('session[52a1b2c3]filter')
+        self._add(vmodl.query.PropertyCollector.Filter, moid)
+        self._filters[moid] = {'spec': spec, 'reported': False}
+        return self._method_response(method, self._ref(moid))
+
+    def _DestroyPropertyFilter(self, method, _this):
+        self._filters.pop(_this._moId, None)
+        self._objects.pop(_this._moId, None)
+        return self._method_response(method, None)
+
+    def _updates(self, version):
+        collector = vmodl.query.PropertyCollector
+        filter_sets = []
+        for moid in sorted(self._filters):
+            pfilter = self._filters[moid]
+            object_sets = []
+            for content in self._contents(pfilter['spec']):
+                ref = content.obj
+                if pfilter['reported'] and ref._moId not in self._tasks:
+                    continue
+                if ref._moId in self._tasks:
+                    if pfilter['reported'] and self._tasks[ref._moId] >= \
+                            len(_TASK_STATES):
+                        continue
+                    info = self._observe(ref._moId)
+                    for prop in content.propSet:
+                        if prop.name == 'info':
+                            prop.val = info
+                object_sets.append(collector.ObjectUpdate(
+                    kind='modify' if pfilter['reported'] else 'enter',
+                    obj=ref,
+                    changeSet=[collector.Change(name=p.name, op='assign',
+                                                val=p.val)
+                               for p in content.propSet]))
+            pfilter['reported'] = True
+            if object_sets:
+                filter_sets.append(collector.FilterUpdate(
+                    filter=self._ref(moid), objectSet=object_sets))
+        if not filter_sets:
+            return None
+        return collector.UpdateSet(version=str(int(version or 0) + 1),
+                                   filterSet=filter_sets)
+
+    def _WaitForUpdates(self, method, _this, version=None):
+        return self._method_response(method, self._updates(version))
+
+    def _WaitForUpdatesEx(self, method, _this, version=None, options=None):
+        return self._method_response(method, self._updates(version))
+
+    # tasks
+
+    def _task(self, method, entity, description_id, done=None):
+        moid = self._next_id('task')
+        entity_name = self._objects[entity._moId].props.get('name')
+        info = vim.TaskInfo(
+            key=moid, task=vim.Task(moid), descriptionId=description_id,
+            entity=entity, entityName=entity_name,
+            state=vim.TaskInfo.State.queued, cancelled=False,
+            cancelable=False, queueTime=EPOCH, eventChainId=1,
+            reason=vim.TaskReasonUser(userName='budget'))
+        self._add(vim.Task, moid, info=info)
+        self._tasks[moid] = 0
+        self._done[moid] = done
+        return self._method_response(method, self._ref(moid))
+
+    def _observe(self, moid):
+        # the task's info as a client sees it now, then one step further
+        step = self._tasks[moid]
+        info = copy.copy(self._objects[moid].props['info'])
+        info.state = _TASK_STATES[min(step, len(_TASK_STATES) - 1)]
+        if step >= 1:
+            info.startTime = EPOCH + datetime.timedelta(seconds=1)
+        if step >= 2:
+            info.completeTime = EPOCH + datetime.timedelta(seconds=2)
+            info.progress = 100
+        if step == len(_TASK_STATES) - 1 and self._done.get(moid):
+            self._done.pop(moid)()
+        self._tasks[moid] = step + 1
+        return info
+
+    def _power(self, vm, state):
+        def done():
+            self._objects[vm._moId].props['runtime'].powerState = state
+        return done
+
+    def _ReconfigVM_Task(self, method, _this, spec):
+        def done():
+            if spec.annotation is not None:
+                self.annotations[_this._moId] = spec.annotation
+        return self._task(method, _this, 'VirtualMachine.reconfigure', done)
+
+    def _PowerOnVM_Task(self, method, _this, host=None):
+        return self._task(method, _this, 'VirtualMachine.powerOn',
+                          self._power(_this, 'poweredOn'))
+
+    def _PowerOffVM_Task(self, method, _this):
+        return self._task(method, _this, 'VirtualMachine.powerOff',
+                          self._power(_this, 'poweredOff'))
+
+    def _ResetVM_Task(self, method, _this):
+        return self._task(method, _this, 'VirtualMachine.reset',
+                          self._power(_this, 'poweredOn'))
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps connections alive between requests
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body, content_type='text/xml; charset=utf-8'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Set-Cookie', SESSION_COOKIE + '; Path=/;')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/sdk/vimServiceVersions.xml':
+            self._send(200, self.server.vcenter.service_versions())
+        else:
+            self._send(404, b'')
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        status, response = self.server.vcenter.invoke(body)
+        self._send(status, response)
+
+
+class _Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
@@ -0,0 +1,179 @@
+# Copyright (c) 2014 VMware, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Stand-ins for the pyVmomi objects the unit tests drive code with.
+
+Record covers anything the code only reads attributes from, such as
+ServiceInstance.content or a task's info. PropertyCollector serves the
+update sets a test queues to code waiting on WaitForUpdatesEx, build them
+with object_update and update_set. TaskMonitor completes tasks in place of
+task.TaskMonitor.
+"""
+__author__ = "VMware, Inc."
+
+import threading
+import time
+
+from six.moves import queue
+
+
+class Record(object):
+    """An object with the given attributes."""
+
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+def object_update(obj, changes, kind='modify'):
+    """An ObjectUpdate of obj assigning (path, value) pairs."""
+    return Record(obj=obj, kind=kind, changeSet=[
+        Record(name=name, op='assign', val=val) for name, val in changes])
+
+
+def update_set(object_updates, pfilter=None, version='1'):
+    """An UpdateSet holding object_updates, all reported for pfilter."""
+    return Record(version=version, filterSet=[
+        Record(filter=pfilter, objectSet=list(object_updates))])
+
+
+class Filter(object):
+    """A property filter on the first object and paths of its spec."""
+
+    def __init__(self, obj, paths):
+        self.obj = obj
+        self.paths = paths
+        self.destroyed = False
+
+    def Destroy(self):
+        self.destroyed = True
+
+
+class PropertyCollector(object):
+    """Serves queued update sets from WaitForUpdatesEx.
+
+    CreatePropertyCollector hands back the collector itself. Filters are
+    kept in filters and passed to on_create as they are made. An exception
+    queued with put() is raised instead of returned, and with nothing
+    queued WaitForUpdatesEx returns None after timeout seconds, as when
+    maxWaitSeconds runs out.
+    """
+
+    def __init__(self, updates=(), timeout=0.05):
+        self.updates = queue.Queue()
+        for update in updates:
+            self.updates.put(update)
+        self.timeout = timeout
+        self.filters = []
+        self.on_create = None
+
+    def put(self, update):
+        self.updates.put(update)
+
+    def CreatePropertyCollector(self):
+        return self
+
+    def CreateFilter(self, spec, partial_updates):
+        paths = list(spec.propSet[0].pathSet or []) if spec.propSet else []
+        pfilter = Filter(spec.objectSet[0].obj, paths)
+        self.filters.append(pfilter)
+        if self.on_create is not None:
+            self.on_create(pfilter)
+        return pfilter
+
+    def WaitForUpdatesEx(self, version, options):
+        try:
+            update = self.updates.get(timeout=self.timeout)
+        except queue.Empty:
+            return None
+        if isinstance(update, Exception):
+            raise update
+        return update
+
+    def Destroy(self):
+        pass
+
+
+class TaskMonitor(object):
+    """Completes the tasks added to it on a thread, oldest first.
+
+    A task is only completed once limit tasks are pending or the code waits,
+    so code that starts at most limit tasks at once always reaches limit.
+    limit may be a function returning the bound as it changes.
+    most_pending is the most tasks seen pending at once. Tasks complete with
+    the (state, error) in outcomes under their id, by default in success,
+    and on_complete(task) is called just before their callback.
+    """
+
+    def __init__(self, limit, outcomes=None, on_complete=None):
+        self.limit = limit
+        self.outcomes = outcomes or {}
+        self.on_complete = on_complete
+        self.most_pending = 0
+        self.stopped = False
+        self._pending = []
+        self._unfinished = 0
+        self._waiting = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def add(self, task, callback):
+        with self._cond:
+            self._pending.append((task, callback))
+            self._unfinished += 1
+            self.most_pending = max(self.most_pending, len(self._pending))
+            self._cond.notify_all()
+
+    def wait(self):
+        with self._cond:
+            self._waiting = True
+            self._cond.notify_all()
+            while self._unfinished:
+                self._cond.wait()
+
+    def stop(self):
+        with self._cond:
+            self.stopped = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def _limit(self):
+        return self.limit() if callable(self.limit) else self.limit
+
+    def _run(self):
+        while True:
+            with self._cond:
+                # after a second without either, complete anyway so code
+                # holding back fewer than limit tasks fails instead of hangs
+                give_up = time.time() + 1
+                while len(self._pending) < self._limit() and \
+                        not self._waiting and not self.stopped and \
+                        time.time() < give_up:
+                    self._cond.wait(give_up - time.time())
+                if not self._pending:
+                    if self.stopped:
+                        return
+                    continue
+                task, callback = self._pending.pop(0)
+            state, error = self.outcomes.get(task._moId, ('success', None))
+            if self.on_complete is not None:
+                self.on_complete(task)
+            callback(task, state, error)
+            with self._cond:
+                self._unfinished -= 1
+                self._cond.notify_all()
@@ -0,0 +1,148 @@
+# Copyright (c) 2014 VMware, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+
+from six.moves import queue
+import testtools
+
+from pyvmomi_tools import extensions  # noqa
+from pyvmomi_tools.extensions import change_bus
+from pyVmomi import vim
+
+from tests import fakes
+
+
+class _Collector(fakes.PropertyCollector):
+    """A property collector serving updates from a per-object value dict.
+
+    A new filter is answered with an 'enter' update carrying the current
+    values, set() sends a 'modify' update to every live filter.
+    """
+
+    def __init__(self):
+        super(_Collector, self).__init__()
+        self.values = {}
+
+    def CreateFilter(self, spec, partial_updates):
+        pfilter = super(_Collector, self).CreateFilter(spec,
+                                                       partial_updates)
+        values = self.values.get(pfilter.obj.id, {})
+        self._send(pfilter, 'enter',
+                   [(p, values[p]) for p in pfilter.paths if p in values])
+        return pfilter
+
+    def set(self, obj, path, val):
+        self.values.setdefault(obj.id, {})[path] = val
+        for pfilter in self.filters:
+            if not pfilter.destroyed and path in pfilter.paths:
+                self._send(pfilter, 'modify', [(path, val)])
+
+    def _send(self, pfilter, kind, changes):
+        self.put(fakes.update_set(
+            [fakes.object_update(pfilter.obj, changes, kind)], pfilter))
+
+
+class ChangeBusTests(testtools.TestCase):
+
+    def setUp(self):
+        super(ChangeBusTests, self).setUp()
+        self.collector = _Collector()
+        si = fakes.Record(content=fakes.Record(
+            propertyCollector=self.collector))
+        self.bus = change_bus.ChangeBus(si, max_wait_seconds=0)
+        self.bus.start()
+        self.addCleanup(self.bus.stop)
+        self.vm = vim.VirtualMachine('vm-1')
+        self.collector.values['vm-1'] = {'name': 'web-01',
+                                         'runtime.powerState': 'poweredOn'}
+
+    def _events(self, subscription, count):
+        return [(e.kind, e.name, e.val)
+                for e in [subscription.get(timeout=5) for _ in range(count)]]
+
+    def _assert_idle(self, subscription):
+        self._settle()
+        self.assertRaises(queue.Empty, subscription.get, timeout=0.2)
+
+    def _settle(self):
+        # let the update loop take everything queued so far
+        while not self.collector.updates.empty():
+            threading.Event().wait(0.01)
+        threading.Event().wait(0.1)
+
+    def test_first_subscriber_gets_current_values(self):
+        subscription = self.bus.subscribe(self.vm, ['name'])
+        self.assertEqual([('enter', 'name', 'web-01')],
+                         self._events(subscription, 1))
+
+    def test_second_subscriber_to_watched_paths_gets_current_values(self):
+        first = self.bus.subscribe(self.vm, ['name'])
+        self._events(first, 1)
+        self._settle()
+        second = self.bus.subscribe(self.vm, ['name'])
+        self.assertEqual([('enter', 'name', 'web-01')],
+                         self._events(second, 1))
+        # the filter was not rebuilt
+        self.assertEqual(1, len(self.collector.filters))
+        self._assert_idle(first)
+
+    def test_rebuilt_filter_does_not_repeat_values(self):
+        first = self.bus.subscribe(self.vm, ['name'])
+        self._events(first, 1)
+        self._settle()
+        second = self.bus.subscribe(self.vm, ['runtime.powerState'])
+        self.assertEqual([('enter', 'runtime.powerState', 'poweredOn')],
+                         self._events(second, 1))
+        self._assert_idle(first)
+        self.collector.set(self.vm, 'name', 'web-02')
+        self.assertEqual([('modify', 'name', 'web-02')],
+                         self._events(first, 1))
+        self._assert_idle(second)
+
+    def test_updates_from_replaced_filters_are_ignored(self):
+        first = self.bus.subscribe(self.vm, ['name'])
+        second = self.bus.subscribe(self.vm, ['runtime.powerState'])
+        self.assertEqual([('enter', 'name', 'web-01')],
+                         self._events(first, 1))
+        self.assertEqual([('enter', 'runtime.powerState', 'poweredOn')],
+                         self._events(second, 1))
+        self._assert_idle(first)
+
+    def test_get_raises_after_the_loop_fails(self):
+        subscription = self.bus.subscribe(self.vm, ['name'])
+        self._events(subscription, 1)
+        self.collector.put(ValueError('connection lost'))
+        e = self.assertRaises(change_bus.ChangeBusStopped,
+                              subscription.get, timeout=5)
+        self.assertIsInstance(e.error, ValueError)
+        # and keeps raising
+        self.assertRaises(change_bus.ChangeBusStopped,
+                          subscription.get, timeout=5)
+        self.assertRaises(change_bus.ChangeBusStopped,
+                          self.bus.subscribe, self.vm, ['name'])
+
+    def test_get_raises_after_stop(self):
+        subscription = self.bus.subscribe(self.vm, ['name'])
+        self._events(subscription, 1)
+        self.bus.stop()
+        e = self.assertRaises(change_bus.ChangeBusStopped,
+                              subscription.get, timeout=5)
+        self.assertIsNone(e.error)
+
+    def test_stopped_bus_is_forgotten(self):
+        stub = object()
+        self.patch(change_bus, '_buses', {stub: self.bus})
+        self.bus.stop()
+        self.assertEqual({}, change_bus._buses)
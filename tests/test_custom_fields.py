@@ -0,0 +1,205 @@
+# Copyright (c) 2014 VMware, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+
+import testtools
+
+from pyvmomi_tools import extensions  # noqa
+from pyvmomi_tools.extensions import custom_fields
+from pyvmomi_tools.extensions import folder as folder_extensions
+from pyVmomi import vim
+
+from tests import fakes
+
+
+def _obj_set(obj, kind='enter', **changes):
+    return fakes.object_update(obj, sorted(changes.items()), kind)
+
+
+def _owner(value):
+    return [vim.CustomFieldStringValue(key=1, value=value)]
+
+
+class CustomAttributeIndexTests(testtools.TestCase):
+    """The index fed directly with the updates its filters would send.
+
+    root
+      apps (folder)
+        web-01 (vm, owner alice)
+        shop (vApp)
+          db-01 (vm, owner alice)
+      lab (folder)
+        test-01 (vm, owner alice)
+        build-01 (vm, owner bob)
+    """
+
+    def setUp(self):
+        super(CustomAttributeIndexTests, self).setUp()
+        self.root = vim.Folder('group-v1')
+        si = fakes.Record(content=fakes.Record(
+            rootFolder=self.root,
+            propertyCollector=fakes.PropertyCollector()))
+        self.index = custom_fields.CustomAttributeIndex(si)
+        self.apps = vim.Folder('group-v2')
+        self.lab = vim.Folder('group-v3')
+        self.shop = vim.VirtualApp('resgroup-v4')
+        self.web = vim.VirtualMachine('vm-10')
+        self.db = vim.VirtualMachine('vm-11')
+        self.test = vim.VirtualMachine('vm-12')
+        self.build = vim.VirtualMachine('vm-13')
+        manager = vim.CustomFieldsManager('CustomFieldsManager')
+        fields = [vim.CustomFieldsManager.FieldDef(key=1, name='owner'),
+                  vim.CustomFieldsManager.FieldDef(
+                      key=2, name='backup',
+                      managedObjectType=vim.HostSystem)]
+        for obj_set in [
+                _obj_set(manager, field=fields),
+                _obj_set(self.apps, parent=self.root),
+                _obj_set(self.lab, parent=self.root),
+                _obj_set(self.shop, parent=self.apps),
+                _obj_set(self.web, parent=self.apps,
+                         customValue=_owner('alice')),
+                _obj_set(self.db, parent=None, parentVApp=self.shop,
+                         customValue=_owner('alice')),
+                _obj_set(self.test, parent=self.lab,
+                         customValue=_owner('alice')),
+                _obj_set(self.build, parent=self.lab,
+                         customValue=_owner('bob'))]:
+            self.index._apply(obj_set)
+
+    def test_find(self):
+        self.assertEqual([self.web, self.db, self.test],
+                         self.index.find('owner', 'alice'))
+        self.assertEqual([self.build], self.index.find('owner', 'bob'))
+        self.assertEqual([], self.index.find('owner', 'carol'))
+
+    def test_find_below_a_container(self):
+        self.assertEqual([self.web, self.db],
+                         self.index.find('owner', 'alice',
+                                         container=self.apps))
+        self.assertEqual([self.db],
+                         self.index.find('owner', 'alice',
+                                         container=self.shop))
+        self.assertEqual([self.web, self.db, self.test],
+                         self.index.find('owner', 'alice',
+                                         container=self.root))
+        self.assertEqual([], self.index.find('owner', 'alice',
+                                             container=self.web))
+
+    def test_moves_are_followed(self):
+        self.index._apply(_obj_set(self.test, kind='modify',
+                                   parent=self.apps))
+        self.assertEqual([self.web, self.db, self.test],
+                         self.index.find('owner', 'alice',
+                                         container=self.apps))
+        self.assertEqual([], self.index.find('owner', 'alice',
+                                             container=self.lab))
+
+    def test_value_changes_and_leaves(self):
+        self.index._apply(_obj_set(self.web, kind='modify',
+                                   customValue=_owner('bob')))
+        self.index._apply(_obj_set(self.test, kind='leave'))
+        self.assertEqual([self.db], self.index.find('owner', 'alice'))
+        self.assertEqual([self.web, self.build],
+                         self.index.find('owner', 'bob'))
+        self.assertEqual({'owner': 'bob'}, self.index.values(self.web))
+
+    def test_field_types(self):
+        self.assertEqual([1], self.index.field_keys('owner',
+                                                    vim.VirtualMachine))
+        self.assertEqual([], self.index.field_keys('backup',
+                                                   vim.VirtualMachine))
+        self.assertEqual([2], self.index.field_keys('backup',
+                                                    vim.HostSystem))
+
+
+class SharedIndexTests(testtools.TestCase):
+
+    def test_building_does_not_hold_up_other_sessions(self):
+        building = threading.Event()
+        release = threading.Event()
+
+        class Index(object):
+            error = None
+
+            def __init__(self, si):
+                self.si = si
+
+            def start(self):
+                if self.si.name == 'slow':
+                    building.set()
+                    release.wait(5)
+
+        self.patch(custom_fields, 'CustomAttributeIndex', Index)
+        self.patch(custom_fields, '_indexes', {})
+        slow = fakes.Record(name='slow', _stub=object())
+        fast = fakes.Record(name='fast', _stub=object())
+        thread = threading.Thread(target=custom_fields.custom_attribute_index,
+                                  args=(slow,))
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(release.set)
+        building.wait(5)
+        self.assertIs(fast, custom_fields.custom_attribute_index(fast).si)
+        # the slow session is still building
+        self.assertTrue(thread.is_alive())
+        release.set()
+        thread.join()
+        index = custom_fields.custom_attribute_index(slow)
+        self.assertIs(slow, index.si)
+        self.assertIs(index, custom_fields.custom_attribute_index(slow))
+
+    def test_dead_indexes_are_replaced(self):
+        built = []
+
+        class Index(object):
+            error = None
+            stopped = False
+
+            def __init__(self, si):
+                built.append(self)
+
+            def start(self):
+                pass
+
+            def stop(self):
+                self.stopped = True
+
+        self.patch(custom_fields, 'CustomAttributeIndex', Index)
+        self.patch(custom_fields, '_indexes', {})
+        si = fakes.Record(_stub=object())
+        index = custom_fields.custom_attribute_index(si)
+        self.assertIs(index, custom_fields.custom_attribute_index(si))
+        index.error = vim.fault.NotAuthenticated()
+        replacement = custom_fields.custom_attribute_index(si)
+        self.assertEqual([index, replacement], built)
+        self.assertTrue(index.stopped)
+        self.assertFalse(replacement.stopped)
+
+    def test_find_by_custom_value_scopes_in_the_index(self):
+        calls = []
+
+        class Index(object):
+            def find(self, *args, **kwargs):
+                calls.append((args, kwargs))
+                return []
+
+        self.patch(custom_fields, 'custom_attribute_index',
+                   lambda si: Index())
+        folder = vim.Folder('group-v2')
+        # any property read on folder would need a stub
+        folder_extensions.find_by_custom_value(folder, 'owner', 'alice')
+        self.assertEqual([(('owner', 'alice', None), {'container': folder})],
+                         calls)
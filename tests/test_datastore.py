@@ -0,0 +1,153 @@
+# Copyright (c) 2014 VMware, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+import pickle
+
+import testtools
+
+from pyvmomi_tools import extensions  # noqa
+from pyvmomi_tools.extensions import datastore
+from pyVmomi import vim
+
+from tests import budget
+from tests import fakes
+
+_browser = vim.host.DatastoreBrowser
+_T0 = datetime.datetime(2024, 1, 1)
+
+
+class _Browser(object):
+    """Lists a datastore from {folder: {file: size}}, records searches."""
+
+    def __init__(self, name, folders, modified):
+        self.name = name
+        self.folders = folders
+        self.modified = modified
+        self.searches = []
+
+    def SearchDatastore_Task(self, path, spec):
+        self.searches.append(path)
+        result = _browser.SearchResults(
+            folderPath='[%s]' % self.name,
+            file=[_browser.FolderInfo(path=folder,
+                                      modification=self.modified[folder])
+                  for folder in sorted(self.folders)])
+        return fakes.Record(info=fakes.Record(result=result))
+
+    def SearchDatastoreSubFolders_Task(self, path, spec):
+        self.searches.append(path)
+        folder = path.split('] ', 1)[1]
+        result = _browser.SearchResults(
+            folderPath=path,
+            file=[_browser.VmDiskInfo(path=name, fileSize=size,
+                                      modification=_T0)
+                  for name, size in sorted(self.folders[folder].items())])
+        return fakes.Record(info=fakes.Record(result=[result]))
+
+
+class _Monitor(object):
+
+    def __init__(self, si):
+        pass
+
+    def start(self):
+        pass
+
+    def add(self, task, callback):
+        callback(task, vim.TaskInfo.State.success, None)
+
+    def stop(self):
+        pass
+
+
+class ListingCacheTests(testtools.TestCase):
+
+    def setUp(self):
+        super(ListingCacheTests, self).setUp()
+        self.clock = budget.FakeClock()
+        self.patch(datastore, 'time', self.clock)
+        self.cache = datastore.ListingCache(max_age=60)
+        self.cache.put('ds1', 'vm-a', _T0, ['entry'], ['*.vmdk'])
+
+    def test_hit(self):
+        self.assertEqual(['entry'],
+                         self.cache.get('ds1', 'vm-a', _T0, ['*.vmdk']))
+
+    def test_folder_changed(self):
+        self.assertIsNone(self.cache.get(
+            'ds1', 'vm-a', _T0 + datetime.timedelta(seconds=1), ['*.vmdk']))
+
+    def test_other_patterns(self):
+        self.assertIsNone(self.cache.get('ds1', 'vm-a', _T0, ['*.vmx']))
+        self.assertIsNone(self.cache.get('ds1', 'vm-a', _T0))
+
+    def test_expires(self):
+        self.clock.sleep(61)
+        self.assertIsNone(self.cache.get('ds1', 'vm-a', _T0, ['*.vmdk']))
+
+    def test_no_max_age(self):
+        cache = datastore.ListingCache(max_age=None)
+        cache.put('ds1', 'vm-a', _T0, ['entry'])
+        self.clock.sleep(10 ** 6)
+        self.assertEqual(['entry'], cache.get('ds1', 'vm-a', _T0))
+
+    def test_pickles(self):
+        cache = pickle.loads(pickle.dumps(self.cache))
+        self.assertEqual(60, cache.max_age)
+        self.assertEqual(['entry'],
+                         cache.get('ds1', 'vm-a', _T0, ['*.vmdk']))
+
+
+class BrowseTests(testtools.TestCase):
+
+    def setUp(self):
+        super(BrowseTests, self).setUp()
+        self.clock = budget.FakeClock()
+        self.patch(datastore, 'time', self.clock)
+        self.patch(datastore.task_extensions, 'TaskMonitor', _Monitor)
+        self.browser = _Browser('ds1', {'vm-a': {'a.vmdk': 10},
+                                        'vm-b': {'b.vmdk': 20}},
+                                {'vm-a': _T0, 'vm-b': _T0})
+        self.datastores = [fakes.Record(name='ds1', browser=self.browser)]
+
+    def _sizes(self, cache):
+        entries = datastore.browse_datastores(self.datastores, ['*.vmdk'],
+                                              cache=cache, si=object())
+        return dict((e.datastore_path, e.size) for e in entries)
+
+    def test_browse(self):
+        self.assertEqual({'[ds1] vm-a/a.vmdk': 10,
+                          '[ds1] vm-b/b.vmdk': 20}, self._sizes(None))
+        self.assertEqual(['[ds1]', '[ds1] vm-a', '[ds1] vm-b'],
+                         self.browser.searches)
+
+    def test_unchanged_folders_come_from_the_cache(self):
+        cache = datastore.ListingCache()
+        self._sizes(cache)
+        del self.browser.searches[:]
+        self.browser.modified['vm-b'] = _T0 + datetime.timedelta(seconds=1)
+        self.browser.folders['vm-b']['b.vmdk'] = 25
+        self.assertEqual({'[ds1] vm-a/a.vmdk': 10,
+                          '[ds1] vm-b/b.vmdk': 25}, self._sizes(cache))
+        self.assertEqual(['[ds1]', '[ds1] vm-b'], self.browser.searches)
+
+    def test_files_growing_in_place_show_up_after_max_age(self):
+        cache = datastore.ListingCache(max_age=60)
+        self._sizes(cache)
+        # the folder's modification time does not move
+        self.browser.folders['vm-a']['a.vmdk'] = 15
+        self.assertEqual(10, self._sizes(cache)['[ds1] vm-a/a.vmdk'])
+        self.clock.sleep(61)
+        self.assertEqual(15, self._sizes(cache)['[ds1] vm-a/a.vmdk'])
@@ -0,0 +1,195 @@
+# Copyright (c) 2014 VMware, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import csv
+import datetime
+import gzip
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import six
+import testtools
+
+from pyvmomi_tools import extensions  # noqa
+from pyvmomi_tools.cli import export as export_command
+from pyvmomi_tools.extensions import export
+from pyVmomi import vim
+from pyVmomi import vmodl
+
+from tests import fakes
+
+collector = vmodl.query.PropertyCollector
+
+
+class _Stub(object):
+    """Serves rows, [(obj, {path: value})], through a container view.
+
+    RetrievePropertiesEx hands out page_size objects at a time, calls
+    records each method called.
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.calls = []
+        self.content = fakes.Record(
+            propertyCollector=vim.PropertyCollector('propertyCollector',
+                                                    self),
+            viewManager=vim.view.ViewManager('ViewManager', self))
+
+    def InvokeAccessor(self, mo, info):
+        return self.content
+
+    def InvokeMethod(self, mo, info, args):
+        self.calls.append(info.wsdlName)
+        if info.wsdlName == 'CreateContainerView':
+            self.view = args
+            return vim.view.ContainerView('session[1]view-1', self)
+        if info.wsdlName == 'RetrievePropertiesEx':
+            self.spec = args[0][0]
+            return self._page(0, args[1].maxObjects)
+        if info.wsdlName == 'ContinueRetrievePropertiesEx':
+            start, size = [int(n) for n in args[0].split(':')]
+            return self._page(start, size)
+
+    def _page(self, start, size):
+        page = self.rows[start:start + size]
+        token = None
+        if start + size < len(self.rows):
+            token = '%d:%d' % (start + size, size)
+        return collector.RetrieveResult(token=token, objects=[
+            collector.ObjectContent(obj=obj, propSet=[
+                vmodl.DynamicProperty(name=name, val=val)
+                for name, val in sorted(props.items())])
+            for obj, props in page])
+
+
+class ToPlainTests(testtools.TestCase):
+
+    def test_values(self):
+        spec = vim.vm.ConfigSpec(numCPUs=2, annotation='web', files=None,
+                                 deviceChange=[])
+        self.assertEqual({'numCPUs': 2, 'annotation': 'web'},
+                         export.to_plain(spec))
+        self.assertEqual('vm-1',
+                         export.to_plain(vim.VirtualMachine('vm-1')))
+        self.assertEqual('2014-01-02T03:04:05',
+                         export.to_plain(datetime.datetime(2014, 1, 2, 3, 4,
+                                                           5)))
+        self.assertEqual('vim.VirtualMachine',
+                         export.to_plain(vim.VirtualMachine))
+        self.assertEqual({'hosts': ['host-1', 'host-2'], 'count': 2},
+                         export.to_plain({'hosts': (vim.HostSystem('host-1'),
+                                                    vim.HostSystem('host-2')),
+                                          'count': 2}))
+
+
+class ExportInventoryTests(testtools.TestCase):
+
+    def setUp(self):
+        super(ExportInventoryTests, self).setUp()
+        rows = []
+        for i in range(5):
+            props = {'name': 'web-%d' % i}
+            if i % 2:
+                props['runtime.host'] = vim.HostSystem('host-1')
+            rows.append((vim.VirtualMachine('vm-%d' % i), props))
+        rows[0][1]['config.cpuAllocation'] = vim.ResourceAllocationInfo(
+            limit=-1, reservation=0)
+        self.stub = _Stub(rows)
+        self.folder = vim.Folder('group-v1', self.stub)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def _export(self, name, **kwargs):
+        path = os.path.join(self.directory, name)
+        rows, seconds = export.export_inventory(
+            self.folder, path, ['name', 'runtime.host',
+                                'config.cpuAllocation'], **kwargs)
+        self.assertEqual(5, rows)
+        return path
+
+    def _text(self, path):
+        opener = gzip.open if path.endswith('.gz') else io.open
+        with opener(path, 'rb') as f:
+            return f.read().decode('utf-8')
+
+    def test_jsonl(self):
+        path = self._export('vms.jsonl', page_size=2)
+        records = [json.loads(line)
+                   for line in self._text(path).splitlines()]
+        self.assertEqual({'id': 'vm-0', 'name': 'web-0',
+                          'runtime.host': None,
+                          'config.cpuAllocation': {'limit': -1,
+                                                   'reservation': 0}},
+                         records[0])
+        self.assertEqual({'id': 'vm-1', 'name': 'web-1',
+                          'runtime.host': 'host-1',
+                          'config.cpuAllocation': None}, records[1])
+        self.assertEqual(['vm-%d' % i for i in range(5)],
+                         [r['id'] for r in records])
+        # paged through a recursive view of virtual machines below folder
+        self.assertEqual(['CreateContainerView', 'RetrievePropertiesEx',
+                          'ContinueRetrievePropertiesEx',
+                          'ContinueRetrievePropertiesEx', 'DestroyView'],
+                         self.stub.calls)
+        self.assertEqual((self.folder, [vim.VirtualMachine], True),
+                         tuple(self.stub.view))
+        self.assertEqual(['name', 'runtime.host', 'config.cpuAllocation'],
+                         list(self.stub.spec.propSet[0].pathSet))
+
+    def test_csv(self):
+        path = self._export('vms.csv')
+        rows = list(csv.reader(six.StringIO(self._text(path))))
+        self.assertEqual(['id', 'name', 'runtime.host',
+                          'config.cpuAllocation'], rows[0])
+        self.assertEqual(['vm-0', 'web-0', '',
+                          '{"limit": -1, "reservation": 0}'], rows[1])
+        self.assertEqual(['vm-1', 'web-1', 'host-1', ''], rows[2])
+        self.assertEqual(6, len(rows))
+
+    def test_gzip(self):
+        path = self._export('vms.csv.gz')
+        with open(path, 'rb') as f:
+            self.assertEqual(b'\x1f\x8b', f.read(2))
+        self.assertTrue(self._text(path).startswith('id,name,'))
+
+    def test_format_argument_wins(self):
+        path = self._export('vms.out', fmt='jsonl')
+        self.assertEqual('vm-0', json.loads(
+            self._text(path).splitlines()[0])['id'])
+
+    def test_unknown_formats(self):
+        self.assertRaises(ValueError, export.export_inventory, self.folder,
+                          os.path.join(self.directory, 'vms.xml'), ['name'])
+        self.assertRaises(ValueError, export.export_inventory, self.folder,
+                          os.path.join(self.directory, 'vms.csv'), ['name'],
+                          fmt='xml')
+        self.assertEqual([], self.stub.calls)
+
+    def test_command(self):
+        si = fakes.Record(content=fakes.Record(rootFolder=self.folder))
+        self.patch(export_command.session, 'connect', lambda args: si)
+        out = six.StringIO()
+        self.patch(sys, 'stdout', out)
+        parser = export_command.add_arguments(argparse.ArgumentParser())
+        path = os.path.join(self.directory, 'vms.jsonl')
+        args = parser.parse_args([path, '-P', 'name', '--page-size', '3'])
+        self.assertEqual(0, export_command.run(args))
+        self.assertTrue(out.getvalue().startswith('exported 5 rows in '))
+        self.assertEqual(5, len(self._text(path).splitlines()))
@@ -0,0 +1,180 @@
+# Copyright (c) 2014 VMware, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import testtools
+
+from pyvmomi_tools.extensions import federation
+from pyVmomi import vim
+
+from tests import fakes
+
+
+class _Site(object):
+    """A session whose inventory is {name: entity}, or that fails."""
+
+    def __init__(self, name, inventory=None, error=None):
+        self.name = name
+        self._stub = object()
+        self.inventory = inventory or {}
+        self.error = error
+        self.content = fakes.Record(rootFolder=self)
+
+    def entity(self, moid):
+        return vim.VirtualMachine(moid, self._stub)
+
+
+def _root(function):
+    # the folder helper run on a site's root folder, raising its error
+    def helper(root, *args, **kwargs):
+        if root.error is not None:
+            raise root.error
+        return function(root, *args, **kwargs)
+    return helper
+
+
+class FederationTests(testtools.TestCase):
+
+    def setUp(self):
+        super(FederationTests, self).setUp()
+        self.vc1 = _Site('vc1')
+        self.vc1.inventory = {'web-01': [self.vc1.entity('vm-1')]}
+        self.vc2 = _Site('vc2', error=vim.fault.NotAuthenticated())
+        self.vc3 = _Site('vc3')
+        self.vc3.inventory = {'web-01': [self.vc3.entity('vm-7'),
+                                         self.vc3.entity('vm-8')]}
+        self.vc4 = _Site('vc4')
+        self.federation = federation.Federation()
+        for site in (self.vc1, self.vc3, self.vc4):
+            self.federation.add(site.name, site)
+        folder = federation.folder_extensions
+        self.patch(folder, 'find_by_name', _root(
+            lambda root, name, workers=None, types=None:
+            (root.inventory.get(name) or [None])[0]))
+        self.patch(folder, 'find_all_by_name', _root(
+            lambda root, name, workers=None, types=None:
+            list(root.inventory.get(name, []))))
+
+    def _found(self, results):
+        return [(r.site, r.value._moId) for r in results]
+
+    def test_find_by_name(self):
+        self.assertEqual([('vc1', 'vm-1'), ('vc3', 'vm-7')],
+                         self._found(self.federation.find_by_name('web-01')))
+
+    def test_find_all_by_name(self):
+        self.assertEqual([('vc1', 'vm-1'), ('vc3', 'vm-7'), ('vc3', 'vm-8')],
+                         self._found(
+                             self.federation.find_all_by_name('web-01')))
+
+    def test_find_by_name_with_a_failed_site(self):
+        self.federation.add('vc2', self.vc2)
+        e = self.assertRaises(federation.FederationError,
+                              self.federation.find_by_name, 'web-01')
+        # sites without a match are left out as without failures
+        self.assertEqual([('vc1', 'vm-1'), ('vc3', 'vm-7')],
+                         self._found(e.results))
+        self.assertEqual(['vc2'], list(e.errors))
+        self.assertIsInstance(e.errors['vc2'], vim.fault.NotAuthenticated)
+
+    def test_find_all_by_name_with_a_failed_site(self):
+        self.federation.add('vc2', self.vc2)
+        e = self.assertRaises(federation.FederationError,
+                              self.federation.find_all_by_name, 'web-01')
+        self.assertEqual([('vc1', 'vm-1'), ('vc3', 'vm-7'), ('vc3', 'vm-8')],
+                         self._found(e.results))
+
+    def test_map_keeps_site_order(self):
+        results = self.federation.map(lambda si, suffix: si.name + suffix,
+                                      '!')
+        self.assertEqual([('vc1', 'vc1!'), ('vc3', 'vc3!'), ('vc4', 'vc4!')],
+                         [tuple(r) for r in results])
+
+    def test_site_of(self):
+        self.assertEqual('vc3', self.federation.site_of(
+            self.vc3.entity('vm-9')))
+        self.assertIsNone(self.federation.site_of(vim.VirtualMachine('x')))
+
+
+class ConnectTests(testtools.TestCase):
+
+    def test_failed_logins_log_out_the_others(self):
+        sites = {}
+        disconnected = []
+
+        def smart_connect(host, **kwargs):
+            if host == 'bad':
+                raise vim.fault.InvalidLogin()
+            sites[host] = _Site(host)
+            return sites[host]
+
+        self.patch(federation.connect, 'SmartConnect', smart_connect)
+        self.patch(federation.connect, 'Disconnect', disconnected.append)
+        e = self.assertRaises(federation.FederationError,
+                              federation.Federation.connect,
+                              ['good', 'bad'], 'u', 'p')
+        self.assertEqual(['bad'], list(e.errors))
+        self.assertEqual([sites['good']], disconnected)
+
+    def test_close_only_logs_out_owned_sessions(self):
+        disconnected = []
+        self.patch(federation.connect, 'SmartConnect',
+                   lambda host, **kwargs: _Site(host))
+        self.patch(federation.connect, 'Disconnect', disconnected.append)
+        fed = federation.Federation.connect(['vc1'], 'u', 'p')
+        fed.add('mine', _Site('mine'))
+        fed.close()
+        self.assertEqual(['vc1'], [si.name for si in disconnected])
+
+
+class _Monitor(object):
+
+    def __init__(self, si, max_wait_seconds, stats):
+        self.si = si
+        self.tasks = []
+        self.started = self.stopped = False
+
+    def start(self):
+        self.started = True
+
+    def add(self, task, callback):
+        self.tasks.append(task)
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def wait(self):
+        pass
+
+    def stop(self):
+        self.stopped = True
+
+
+class FederatedTaskMonitorTests(testtools.TestCase):
+
+    def test_one_monitor_per_site(self):
+        self.patch(federation.task_extensions, 'TaskMonitor', _Monitor)
+        vc1, vc2 = _Site('vc1'), _Site('vc2')
+        fed = federation.Federation({'vc1': vc1, 'vc2': vc2})
+        monitor = fed.task_monitor()
+        for site, moid in ((vc1, 'task-1'), (vc2, 'task-2'),
+                           (vc1, 'task-3')):
+            monitor.add(vim.Task(moid, site._stub), None)
+        self.assertEqual(3, len(monitor))
+        monitors = dict((m.si.name, m) for m in monitor._monitors.values())
+        self.assertEqual(['task-1', 'task-3'],
+                         [t._moId for t in monitors['vc1'].tasks])
+        self.assertTrue(monitors['vc2'].started)
+        monitor.stop()
+        self.assertTrue(monitors['vc1'].stopped)
+        self.assertRaises(ValueError, monitor.add, vim.Task('task-9'), None)
@@ -11,3 +11,504 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+
+import threading
+from multiprocessing.pool import ThreadPool
+
+import testtools
+
+from pyvmomi_tools import extensions  # noqa
+from pyvmomi_tools.extensions import folder
+from pyVmomi import vim
+
+from tests import fakes
+
+from tests import budget
+
+
+class FindByNameBudgetTests(budget.BudgetTestCase):
+
+    def test_find_by_name(self):
+        with self.session('find_by_name') as si:
+            root = si.content.rootFolder
+            with self.budget('find_by_name'):
+                vm = root.find_by_name(budget.VM_NAME)
+            self.assertIsInstance(vm, vim.VirtualMachine)
+
+    def test_find_by_name_missing(self):
+        with self.session('find_by_name_missing') as si:
+            root = si.content.rootFolder
+            with self.budget('find_by_name_missing'):
+                vm = root.find_by_name(budget.VM_NAME + '-missing')
+            self.assertIsNone(vm)
+
+    def test_find_all_by_name(self):
+        with self.session('find_all_by_name') as si:
+            root = si.content.rootFolder
+            with self.budget('find_all_by_name'):
+                found = root.find_all_by_name(budget.VM_NAME)
+            self.assertEqual(1, len(found))
+
+
+class _Stub(object):
+    """Answers property reads from a dict and remembers them."""
+
+    def __init__(self):
+        self.props = {}
+        self.reads = []
+
+    def ref(self, obj_type, moid, **props):
+        self.props[moid] = props
+        return obj_type(moid, self)
+
+    def InvokeAccessor(self, mo, info):
+        self.reads.append((mo._moId, info.name))
+        return self.props[mo._moId].get(info.name)
+
+
+class ChildPathTests(testtools.TestCase):
+
+    def _paths(self, types=None):
+        return [(container.__name__, path)
+                for container, path in folder._child_paths(types)]
+
+    def test_no_types_walks_every_folder(self):
+        self.assertEqual([('vim.Folder', 'childEntity'),
+                          ('vim.Datacenter', 'datastoreFolder'),
+                          ('vim.Datacenter', 'hostFolder'),
+                          ('vim.Datacenter', 'networkFolder'),
+                          ('vim.Datacenter', 'vmFolder')],
+                         self._paths())
+
+    def test_virtual_machines(self):
+        self.assertEqual([('vim.Folder', 'childEntity'),
+                          ('vim.Datacenter', 'vmFolder'),
+                          ('vim.VirtualApp', 'vm'),
+                          ('vim.VirtualApp', 'resourcePool')],
+                         self._paths((vim.VirtualMachine,)))
+
+    def test_hosts(self):
+        self.assertEqual([('vim.Folder', 'childEntity'),
+                          ('vim.Datacenter', 'hostFolder'),
+                          ('vim.ComputeResource', 'host')],
+                         self._paths((vim.HostSystem,)))
+
+    def test_clusters(self):
+        self.assertEqual([('vim.Folder', 'childEntity'),
+                          ('vim.Datacenter', 'hostFolder')],
+                         self._paths((vim.ClusterComputeResource,)))
+
+    def test_datastores_and_networks(self):
+        self.assertEqual([('vim.Folder', 'childEntity'),
+                          ('vim.Datacenter', 'datastoreFolder'),
+                          ('vim.Datacenter', 'networkFolder')],
+                         self._paths((vim.Datastore, vim.Network)))
+
+    def test_distributed_switches(self):
+        self.assertEqual([('vim.Folder', 'childEntity'),
+                          ('vim.Datacenter', 'networkFolder')],
+                         self._paths((vim.DistributedVirtualSwitch,)))
+
+    def test_folders_can_be_anywhere(self):
+        self.assertEqual(self._paths(), self._paths((vim.Folder,)))
+
+    def test_managed_entity_opens_everything(self):
+        self.assertEqual(self._paths() +
+                         [('vim.VirtualApp', 'vm'),
+                          ('vim.VirtualApp', 'resourcePool'),
+                          ('vim.ComputeResource', 'host')],
+                         self._paths((vim.ManagedEntity,)))
+
+    def test_may_contain(self):
+        self.assertTrue(folder._may_contain((vim.ComputeResource,),
+                                            (vim.ClusterComputeResource,)))
+        self.assertTrue(folder._may_contain((vim.ClusterComputeResource,),
+                                            (vim.ComputeResource,)))
+        self.assertFalse(folder._may_contain((vim.Datastore,),
+                                             (vim.VirtualMachine,)))
+
+
+class SerialFindByTests(testtools.TestCase):
+
+    def setUp(self):
+        super(SerialFindByTests, self).setUp()
+        stub = self.stub = _Stub()
+        vm = stub.ref(vim.VirtualMachine, 'vm-1', name='web')
+        host = stub.ref(vim.HostSystem, 'host-1', name='esx')
+        cluster = stub.ref(vim.ClusterComputeResource, 'domain-c1',
+                           name='cluster', host=[host])
+        folders = dict(
+            vmFolder=stub.ref(vim.Folder, 'group-v1', name='vm',
+                              childEntity=[vm]),
+            hostFolder=stub.ref(vim.Folder, 'group-h1', name='host',
+                                childEntity=[cluster]),
+            datastoreFolder=stub.ref(vim.Folder, 'group-s1',
+                                     name='datastore', childEntity=[]),
+            networkFolder=stub.ref(vim.Folder, 'group-n1', name='network',
+                                   childEntity=[]))
+        datacenter = stub.ref(vim.Datacenter, 'datacenter-1', name='dc',
+                              **folders)
+        self.root = stub.ref(vim.Folder, 'group-d1', name='Datacenters',
+                             childEntity=[datacenter])
+
+    def _child_reads(self):
+        return [read for read in self.stub.reads if read[1] != 'name']
+
+    def test_walks_datacenter_folders(self):
+        self.assertEqual('vm-1', self.root.find_by_name('web')._moId)
+        self.assertEqual('domain-c1',
+                         self.root.find_by_name('cluster')._moId)
+        # compute resources are only opened when hosts are asked for
+        self.assertIsNone(self.root.find_by_name('esx'))
+
+    def test_types_prune_the_walk(self):
+        found = self.root.find_all_by_name('web',
+                                           types=[vim.VirtualMachine])
+        self.assertEqual(['vm-1'], [vm._moId for vm in found])
+        self.assertEqual([('group-d1', 'childEntity'),
+                          ('datacenter-1', 'vmFolder'),
+                          ('group-v1', 'childEntity')],
+                         self._child_reads())
+        # the matcher only runs on virtual machines
+        self.assertEqual([('vm-1', 'name')],
+                         [r for r in self.stub.reads if r[1] == 'name'])
+
+    def test_hosts_are_found_in_clusters(self):
+        found = self.root.find_all_by_name('esx', types=[vim.HostSystem])
+        self.assertEqual(['host-1'], [host._moId for host in found])
+        self.assertEqual([('group-d1', 'childEntity'),
+                          ('datacenter-1', 'hostFolder'),
+                          ('group-h1', 'childEntity'),
+                          ('domain-c1', 'host')],
+                         self._child_reads())
+
+    def test_names_are_passed_and_yielded(self):
+        found = list(self.root.find_by(lambda e, name: name == 'web',
+                                       types=[vim.VirtualMachine],
+                                       names=True))
+        self.assertEqual([('vm-1', 'web')],
+                         [(e._moId, name) for e, name in found])
+
+
+class _ChildCollector(object):
+    """Answers the child RetrievePropertiesEx calls of a parallel find_by.
+
+    Children and names come from the inventory of a _Stub, at most
+    page_size objects per result. calls keeps the sorted container ids of
+    each call, error is raised by the next call.
+    """
+
+    def __init__(self, stub, page_size=None):
+        self.stub = stub
+        self.page_size = page_size
+        self.calls = []
+        self.continued = []
+        self.error = None
+        self._pages = {}
+        self._lock = threading.Lock()
+
+    def RetrievePropertiesEx(self, specs, options):
+        obj_specs = specs[0].objectSet
+        with self._lock:
+            self.calls.append(sorted(o.obj._moId for o in obj_specs))
+            if self.error is not None:
+                raise self.error
+        objects = []
+        for obj_spec in obj_specs:
+            props = self.stub.props[obj_spec.obj._moId]
+            for traversal in obj_spec.selectSet:
+                if not isinstance(obj_spec.obj, traversal.type):
+                    continue
+                children = props.get(traversal.path) or []
+                if not isinstance(children, list):
+                    children = [children]
+                for child in children:
+                    name = self.stub.props[child._moId]['name']
+                    objects.append(fakes.Record(obj=child, propSet=[
+                        fakes.Record(name='name', val=name)]))
+        return self._page(objects)
+
+    def ContinueRetrievePropertiesEx(self, token):
+        with self._lock:
+            self.continued.append(token)
+            objects = self._pages.pop(token)
+        return self._page(objects)
+
+    def _page(self, objects):
+        if self.page_size is None or len(objects) <= self.page_size:
+            return fakes.Record(objects=objects, token=None)
+        with self._lock:
+            token = 'token-%d' % len(self.continued + list(self._pages))
+            self._pages[token] = objects[self.page_size:]
+        return fakes.Record(objects=objects[:self.page_size], token=token)
+
+
+class _Pool(ThreadPool):
+    """A ThreadPool that remembers being terminated."""
+
+    created = []
+
+    def __init__(self, *args, **kwargs):
+        super(_Pool, self).__init__(*args, **kwargs)
+        self.terminated = False
+        _Pool.created.append(self)
+
+    def terminate(self):
+        self.terminated = True
+        super(_Pool, self).terminate()
+
+
+class ParallelFindByTests(testtools.TestCase):
+    """
+    Datacenters
+      f0 .. f4 (folders)
+        vm-0 .. vm-4 named web-0 .. web-4, one per folder
+    """
+
+    def setUp(self):
+        super(ParallelFindByTests, self).setUp()
+        stub = self.stub = _Stub()
+        self.vms = [stub.ref(vim.VirtualMachine, 'vm-%d' % i,
+                             name='web-%d' % i) for i in range(5)]
+        self.folders = [stub.ref(vim.Folder, 'group-%d' % i, name='f%d' % i,
+                                 childEntity=[vm])
+                        for i, vm in enumerate(self.vms)]
+        self.root = stub.ref(vim.Folder, 'group-d1', name='Datacenters',
+                             childEntity=self.folders)
+        self.collector = _ChildCollector(stub)
+        stub.ref(vim.ServiceInstance, 'ServiceInstance',
+                 content=fakes.Record(propertyCollector=self.collector))
+        self.patch(_Pool, 'created', [])
+        self.patch(folder, 'ThreadPool', _Pool)
+
+    def test_children_are_fetched_in_batches(self):
+        found = list(self.root.find_by(lambda e: e.name == 'web-3',
+                                       workers=1, batch_size=2))
+        self.assertEqual([self.vms[3]], found)
+        # one worker, so the frontier is split by batch_size alone
+        self.assertEqual([['group-d1'], ['group-0', 'group-1'],
+                          ['group-2', 'group-3'], ['group-4']],
+                         self.collector.calls)
+
+    def test_narrow_frontiers_are_spread_over_workers(self):
+        self.root.find_all_by_name('web-1', workers=2)
+        self.assertEqual([['group-0', 'group-1', 'group-2'],
+                          ['group-3', 'group-4'], ['group-d1']],
+                         sorted(self.collector.calls))
+
+    def test_results_are_paged(self):
+        self.collector.page_size = 2
+        found = self.root.find_all_by_name('web-4', workers=1)
+        self.assertEqual([self.vms[4]], found)
+        # five children of the root, then five of the folders
+        self.assertEqual(4, len(self.collector.continued))
+
+    def test_names_stream_without_name_reads(self):
+        found = list(self.root.find_by(
+            lambda e, name: name.startswith('web-'), workers=3,
+            types=[vim.VirtualMachine], names=True))
+        self.assertEqual([(vm, 'web-%d' % i)
+                          for i, vm in enumerate(self.vms)],
+                         sorted(found, key=lambda pair: pair[1]))
+        self.assertEqual([], [r for r in self.stub.reads
+                              if r[1] == 'name'])
+
+    def test_worker_errors_reach_the_caller(self):
+        self.collector.error = vim.fault.NotAuthenticated()
+        self.assertRaises(vim.fault.NotAuthenticated, list,
+                          self.root.find_by(lambda e: True, workers=2))
+        self.assertTrue(_Pool.created[0].terminated)
+
+    def test_closing_terminates_the_pool(self):
+        found = self.root.find_by(lambda e: isinstance(e, vim.Folder),
+                                  workers=2)
+        self.assertIsInstance(next(found), vim.Folder)
+        found.close()
+        self.assertTrue(_Pool.created[0].terminated)
+
+    def test_find_by_name_stops_at_the_first_match(self):
+        deep = self.stub.ref(vim.Folder, 'group-9', name='deep',
+                             childEntity=[])
+        self.stub.props['group-0']['childEntity'].append(deep)
+        self.assertEqual(self.folders[2],
+                         self.root.find_by_name('f2', workers=1))
+        # the match is not opened, and nothing below the level already
+        # submitted is
+        opened = sum(self.collector.calls, [])
+        self.assertEqual(['group-d1'], self.collector.calls[0])
+        self.assertNotIn('group-2', opened)
+        self.assertNotIn('group-9', opened)
+        self.assertTrue(_Pool.created[0].terminated)
+
+    def test_find_by_name_miss_does_not_walk_again(self):
+        def serial(*args, **kwargs):
+            self.fail('the serial walk ran after the parallel one')
+        self.patch(folder, '_serial_find_by', serial)
+        self.assertIsNone(self.root.find_by_name('missing', workers=2))
+        self.assertEqual(1 + 2, len(self.collector.calls))
+
+
+class _SearchIndex(object):
+    """Answers SearchIndex calls from the inventory of a _Stub.
+
+    FindChild sees a Datacenter's vmFolder and hostFolder as its children
+    and nothing else of it, as vCenter does. The FindAllBy* calls answer
+    from found, {(method, key): [entity]}.
+    """
+
+    def __init__(self, stub):
+        self.stub = stub
+        self.found = {}
+        self.calls = []
+
+    def _find(self, method, key):
+        self.calls.append((method, key))
+        return list(self.found.get((method, key), []))
+
+    def FindByInventoryPath(self, path):
+        self.calls.append(('FindByInventoryPath', path))
+        entity = self.stub.root
+        for name in path.split('/'):
+            entity = self._child(entity, name)
+        return entity
+
+    def FindChild(self, entity, name):
+        self.calls.append(('FindChild', entity._moId, name))
+        if isinstance(entity, vim.Datacenter) and \
+                name in ('datastore', 'network'):
+            return None
+        return self._child(entity, name)
+
+    def _child(self, entity, name):
+        props = self.stub.props[entity._moId]
+        children = props.get('childEntity') or props.get('vm') or []
+        if isinstance(entity, vim.Datacenter):
+            children = [props[path] for path in ('vmFolder', 'hostFolder',
+                                                 'datastoreFolder',
+                                                 'networkFolder')]
+        for child in children:
+            if self.stub.props[child._moId].get('name') == name:
+                return child
+
+    def FindByUuid(self, datacenter, uuid, vm_search, instance_uuid):
+        return (self._find('FindAllByUuid', uuid) or [None])[0]
+
+    def FindAllByUuid(self, datacenter, uuid, vm_search, instance_uuid):
+        return self._find('FindAllByUuid', uuid)
+
+    def FindByIp(self, datacenter, ip, vm_search):
+        return (self._find('FindAllByIp', ip) or [None])[0]
+
+    def FindAllByIp(self, datacenter, ip, vm_search):
+        return self._find('FindAllByIp', ip)
+
+    def FindByDnsName(self, datacenter, dns_name, vm_search):
+        return (self._find('FindAllByDnsName', dns_name) or [None])[0]
+
+    def FindAllByDnsName(self, datacenter, dns_name, vm_search):
+        return self._find('FindAllByDnsName', dns_name)
+
+
+class SearchIndexTests(testtools.TestCase):
+    """
+    Datacenters
+      dc
+        vm
+          apps
+            web (vm)
+          shop (vApp)
+            db (vm)
+        host
+        datastore
+          ds1
+        network
+    """
+
+    def setUp(self):
+        super(SearchIndexTests, self).setUp()
+        stub = self.stub = _Stub()
+        self.root = stub.root = stub.ref(vim.Folder, 'group-d1',
+                                         name='Datacenters')
+        dc = self.dc = stub.ref(vim.Datacenter, 'datacenter-1', name='dc',
+                                parent=self.root)
+        vm_folder = stub.ref(vim.Folder, 'group-v1', name='vm', parent=dc)
+        self.apps = stub.ref(vim.Folder, 'group-v2', name='apps',
+                             parent=vm_folder)
+        self.web = stub.ref(vim.VirtualMachine, 'vm-1', name='web',
+                            parent=self.apps)
+        self.shop = stub.ref(vim.VirtualApp, 'resgroup-v3', name='shop',
+                             parent=vm_folder)
+        # virtual machines in a vApp have no parent, only a parentVApp
+        self.db = stub.ref(vim.VirtualMachine, 'vm-2', name='db',
+                           parentVApp=self.shop)
+        datastore_folder = stub.ref(vim.Folder, 'group-s1',
+                                    name='datastore', parent=dc)
+        self.ds1 = stub.ref(vim.Datastore, 'datastore-1', name='ds1',
+                            parent=datastore_folder)
+        stub.props['group-d1']['childEntity'] = [dc]
+        stub.props['datacenter-1'].update(
+            vmFolder=vm_folder, datastoreFolder=datastore_folder,
+            hostFolder=stub.ref(vim.Folder, 'group-h1', name='host',
+                                parent=dc, childEntity=[]),
+            networkFolder=stub.ref(vim.Folder, 'group-n1', name='network',
+                                   parent=dc, childEntity=[]))
+        stub.props['group-v1']['childEntity'] = [self.apps, self.shop]
+        stub.props['group-v2']['childEntity'] = [self.web]
+        stub.props['resgroup-v3']['vm'] = [self.db]
+        stub.props['group-s1']['childEntity'] = [self.ds1]
+        self.index = _SearchIndex(stub)
+        stub.ref(vim.ServiceInstance, 'ServiceInstance',
+                 content=fakes.Record(searchIndex=self.index))
+
+    def test_path_from_the_root(self):
+        self.assertEqual(self.web,
+                         self.root.find_by_path('/dc/vm/apps/web/'))
+        self.assertEqual([('FindByInventoryPath', 'dc/vm/apps/web')],
+                         self.index.calls)
+        self.assertEqual(self.web,
+                         self.root.find_by_name('dc/vm/apps/web', path=True))
+
+    def test_path_from_a_sub_folder(self):
+        vm_folder = self.stub.props['datacenter-1']['vmFolder']
+        self.assertEqual(self.web, vm_folder.find_by_path('apps/web'))
+        self.assertEqual([('FindChild', 'group-v1', 'apps'),
+                          ('FindChild', 'group-v2', 'web')],
+                         self.index.calls)
+        self.assertIsNone(vm_folder.find_by_path('apps/missing/web'))
+
+    def test_datacenter_folders_from_a_sub_folder(self):
+        # a Datacenter below a sub-folder
+        folder = self.stub.ref(vim.Folder, 'group-d2', name='emea',
+                               parent=self.root, childEntity=[self.dc])
+        self.assertEqual(self.ds1, folder.find_by_path('dc/datastore/ds1'))
+        self.assertEqual(self.web, folder.find_by_path('dc/vm/apps/web'))
+        self.assertIsNone(folder.find_by_path('dc/network/missing'))
+        # the folders are read, not looked up
+        self.assertNotIn(('FindChild', 'datacenter-1', 'datastore'),
+                         self.index.calls)
+
+    def test_uuid(self):
+        other = self.stub.ref(vim.VirtualMachine, 'vm-9', name='other',
+                              parent=self.stub.root)
+        self.index.found[('FindAllByUuid', 'u-1')] = [other, self.web]
+        self.assertEqual(other, self.root.find_by_uuid('u-1'))
+        self.assertEqual(self.web, self.apps.find_by_uuid('u-1'))
+        self.assertEqual([self.web], self.apps.find_all_by_uuid('u-1'))
+        self.assertEqual([other, self.web],
+                         self.root.find_all_by_uuid('u-1'))
+        self.assertIsNone(self.apps.find_by_uuid('u-2'))
+
+    def test_ip_is_scoped_through_vapps(self):
+        self.index.found[('FindAllByIp', '10.0.0.2')] = [self.db, self.web]
+        vm_folder = self.stub.props['datacenter-1']['vmFolder']
+        self.assertEqual(self.db, vm_folder.find_by_ip('10.0.0.2'))
+        self.assertEqual(self.web, self.apps.find_by_ip('10.0.0.2'))
+        self.assertEqual(self.db, self.root.find_by_ip('10.0.0.2'))
+        self.assertEqual([('FindAllByIp', '10.0.0.2')] * 3,
+                         self.index.calls)
+
+    def test_dns_name_outside_the_folder(self):
+        self.index.found[('FindAllByDnsName', 'db.example.com')] = [self.db]
+        self.assertIsNone(self.apps.find_by_dns_name('db.example.com'))
+        self.assertEqual(self.db,
+                         self.dc.vmFolder.find_by_dns_name('db.example.com'))
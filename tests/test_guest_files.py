@@ -0,0 +1,184 @@
+# Copyright (c) 2014 VMware, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import testtools
+from six.moves import BaseHTTPServer
+from six.moves import socketserver
+
+from pyvmomi_tools.extensions import guest_files
+from pyVmomi import vim
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps connections alive between requests
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _enter(self):
+        server = self.server
+        with server.lock:
+            server.active += 1
+            server.peak = max(server.peak, server.active)
+
+    def _leave(self):
+        with self.server.lock:
+            self.server.active -= 1
+
+    def do_PUT(self):
+        self._enter()
+        try:
+            size = int(self.headers['Content-Length'])
+            data = b''
+            while len(data) < size:
+                data += self.rfile.read(min(65536, size - len(data)))
+            self.server.release.wait(5)
+            self.server.files[self.path] = data
+            self.send_response(200)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        finally:
+            self._leave()
+
+    def do_GET(self):
+        data = self.server.files.get(self.path)
+        if data is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class _Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class HostConnectionPoolTests(testtools.TestCase):
+
+    def setUp(self):
+        super(HostConnectionPoolTests, self).setUp()
+        self.server = _Server(('127.0.0.1', 0), _Handler)
+        self.server.files = {}
+        self.server.lock = threading.Lock()
+        self.server.active = self.server.peak = 0
+        self.server.release = threading.Event()
+        self.server.release.set()
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+
+    def test_round_trip_streams_over_one_connection(self):
+        pool = guest_files.HostConnectionPool()
+        self.addCleanup(pool.close)
+        data = b'0123456789' * 100000
+        for i in range(3):
+            sent = pool.put(self.url + '/f%d?token=x' % i, io.BytesIO(data),
+                            len(data), chunk_size=4096)
+            self.assertEqual(len(data), sent)
+        received = io.BytesIO()
+        self.assertEqual(len(data), pool.get(self.url + '/f2?token=x',
+                                             received, chunk_size=4096))
+        self.assertEqual(data, received.getvalue())
+        self.assertEqual(1, pool.connections_opened)
+
+    def test_error_status_raises(self):
+        pool = guest_files.HostConnectionPool()
+        self.addCleanup(pool.close)
+        self.assertRaises(guest_files.GuestTransferError, pool.get,
+                          self.url + '/missing', io.BytesIO())
+
+    def test_concurrency_is_limited_per_host(self):
+        pool = guest_files.HostConnectionPool(max_per_host=2)
+        self.addCleanup(pool.close)
+        self.server.release.clear()
+        threads = [threading.Thread(target=pool.put,
+                                    args=(self.url + '/c%d' % i,
+                                          io.BytesIO(b'x'), 1))
+                   for i in range(6)]
+        for thread in threads:
+            thread.start()
+        # both slots taken before any transfer may finish
+        deadline = time.time() + 5
+        while self.server.peak < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        self.server.release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(6, len(self.server.files))
+        self.assertEqual(2, self.server.peak)
+        self.assertTrue(pool.connections_opened <= 2)
+
+
+class DownloadTests(testtools.TestCase):
+
+    def setUp(self):
+        super(DownloadTests, self).setUp()
+        self.server = _Server(('127.0.0.1', 0), _Handler)
+        self.server.files = {'/present': b'new contents'}
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.local_path = os.path.join(self.directory, 'file.txt')
+        with open(self.local_path, 'wb') as f:
+            f.write(b'old contents')
+        self.pool = guest_files.HostConnectionPool()
+        self.addCleanup(self.pool.close)
+
+    def _download(self, path):
+        url = self.url + path
+
+        class FileManager(object):
+            def InitiateFileTransferFromGuest(self, vm, auth, guest_path):
+                return vim.vm.guest.FileManager.FileTransferInformation(
+                    url=url)
+
+        self.patch(guest_files, '_file_manager', lambda vm: FileManager())
+        return guest_files.download_from_guest(None, None, '/tmp/file.txt',
+                                               self.local_path,
+                                               pool=self.pool)
+
+    def _contents(self):
+        with open(self.local_path, 'rb') as f:
+            return f.read()
+
+    def test_download_replaces_the_file(self):
+        self.assertEqual(len(b'new contents'), self._download('/present'))
+        self.assertEqual(b'new contents', self._contents())
+        self.assertEqual(['file.txt'], os.listdir(self.directory))
+
+    def test_failed_download_keeps_the_file(self):
+        self.assertRaises(guest_files.GuestTransferError, self._download,
+                          '/missing')
+        self.assertEqual(b'old contents', self._contents())
+        self.assertEqual(['file.txt'], os.listdir(self.directory))
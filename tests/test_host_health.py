@@ -0,0 +1,142 @@
+# Copyright (c) 2014 VMware, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import testtools
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from pyvmomi_tools import extensions  # noqa
+from pyvmomi_tools.extensions import host_health
+from pyVmomi import vim
+
+from tests import fakes
+
+GIB = 1024 * 1024 * 1024
+THRESHOLDS = (0.85, 0.95, 0.85, 0.95)
+
+
+def _row(moid, status='green', state='connected', maintenance=False,
+         cpu=1000, memory=1024, **props):
+    # four 2500MHz cores and 16GB, cpu in MHz and memory in MB used
+    props.update({'name': 'esx-' + moid, 'overallStatus': status,
+                  'runtime.connectionState': state,
+                  'runtime.inMaintenanceMode': maintenance,
+                  'summary.quickStats.overallCpuUsage': cpu,
+                  'summary.quickStats.overallMemoryUsage': memory,
+                  'summary.hardware.cpuMhz': 2500,
+                  'summary.hardware.numCpuCores': 4,
+                  'summary.hardware.memorySize': 16 * GIB})
+    return vim.HostSystem(moid), dict((k, v) for k, v in props.items()
+                                      if v is not None)
+
+
+def _sweep(*rows):
+    return host_health.HealthSweep(list(rows), *THRESHOLDS)
+
+
+def _health(sweep):
+    return dict((host_id, sweep.value('health', row))
+                for row, host_id in enumerate(sweep.ids))
+
+
+@testtools.skipIf(numpy is None, 'HealthSweep requires numpy')
+class HealthTests(testtools.TestCase):
+
+    def test_classification(self):
+        sweep = _sweep(_row('ok'),
+                       _row('yellow', status='yellow'),
+                       _row('gray', status='gray'),
+                       _row('red', status='red'),
+                       _row('down', state='notResponding'),
+                       _row('unknown-state', state='somethingNew'),
+                       _row('cpu-warning', cpu=8500),
+                       _row('cpu-critical', cpu=9500),
+                       _row('memory-warning', memory=14000),
+                       _row('memory-critical', memory=16384),
+                       _row('no-stats', cpu=None, memory=None),
+                       _row('no-capacity', **{
+                           'summary.hardware.numCpuCores': 0}))
+        self.assertEqual({'ok': 'ok', 'yellow': 'warning',
+                          'gray': 'warning', 'red': 'critical',
+                          'down': 'critical', 'unknown-state': 'critical',
+                          'cpu-warning': 'warning',
+                          'cpu-critical': 'critical',
+                          'memory-warning': 'warning',
+                          'memory-critical': 'critical',
+                          'no-stats': 'ok', 'no-capacity': 'ok'},
+                         _health(sweep))
+        self.assertEqual({'ok': 3, 'warning': 4, 'critical': 5},
+                         sweep.counts())
+
+    def test_ratios(self):
+        sweep = _sweep(_row('a', cpu=5000, memory=4096), _row('b', cpu=None))
+        self.assertEqual([0.5, 0.25], [sweep.cpu_ratio[0],
+                                       sweep.memory_ratio[0]])
+        self.assertTrue(numpy.isnan(sweep.cpu_ratio[1]))
+
+    def test_values(self):
+        # an unknown overallStatus is not a problem on its own
+        sweep = _sweep(_row('a', status='purple', maintenance=True))
+        self.assertEqual([None, 'connected', True, 'ok'],
+                         [sweep.value(f, 0) for f in
+                          ('overall_status', 'connection_state',
+                           'in_maintenance', 'health')])
+
+    def test_diff(self):
+        before = _sweep(_row('same'), _row('hot'), _row('gone'),
+                        _row('maintenance'))
+        after = _sweep(_row('new', status='red'), _row('maintenance',
+                                                       maintenance=True),
+                       _row('hot', cpu=9600), _row('same'))
+        changes = [(c.host._moId, c.name, c.field, c.old, c.new)
+                   for c in after.diff(before)]
+        self.assertEqual([
+            ('new', 'esx-new', 'host', None, 'critical'),
+            ('gone', 'esx-gone', 'host', 'ok', None),
+            ('hot', 'esx-hot', 'health', 'ok', 'critical'),
+            ('maintenance', 'esx-maintenance', 'in_maintenance', False,
+             True)], changes)
+
+    def test_diff_without_previous(self):
+        self.assertEqual([], _sweep(_row('a')).diff(None))
+        self.assertEqual([], _sweep(_row('a')).diff(_sweep(_row('a'))))
+
+
+@testtools.skipIf(numpy is None, 'HostHealthSweeper requires numpy')
+class SweeperTests(testtools.TestCase):
+
+    def test_sweeps_report_changes_since_the_last(self):
+        sweeps = [[_row('a')], [_row('a', status='yellow')],
+                  [_row('a', status='yellow')]]
+        calls = []
+
+        def iter_properties(*args):
+            calls.append(args)
+            return iter(sweeps.pop(0))
+        si = fakes.Record(content=fakes.Record(
+            propertyCollector=fakes.Record(iter_properties=iter_properties),
+            rootFolder='root'))
+        sweeper = host_health.HostHealthSweeper(si, page_size=10)
+        self.assertEqual([], sweeper.sweep())
+        self.assertEqual([('overall_status', 'green', 'yellow'),
+                          ('health', 'ok', 'warning')],
+                         sorted(((c.field, c.old, c.new)
+                                 for c in sweeper.sweep()),
+                                key=lambda c: c[0] != 'overall_status'))
+        self.assertEqual([], sweeper.sweep())
+        self.assertEqual(('root', vim.HostSystem, host_health._PATHS, 10),
+                         calls[0])
@@ -0,0 +1,126 @@
+# Copyright (c) 2014 VMware, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+
+import testtools
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from pyvmomi_tools import extensions  # noqa
+from pyvmomi_tools.extensions import performance_manager
+from pyVmomi import vim
+
+_COUNTERS = ['cpu.usage.average', 'mem.active.average', 'net.usage.average']
+
+
+def _counter(key, name):
+    group, counter, rollup = name.split('.')
+    return vim.PerformanceManager.CounterInfo(
+        key=key, groupInfo=vim.ElementDescription(key=group),
+        nameInfo=vim.ElementDescription(key=counter), rollupType=rollup)
+
+
+class _PerfManager(object):
+    """Answers QueryPerf with value = entity number * 100 + counter id,
+    sampled at two times, and records every call.
+    """
+
+    id = 'PerfMgr'
+
+    def __init__(self):
+        self._stub = object()
+        self.perfCounter = [_counter(i + 1, name)
+                            for i, name in enumerate(_COUNTERS)]
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def QueryPerf(self, querySpec):
+        with self._lock:
+            self.calls.append([(spec.entity.id,
+                                [m.counterId for m in spec.metricId])
+                               for spec in querySpec])
+        results = []
+        for spec in querySpec:
+            number = int(spec.entity.id.split('-')[1])
+            results.append(vim.PerformanceManager.EntityMetricCSV(
+                entity=spec.entity,
+                sampleInfoCSV='20,2024-01-01T00:00:20Z,'
+                              '20,2024-01-01T00:00:40Z',
+                value=[vim.PerformanceManager.MetricSeriesCSV(
+                    id=metric,
+                    value='%d,-1' % (number * 100 + metric.counterId))
+                    for metric in spec.metricId]))
+        return results
+
+
+@testtools.skipIf(numpy is None, 'query_stats requires numpy')
+class QueryStatsTests(testtools.TestCase):
+
+    def setUp(self):
+        super(QueryStatsTests, self).setUp()
+        self.patch(performance_manager, '_counter_cache', {})
+        self.perf_manager = _PerfManager()
+        self.vms = [vim.VirtualMachine('vm-%d' % i) for i in range(1, 6)]
+
+    def _query(self, counters, max_query_metrics, entities=None):
+        return performance_manager.query_stats(
+            self.perf_manager, self.vms if entities is None else entities,
+            counters, max_query_metrics=max_query_metrics)
+
+    def _metrics_per_call(self):
+        return [sum(len(ids) for _, ids in call)
+                for call in self.perf_manager.calls]
+
+    def test_values(self):
+        stats = self._query(_COUNTERS[:2], 0)
+        self.assertEqual((5, 2, 2), stats.values.shape)
+        self.assertEqual(numpy.datetime64('2024-01-01T00:00:20'),
+                         stats.timestamps[0])
+        self.assertEqual([301, 302], list(stats.values[2, :, 0]))
+        # -1 is a missing sample
+        self.assertTrue(numpy.isnan(stats.values[:, :, 1]).all())
+
+    def test_entities_are_chunked_to_the_limit(self):
+        self._query(_COUNTERS[:2], 4)
+        self.assertEqual([4, 4, 2], sorted(self._metrics_per_call(),
+                                           reverse=True))
+
+    def test_counters_are_chunked_above_the_limit(self):
+        stats = self._query(_COUNTERS, 2, entities=self.vms[:1])
+        self.assertEqual([2, 1], sorted(self._metrics_per_call(),
+                                        reverse=True))
+        self.assertEqual([101, 102, 103], list(stats.values[0, :, 0]))
+
+    def test_every_call_fits_the_limit(self):
+        stats = self._query(_COUNTERS, 2)
+        self.assertTrue(max(self._metrics_per_call()) <= 2)
+        self.assertEqual(15, sum(self._metrics_per_call()))
+        self.assertEqual([501, 502, 503], list(stats.values[4, :, 0]))
+
+    def test_no_counters(self):
+        stats = self._query([], 4)
+        self.assertEqual((5, 0, 0), stats.values.shape)
+        self.assertEqual([], self.perf_manager.calls)
+
+    def test_no_entities(self):
+        stats = self._query(_COUNTERS, 4, entities=[])
+        self.assertEqual((0, 3, 0), stats.values.shape)
+        self.assertEqual([], self.perf_manager.calls)
+
+    def test_unknown_counter(self):
+        self.assertRaises(KeyError, self._query, ['cpu.nope.average'], 4)
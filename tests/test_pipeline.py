@@ -0,0 +1,132 @@
+# Copyright (c) 2014 VMware, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+
+import testtools
+
+from pyvmomi_tools import extensions  # noqa
+from pyvmomi_tools.extensions.pipeline import Pipeline
+from pyvmomi_tools.extensions.pipeline import Step
+from pyVmomi import vim
+
+from tests import fakes
+
+
+def _collector(states):
+    """Completes every task as soon as a filter is created for it."""
+    collector = fakes.PropertyCollector()
+    collector.on_create = lambda pfilter: collector.put(fakes.update_set([
+        fakes.object_update(pfilter.obj,
+                            [('info.state', states[pfilter.obj.id])],
+                            'enter')]))
+    return collector
+
+
+class PipelineTests(testtools.TestCase):
+
+    def setUp(self):
+        super(PipelineTests, self).setUp()
+        self.task_states = {}
+        self.si = fakes.Record(content=fakes.Record(
+            propertyCollector=_collector(self.task_states)))
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def _step(self, name, fail_for=(), **kwargs):
+        def action(entity):
+            with self.lock:
+                self.calls.append((name, entity))
+            if entity in fail_for:
+                raise ValueError('%s failed for %s' % (name, entity))
+        return Step(name, action, **kwargs)
+
+    def test_sequence_runs_steps_in_order(self):
+        pipeline = Pipeline.sequence([self._step('a'), self._step('b'),
+                                      self._step('c')], si=self.si)
+        results = pipeline.run(['x', 'y'])
+        self.assertEqual(['x', 'y'], [r.entity for r in results])
+        for result in results:
+            self.assertEqual(['a', 'b', 'c'], result.completed)
+            self.assertIsNone(result.failed_step)
+        for entity in 'xy':
+            self.assertEqual(['a', 'b', 'c'],
+                             [n for n, e in self.calls if e == entity])
+
+    def test_failure_stops_only_that_entity(self):
+        pipeline = Pipeline.sequence([self._step('a'),
+                                      self._step('b', fail_for=['y']),
+                                      self._step('c')], si=self.si)
+        x, y = pipeline.run(['x', 'y'])
+        self.assertEqual(['a', 'b', 'c'], x.completed)
+        self.assertEqual(['a'], y.completed)
+        self.assertEqual('b', y.failed_step)
+        self.assertIsInstance(y.error, ValueError)
+        self.assertNotIn(('c', 'y'), self.calls)
+
+    def test_queued_branch_is_skipped_after_a_failure(self):
+        # one worker runs a(x), a(y), b(x) in that order, so y fails a
+        # while its b is still waiting for b's only slot
+        pipeline = Pipeline([self._step('a', fail_for=['y']),
+                             self._step('b', concurrency=1)],
+                            workers=1, si=self.si)
+        x, y = pipeline.run(['x', 'y'])
+        self.assertEqual(['a', 'b'], x.completed)
+        self.assertEqual('a', y.failed_step)
+        self.assertNotIn(('b', 'y'), self.calls)
+
+    def test_first_failure_is_reported(self):
+        pipeline = Pipeline([self._step('a', fail_for=['x']),
+                             self._step('b', fail_for=['x'])],
+                            workers=1, si=self.si)
+        x, = pipeline.run(['x'])
+        self.assertEqual('a', x.failed_step)
+        self.assertEqual('a failed for x', str(x.error))
+
+    def test_concurrency_is_limited(self):
+        # [running now, most running at once]
+        active = [0, 0]
+
+        def action(entity):
+            with self.lock:
+                active[0] += 1
+                active[1] = max(active)
+            threading.Event().wait(0.05)
+            with self.lock:
+                active[0] -= 1
+
+        pipeline = Pipeline([Step('a', action, concurrency=2)],
+                            workers=8, si=self.si)
+        results = pipeline.run(list(range(8)))
+        self.assertEqual(8, len([r for r in results if r.completed]))
+        self.assertEqual(2, active[1])
+
+    def test_tasks_complete_through_the_monitor(self):
+        self.task_states['task-1'] = vim.TaskInfo.State.success
+        self.task_states['task-2'] = vim.TaskInfo.State.error
+        tasks = {'x': vim.Task('task-1'), 'y': vim.Task('task-2')}
+        pipeline = Pipeline([Step('a', lambda e: tasks[e])], si=self.si)
+        x, y = pipeline.run(['x', 'y'])
+        self.assertEqual(['a'], x.completed)
+        self.assertEqual('a', y.failed_step)
+        self.assertIsInstance(y.error, RuntimeError)
+
+    def test_unknown_requirement(self):
+        self.assertRaises(ValueError, Pipeline,
+                          [Step('a', None, requires=['b'])])
+
+    def test_cycle(self):
+        self.assertRaises(ValueError, Pipeline,
+                          [Step('a', None, requires=['b']),
+                           Step('b', None, requires=['a'])])
@@ -0,0 +1,209 @@
+# Copyright (c) 2014 VMware, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import testtools
+
+from pyvmomi_tools.extensions import process_pool
+from pyVmomi import vim
+from pyVmomi import vmodl
+
+from tests import fakes
+
+collector = vmodl.query.PropertyCollector
+
+
+class _Stub(object):
+    """A worker session answering RetrievePropertiesEx from props.
+
+    props maps moid to {name: value}. Objects in deleted fail the whole
+    retrieval, as vCenter does, those in denied come back with a NoPermission
+    missingSet.
+    """
+
+    def __init__(self, props):
+        self.props = props
+        self.deleted = set()
+        self.denied = set()
+        self.fault = None
+        self.retrieved = []
+        self.content = fakes.Record(
+            propertyCollector=vim.PropertyCollector('propertyCollector',
+                                                    self))
+
+    def InvokeAccessor(self, mo, info):
+        return self.content
+
+    def InvokeMethod(self, mo, info, args):
+        assert info.wsdlName == 'RetrievePropertiesEx', info.wsdlName
+        spec = args[0][0]
+        objects = [s.obj for s in spec.objectSet]
+        self.retrieved.append((sorted(o._moId for o in objects),
+                               sorted(p.type.__name__
+                                      for p in spec.propSet)))
+        if self.fault is not None:
+            raise self.fault
+        for obj in objects:
+            if obj._moId in self.deleted:
+                raise vmodl.fault.ManagedObjectNotFound(obj=obj)
+        return collector.RetrieveResult(objects=[
+            self._content(obj) for obj in objects])
+
+    def _content(self, obj):
+        if obj._moId in self.denied:
+            return collector.ObjectContent(obj=obj, missingSet=[
+                collector.MissingProperty(
+                    path='name', fault=vim.fault.NoPermission(
+                        msg='no access', privilegeId='System.Read'))])
+        return collector.ObjectContent(obj=obj, propSet=[
+            vmodl.DynamicProperty(name=name, val=value)
+            for name, value in self.props[obj._moId].items()])
+
+
+def _power_state(vm, suffix=''):
+    if vm._moId == 'vm-2':
+        raise vim.fault.InvalidState(msg='busy')
+    return vm._moId + suffix
+
+
+class ReferenceTests(testtools.TestCase):
+
+    def test_ref_and_resolve(self):
+        stub = object()
+        reference = process_pool.ref(vim.VirtualMachine('vm-1'))
+        self.assertEqual(('vim.VirtualMachine', 'vm-1'), reference)
+        vm = process_pool.resolve(reference, fakes.Record(_stub=stub))
+        self.assertIsInstance(vm, vim.VirtualMachine)
+        self.assertEqual('vm-1', vm._moId)
+        self.assertIs(stub, vm._stub)
+
+    def test_shard(self):
+        references = [('vim.VirtualMachine', 'vm-%d' % i)
+                      for i in range(40)]
+        shards = process_pool.shard(references, 4)
+        self.assertEqual(4, len(shards))
+        self.assertEqual(sorted(references), sorted(sum(shards, [])))
+        # an id lands in the same shard whatever the order
+        self.assertEqual(sorted(map(sorted, shards)),
+                         sorted(map(sorted, process_pool.shard(
+                             list(reversed(references)), 4))))
+
+    def test_shard_drops_empty_shards(self):
+        self.assertEqual([[('vim.Datastore', 'datastore-1')]],
+                         process_pool.shard([('vim.Datastore',
+                                              'datastore-1')], 8))
+        self.assertEqual([], process_pool.shard([], 8))
+
+
+class ShardTests(testtools.TestCase):
+
+    def setUp(self):
+        super(ShardTests, self).setUp()
+        self.stub = _Stub({
+            'vm-1': {'name': 'web'}, 'vm-2': {'name': 'db'},
+            'vm-3': {'name': 'cache'}, 'host-1': {'name': 'esx'}})
+        self.patch(process_pool, '_worker_si',
+                   fakes.Record(_stub=self.stub, content=self.stub.content))
+        self.references = [('vim.VirtualMachine', 'vm-%d' % i)
+                           for i in (1, 2, 3)]
+
+    def _retrieve(self, references=None):
+        return sorted(process_pool._retrieve_shard(
+            (references or self.references, ['name'], 100)))
+
+    def test_map_shard(self):
+        self.assertEqual(
+            [process_pool.Record('vim.VirtualMachine', 'vm-1', 'vm-1!',
+                                 None),
+             process_pool.Record('vim.VirtualMachine', 'vm-2', None,
+                                 'vim.fault.InvalidState: busy'),
+             process_pool.Record('vim.VirtualMachine', 'vm-3', 'vm-3!',
+                                 None)],
+            process_pool._map_shard((_power_state, self.references,
+                                     ('!',))))
+
+    def test_retrieve_shard(self):
+        references = self.references + [('vim.HostSystem', 'host-1')]
+        self.assertEqual(
+            [('vim.HostSystem', 'host-1', {'name': 'esx'}, None),
+             ('vim.VirtualMachine', 'vm-1', {'name': 'web'}, None),
+             ('vim.VirtualMachine', 'vm-2', {'name': 'db'}, None),
+             ('vim.VirtualMachine', 'vm-3', {'name': 'cache'}, None)],
+            self._retrieve(references))
+        # one retrieval with a PropertySpec per type
+        self.assertEqual(
+            [(['host-1', 'vm-1', 'vm-2', 'vm-3'],
+              ['vim.HostSystem', 'vim.VirtualMachine'])],
+            self.stub.retrieved)
+
+    def test_deleted_objects_are_retried_without(self):
+        self.stub.deleted.add('vm-2')
+        self.assertEqual(
+            [('vim.VirtualMachine', 'vm-1', {'name': 'web'}, None),
+             ('vim.VirtualMachine', 'vm-2', None, process_pool._DELETED),
+             ('vim.VirtualMachine', 'vm-3', {'name': 'cache'}, None)],
+            self._retrieve())
+        self.assertEqual([['vm-1', 'vm-2', 'vm-3'], ['vm-1', 'vm-3']],
+                         [moids for moids, _ in self.stub.retrieved])
+
+    def test_missing_properties_are_errors(self):
+        self.stub.denied.add('vm-3')
+        records = self._retrieve()
+        self.assertEqual([None, None], [r.error for r in records[:2]])
+        self.assertEqual(('vim.VirtualMachine', 'vm-3', {}), records[2][:3])
+        self.assertEqual('name: vim.fault.NoPermission: no access',
+                         records[2].error)
+
+    def test_other_faults_fail_the_shard(self):
+        self.stub.fault = vim.fault.NoPermission(msg='denied')
+        self.assertEqual(
+            [process_pool.Record('vim.VirtualMachine', moid, None,
+                                 'vim.fault.NoPermission: denied')
+             for moid in ('vm-1', 'vm-2', 'vm-3')],
+            self._retrieve())
+
+
+class ExecutorTests(testtools.TestCase):
+
+    def setUp(self):
+        super(ExecutorTests, self).setUp()
+        self.calls = []
+        self.patch(process_pool, 'connect', fakes.Record(
+            SmartConnect=self._connect,
+            Disconnect=lambda si: self.calls.append(('disconnect', si))))
+        self.patch(process_pool, 'multiprocessing', fakes.Record(
+            Pool=lambda *args: self.calls.append(('pool',) + args),
+            cpu_count=lambda: 2))
+        self.login_error = None
+
+    def _connect(self, **kwargs):
+        self.calls.append(('connect', kwargs))
+        if self.login_error is not None:
+            raise self.login_error
+        return 'si'
+
+    def test_credentials_are_checked_once(self):
+        process_pool.ProcessExecutor('vcenter', 'user', 'secret')
+        kwargs = {'host': 'vcenter', 'user': 'user', 'pwd': 'secret',
+                  'port': 443}
+        self.assertEqual(
+            [('connect', kwargs), ('disconnect', 'si'),
+             ('pool', 2, process_pool._init_worker, (kwargs,))],
+            self.calls)
+
+    def test_bad_credentials_raise_before_the_workers_start(self):
+        self.login_error = vim.fault.InvalidLogin()
+        self.assertRaises(vim.fault.InvalidLogin,
+                          process_pool.ProcessExecutor,
+                          'vcenter', 'user', 'wrong')
+        self.assertEqual(['connect'], [call[0] for call in self.calls])
@@ -0,0 +1,246 @@
+# Copyright (c) 2014 VMware, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import testtools
+
+from pyvmomi_tools.extensions import profiling
+from pyVmomi import SoapAdapter
+
+
+class _Clock(object):
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class _ProfilingTestCase(testtools.TestCase):
+
+    def setUp(self):
+        super(_ProfilingTestCase, self).setUp()
+        self.clock = _Clock()
+        self.patch(profiling, '_clock', self.clock)
+        self.profiler = profiling.enable(soap=False)
+        self.addCleanup(profiling.disable)
+
+    def _spans(self):
+        return dict((s.name, s) for s in self.profiler.spans)
+
+
+class SpanTests(_ProfilingTestCase):
+
+    def test_disabled_spans_do_nothing(self):
+        profiling.disable()
+        with profiling.span('ignored') as s:
+            s.set(rows=1)
+        self.assertIsNone(s.id)
+        self.assertIsNone(profiling.current())
+        self.assertEqual([], self.profiler.spans)
+
+    def test_nesting(self):
+        with profiling.span('outer') as outer:
+            self.assertEqual(outer.id, profiling.current())
+            self.clock.now += 1
+            with profiling.span('inner', items=2) as inner:
+                self.clock.now += 2
+                inner.set(rows=3)
+            with profiling.span('detached', detached=True):
+                # not the current span of the thread
+                self.assertEqual(outer.id, profiling.current())
+                with profiling.span('beside'):
+                    self.clock.now += 1
+            self.assertEqual(outer.id, profiling.current())
+        self.assertIsNone(profiling.current())
+        spans = self._spans()
+        self.assertEqual([None, outer.id, outer.id, outer.id],
+                         [spans[name].parent for name in
+                          ('outer', 'inner', 'detached', 'beside')])
+        self.assertEqual({'items': 2, 'rows': 3}, spans['inner'].args)
+        self.assertEqual((100.0, 104.0),
+                         (spans['outer'].start, spans['outer'].end))
+        self.assertTrue(spans['detached'].detached)
+
+    def test_parent_across_threads(self):
+        with profiling.span('submit'):
+            parent = profiling.current()
+
+            def work():
+                self.assertIsNone(profiling.current())
+                with profiling.span('work', parent=parent):
+                    pass
+            thread = threading.Thread(target=work)
+            thread.start()
+            thread.join()
+        spans = self._spans()
+        self.assertEqual(spans['submit'].id, spans['work'].parent)
+        self.assertNotEqual(spans['submit'].thread, spans['work'].thread)
+
+    def test_errors_are_recorded(self):
+        def fail():
+            with profiling.span('failing'):
+                raise KeyError('x')
+        self.assertRaises(KeyError, fail)
+        self.assertEqual({'error': 'KeyError'},
+                         self._spans()['failing'].args)
+        self.assertIsNone(profiling.current())
+
+    def test_traced(self):
+        @profiling.traced('work.step')
+        def step(value):
+            self.assertIsNotNone(profiling.current())
+            return value * 2
+        self.assertEqual(4, step(2))
+        self.assertEqual(['work.step'],
+                         [s.name for s in self.profiler.spans])
+
+    def test_max_spans(self):
+        self.profiler.max_spans = 2
+        for _ in range(5):
+            with profiling.span('step'):
+                pass
+        self.assertEqual((2, 3), (len(self.profiler.spans),
+                                  self.profiler.dropped))
+
+    def test_summary(self):
+        with profiling.span('soap.Retrieve'):
+            self.clock.now += 1
+            with profiling.span('soap.parse'):
+                self.clock.now += 3
+            with profiling.span('soap.parse'):
+                self.clock.now += 2
+        self.assertEqual({
+            'soap.Retrieve': {'count': 1, 'total': 6.0, 'self': 1.0},
+            'soap.parse': {'count': 2, 'total': 5.0, 'self': 5.0}},
+            self.profiler.summary())
+
+
+class ChromeTraceTests(_ProfilingTestCase):
+
+    def setUp(self):
+        super(ChromeTraceTests, self).setUp()
+        with profiling.span('outer', vms=3) as outer:
+            self.clock.now += 0.5
+            with profiling.span('pages', detached=True):
+                self.clock.now += 0.25
+                with profiling.span('inner', 'soap'):
+                    self.clock.now += 0.25
+        self.outer = outer.id
+
+    def test_events(self):
+        trace = self.profiler.chrome_trace()
+        events = [dict((k, e.get(k)) for k in ('name', 'ph', 'ts', 'dur',
+                                               'cat'))
+                  for e in trace['traceEvents']]
+        self.assertEqual([
+            {'name': 'outer', 'ph': 'X', 'ts': 0.0, 'dur': 1e6,
+             'cat': 'pyvmomi_tools'},
+            {'name': 'pages', 'ph': 'b', 'ts': 0.5e6, 'dur': None,
+             'cat': 'pyvmomi_tools'},
+            {'name': 'inner', 'ph': 'X', 'ts': 0.75e6, 'dur': 0.25e6,
+             'cat': 'soap'},
+            {'name': 'pages', 'ph': 'e', 'ts': 1e6, 'dur': None,
+             'cat': 'pyvmomi_tools'}], events)
+        by_name = dict((e['name'], e) for e in trace['traceEvents']
+                       if e['ph'] != 'e')
+        self.assertEqual({'vms': 3, 'id': self.outer, 'parent': None},
+                         by_name['outer']['args'])
+        self.assertEqual(self.outer, by_name['inner']['args']['parent'])
+        self.assertEqual(by_name['pages']['args']['id'],
+                         trace['traceEvents'][-1]['id'])
+        self.assertEqual(set([os.getpid()]),
+                         set(e['pid'] for e in trace['traceEvents']))
+        self.assertEqual({'dropped': 0}, trace['otherData'])
+
+    def test_save(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'trace.json')
+        self.profiler.save(path)
+        with open(path) as f:
+            self.assertEqual(self.profiler.chrome_trace(), json.load(f))
+
+
+class SoapHookTests(testtools.TestCase):
+
+    def setUp(self):
+        super(SoapHookTests, self).setUp()
+        self.invoke = SoapAdapter.SoapStubAdapter.InvokeMethod
+        self.deserialize = SoapAdapter.SoapResponseDeserializer.Deserialize
+        self.addCleanup(profiling.disable)
+
+    def _installed(self):
+        return (SoapAdapter.SoapStubAdapter.InvokeMethod,
+                SoapAdapter.SoapResponseDeserializer.Deserialize) != \
+            (self.invoke, self.deserialize)
+
+    def test_enable_and_disable(self):
+        profiling.enable()
+        self.assertTrue(self._installed())
+        hooked = SoapAdapter.SoapStubAdapter.InvokeMethod
+        profiling.enable()
+        self.assertIs(hooked, SoapAdapter.SoapStubAdapter.InvokeMethod)
+        profiling.enable(soap=False)
+        self.assertFalse(self._installed())
+        profiling.enable()
+        profiling.disable()
+        self.assertFalse(self._installed())
+
+    def test_racing_enables(self):
+        # the first enable() stalls reading the method to wrap, while a
+        # second one gets to install its hooks
+        adapter = _SlowAdapter()
+        self.patch(profiling, 'SoapAdapter', adapter)
+        original = adapter.SoapStubAdapter.__dict__['InvokeMethod']
+        threads = [threading.Thread(target=profiling.enable)
+                   for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        profiling.disable()
+        # the originals survive, no hook ends up wrapping another
+        self.assertIs(original,
+                      adapter.SoapStubAdapter.__dict__['InvokeMethod'])
+
+
+class _SlowMethods(object):
+
+    def __init__(self, **methods):
+        self.__dict__.update(methods)
+        self.reads = 0
+
+    def __getattribute__(self, name):
+        if name == 'InvokeMethod':
+            self.reads += 1
+            if self.reads == 1:
+                time.sleep(0.1)
+        return object.__getattribute__(self, name)
+
+
+class _SlowAdapter(object):
+
+    def __init__(self):
+        self.SoapStubAdapter = _SlowMethods(
+            InvokeMethod=lambda stub, mo, info, args: None)
+        self.SoapResponseDeserializer = _SlowMethods(
+            Deserialize=lambda deserializer, response: None)
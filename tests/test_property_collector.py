@@ -0,0 +1,83 @@
+# Copyright (c) 2014 VMware, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import testtools
+
+from pyvmomi_tools.extensions import property_collector
+from pyVmomi import vmodl
+
+from tests import fakes
+
+
+class _Collector(object):
+    """Hands out pages of count objects, numbered from 0."""
+
+    def __init__(self, count):
+        self.count = count
+        self.calls = []
+
+    def _page(self, start, size):
+        end = min(start + size, self.count)
+        return fakes.Record(objects=list(range(start, end)),
+                            token='%d:%d' % (end, size)
+                            if end < self.count else None)
+
+    def RetrievePropertiesEx(self, specs, options):
+        self.calls.append(('RetrievePropertiesEx', options.maxObjects))
+        return self._page(0, options.maxObjects)
+
+    def ContinueRetrievePropertiesEx(self, token):
+        self.calls.append(('ContinueRetrievePropertiesEx', token))
+        return self._page(*[int(n) for n in token.split(':')])
+
+    def CancelRetrievePropertiesEx(self, token):
+        self.calls.append(('CancelRetrievePropertiesEx', token))
+
+
+class IterPagesTests(testtools.TestCase):
+
+    def _pages(self, collector, page_size):
+        return property_collector.iter_pages(
+            collector, vmodl.query.PropertyCollector.FilterSpec(), page_size)
+
+    def test_all_pages(self):
+        collector = _Collector(5)
+        self.assertEqual([[0, 1], [2, 3], [4]],
+                         list(self._pages(collector, 2)))
+        self.assertEqual([('RetrievePropertiesEx', 2),
+                          ('ContinueRetrievePropertiesEx', '2:2'),
+                          ('ContinueRetrievePropertiesEx', '4:2')],
+                         collector.calls)
+
+    def test_closing_early_cancels_the_retrieval(self):
+        collector = _Collector(5)
+        pages = self._pages(collector, 2)
+        self.assertEqual([0, 1], next(pages))
+        self.assertEqual([2, 3], next(pages))
+        pages.close()
+        self.assertEqual(('CancelRetrievePropertiesEx', '4:2'),
+                         collector.calls[-1])
+        self.assertEqual(3, len(collector.calls))
+
+    def test_closing_after_the_last_page_does_not_cancel(self):
+        collector = _Collector(2)
+        pages = self._pages(collector, 2)
+        self.assertEqual([0, 1], next(pages))
+        pages.close()
+        self.assertEqual([('RetrievePropertiesEx', 2)], collector.calls)
+
+    def test_no_results(self):
+        collector = _Collector(0)
+        collector.RetrievePropertiesEx = lambda specs, options: None
+        self.assertEqual([], list(self._pages(collector, 2)))
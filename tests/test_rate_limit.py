@@ -0,0 +1,127 @@
+# Copyright (c) 2014 VMware, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import testtools
+
+from pyvmomi_tools.extensions import rate_limit
+from pyVmomi import vim
+
+from tests import budget
+from tests import fakes
+
+
+READ_INFO = fakes.Record(wsdlName='RetrieveProperties', result=object)
+TASK_INFO = fakes.Record(wsdlName='PowerOnVM_Task', result=vim.Task)
+
+
+class _Stub(object):
+
+    def __init__(self):
+        self.calls = []
+
+    def InvokeMethod(self, mo, info, args):
+        self.calls.append(info.wsdlName)
+        return info.wsdlName
+
+
+class TokenBucketTests(testtools.TestCase):
+
+    def setUp(self):
+        super(TokenBucketTests, self).setUp()
+        self.clock = budget.FakeClock()
+        self.patch(rate_limit, 'time', self.clock)
+
+    def test_burst_then_one_token_per_interval(self):
+        bucket = rate_limit.TokenBucket(rate=2, burst=3)
+        waits = [bucket.reserve() for _ in range(6)]
+        # reservations queue up behind each other without the clock moving
+        self.assertEqual([0.0, 0.0, 0.0, 0.5, 1.0, 1.5], waits)
+
+    def test_default_burst_is_one_seconds_worth(self):
+        self.assertEqual(5.0, rate_limit.TokenBucket(rate=5).burst)
+        self.assertEqual(1.0, rate_limit.TokenBucket(rate=0.5).burst)
+
+    def test_refills_with_time_up_to_burst(self):
+        bucket = rate_limit.TokenBucket(rate=2, burst=2)
+        self.assertEqual([0.0, 0.0, 0.5],
+                         [bucket.reserve() for _ in range(3)])
+        self.clock.now += 1.0
+        # half a second paid back the debt, the other half is one token
+        self.assertEqual([0.0, 0.5],
+                         [bucket.reserve() for _ in range(2)])
+        self.clock.now += 60
+        self.assertEqual([0.0, 0.0, 0.5],
+                         [bucket.reserve() for _ in range(3)])
+
+    def test_acquire_sleeps_for_the_wait(self):
+        bucket = rate_limit.TokenBucket(rate=4, burst=1)
+        self.assertEqual(0.0, bucket.acquire())
+        self.assertEqual(0.25, bucket.acquire())
+        self.assertEqual(0.25, bucket.acquire())
+        self.assertEqual([0.25, 0.25], self.clock.slept)
+
+
+class RateLimiterTests(testtools.TestCase):
+
+    def setUp(self):
+        super(RateLimiterTests, self).setUp()
+        self.clock = budget.FakeClock()
+        self.patch(rate_limit, 'time', self.clock)
+
+    def test_classify(self):
+        self.assertEqual(rate_limit.READ, rate_limit.classify(READ_INFO))
+        self.assertEqual(rate_limit.TASK, rate_limit.classify(TASK_INFO))
+        self.assertEqual(rate_limit.TASK, rate_limit.classify(
+            fakes.Record(wsdlName='Destroy_Task', result=object)))
+
+    def test_limits_and_metrics_per_class(self):
+        limiter = rate_limit.RateLimiter(task_rate=1, task_burst=1)
+        for _ in range(3):
+            limiter.acquire(rate_limit.READ)
+            limiter.acquire(rate_limit.TASK)
+        metrics = limiter.metrics()
+        self.assertEqual({'calls': 3, 'waited_calls': 0, 'wait_seconds': 0.0,
+                          'max_wait_seconds': 0.0}, metrics[rate_limit.READ])
+        self.assertEqual({'calls': 3, 'waited_calls': 2, 'wait_seconds': 2.0,
+                          'max_wait_seconds': 1.0}, metrics[rate_limit.TASK])
+        self.assertEqual([1.0, 1.0], self.clock.slept)
+
+    def test_install_and_uninstall(self):
+        stub = _Stub()
+        si = fakes.Record(_stub=stub)
+        limiter = rate_limit.RateLimiter(read_rate=1, task_rate=1)
+        limiter.install(si)
+        self.assertIs(limiter, rate_limit.installed_limiter(si))
+        self.assertEqual('PowerOnVM_Task',
+                         stub.InvokeMethod(None, TASK_INFO, ()))
+        stub.InvokeMethod(None, READ_INFO, ())
+        stub.InvokeMethod(None, READ_INFO, ())
+        self.assertEqual(['PowerOnVM_Task', 'RetrieveProperties',
+                          'RetrieveProperties'], stub.calls)
+        self.assertEqual([1.0], self.clock.slept)
+        rate_limit.uninstall(si)
+        self.assertIsNone(rate_limit.installed_limiter(si))
+        self.assertNotIn('InvokeMethod', stub.__dict__)
+        stub.InvokeMethod(None, READ_INFO, ())
+        self.assertEqual(2, limiter.metrics()[rate_limit.READ]['calls'])
+
+    def test_reinstall_keeps_one_hook(self):
+        stub = _Stub()
+        first = rate_limit.RateLimiter(read_rate=100)
+        second = rate_limit.RateLimiter(read_rate=100)
+        first.install(stub)
+        second.install(stub)
+        stub.InvokeMethod(None, READ_INFO, ())
+        self.assertEqual(0, first.metrics()[rate_limit.READ]['calls'])
+        self.assertEqual(1, second.metrics()[rate_limit.READ]['calls'])
@@ -0,0 +1,157 @@
+# Copyright (c) 2014 VMware, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import sys
+
+import six
+import testtools
+
+from pyvmomi_tools import extensions  # noqa
+from pyvmomi_tools.cli import run
+from pyVmomi import vim
+
+from tests import fakes
+
+
+class _Entity(object):
+    """A virtual machine whose name must come from the traversal."""
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.calls = []
+
+    @property
+    def name(self):
+        raise AssertionError('name read from the server')
+
+    def PowerOff(self):
+        self.calls.append(('PowerOff',))
+        if self.fail:
+            raise vim.fault.InvalidState()
+        return fakes.Record(entity=self)
+
+    def ResetVM_Task(self):
+        self.calls.append(('ResetVM_Task',))
+        return fakes.Record(entity=self)
+
+    def Rename(self, name):
+        self.calls.append(('Rename', name))
+        return fakes.Record(entity=self)
+
+    def ReconfigVM_Task(self, spec):
+        self.calls.append(('ReconfigVM_Task', spec.memoryMB, spec.numCPUs))
+        return fakes.Record(entity=self)
+
+
+class _Folder(object):
+
+    def __init__(self, entities):
+        self.entities = entities
+        self.kwargs = None
+
+    def find_by(self, matcher, **kwargs):
+        self.kwargs = kwargs
+        return ((entity, name) for name, entity in
+                sorted(self.entities.items()) if matcher(entity, name))
+
+
+class _Monitor(object):
+    """Completes every task as soon as it is added."""
+
+    failing = ()
+
+    def __init__(self, si):
+        self.added = []
+
+    def start(self):
+        pass
+
+    def add(self, task, callback):
+        self.added.append(task)
+        if task.entity in self.failing:
+            callback(task, vim.TaskInfo.State.error, vim.fault.Timedout())
+        else:
+            callback(task, vim.TaskInfo.State.success, None)
+
+    def wait(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+class RunTests(testtools.TestCase):
+
+    def setUp(self):
+        super(RunTests, self).setUp()
+        self.entities = {'web-01': _Entity(), 'web-02': _Entity(),
+                         'db-01': _Entity()}
+        self.folder = _Folder(self.entities)
+        si = fakes.Record(content=fakes.Record(rootFolder=self.folder))
+        self.patch(run.session, 'connect', lambda args: si)
+        self.patch(run.task_extensions, 'TaskMonitor', _Monitor)
+        self.parser = run.add_arguments(argparse.ArgumentParser())
+        self.out = six.StringIO()
+        self.err = six.StringIO()
+        self.patch(sys, 'stdout', self.out)
+        self.patch(sys, 'stderr', self.err)
+
+    def _run(self, *argv):
+        return run.run(self.parser.parse_args(list(argv)))
+
+    def test_operation_on_matches(self):
+        self.assertEqual(0, self._run('power-off', '--match', 'web-*'))
+        self.assertEqual([('PowerOff',)], self.entities['web-01'].calls)
+        self.assertEqual([('PowerOff',)], self.entities['web-02'].calls)
+        self.assertEqual([], self.entities['db-01'].calls)
+        self.assertEqual({'types': [vim.VirtualMachine], 'workers': 8,
+                          'names': True}, self.folder.kwargs)
+
+    def test_rename_uses_the_traversal_name(self):
+        self.assertEqual(0, self._run('rename', '--match', 'db-*',
+                                      '--new-name', 'old-{name}'))
+        self.assertEqual([('Rename', 'old-db-01')],
+                         self.entities['db-01'].calls)
+
+    def test_rename_requires_a_new_name(self):
+        self.assertEqual(2, self._run('rename', '--match', 'db-*'))
+        self.assertEqual([], self.entities['db-01'].calls)
+        self.assertEqual('rename requires --new-name\n',
+                         self.err.getvalue())
+
+    def test_reconfigure_requires_a_change(self):
+        self.assertEqual(2, self._run('reconfigure', '--match', 'web-*'))
+        self.assertEqual([], self.entities['web-01'].calls)
+        self.assertEqual('reconfigure requires --memory-mb or --num-cpus\n',
+                         self.err.getvalue())
+
+    def test_reconfigure(self):
+        self.assertEqual(0, self._run('reconfigure', '--match', 'db-*',
+                                      '--num-cpus', '4'))
+        self.assertEqual([('ReconfigVM_Task', None, 4)],
+                         self.entities['db-01'].calls)
+
+    def test_failures_set_the_exit_code(self):
+        self.entities['web-01'].fail = True
+        self.patch(_Monitor, 'failing', (self.entities['web-02'],))
+        self.assertEqual(1, self._run('power-off', '--match', 'web-*'))
+        lines = self.out.getvalue().splitlines()
+        self.assertIn('web-01: vim.fault.InvalidState', lines)
+        self.assertIn('web-02: vim.fault.Timedout', lines)
+        self.assertTrue(lines[2].startswith('tasks: 0 succeeded, 2 failed'))
+
+    def test_reset(self):
+        self.assertEqual(0, self._run('reset', '--match', 'db-*'))
+        self.assertEqual([('ResetVM_Task',)], self.entities['db-01'].calls)
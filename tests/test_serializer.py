@@ -0,0 +1,122 @@
+# Copyright (c) 2014 VMware, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pickle
+
+import testtools
+
+from pyvmomi_tools.extensions import serializer
+from pyVmomi import Iso8601
+from pyVmomi import SoapAdapter
+from pyVmomi import VmomiSupport
+from pyVmomi import vim
+
+
+def _config(i):
+    add = vim.vm.device.VirtualDeviceSpec.Operation.add
+    disks = []
+    for d in range(3):
+        backing = vim.vm.device.VirtualDisk.FlatVer2BackingInfo(
+            fileName='[ds1] vm-%03d/disk%d.vmdk' % (i, d),
+            diskMode='persistent', thinProvisioned=True)
+        disk = vim.vm.device.VirtualDisk(
+            key=-100 - d, unitNumber=d, controllerKey=1000,
+            capacityInKB=1048576 * (d + 1), backing=backing)
+        disks.append(vim.vm.device.VirtualDeviceSpec(operation=add,
+                                                     device=disk))
+    return vim.vm.ConfigSpec(
+        name='vm-%03d' % i,
+        guestId='otherGuest64',
+        version='vmx-19',
+        uuid='4211%04d-0000-0000-0000-000000000000' % i,
+        annotation='built %d' % i,
+        numCPUs=2,
+        memoryMB=4096,
+        deviceChange=disks,
+        cpuAllocation=vim.ResourceAllocationInfo(
+            reservation=0, limit=-1,
+            shares=vim.SharesInfo(level=vim.SharesInfo.Level.normal,
+                                  shares=2000)),
+        extraConfig=[vim.option.OptionValue(key='k%d' % k, value='v%d' % k)
+                     for k in range(5)])
+
+
+class RoundTripTests(testtools.TestCase):
+
+    def assertSame(self, expected, actual):
+        # data objects do not compare by value, their repr does
+        self.assertEqual(repr(expected), repr(actual))
+
+    def test_json_round_trip(self):
+        config = _config(1)
+        self.assertSame(config, serializer.loads(serializer.dumps(config)))
+
+    def test_pickle_round_trip(self):
+        config = _config(1)
+        data = serializer.dumps(config, fmt=serializer.PICKLE)
+        self.assertSame(config, serializer.loads(data, fmt=serializer.PICKLE))
+
+    def test_typed_values_keep_their_types(self):
+        when = Iso8601.ParseISO8601('2024-05-06T07:08:09Z')
+        values = [vim.VirtualMachine.PowerState.poweredOn,
+                  VmomiSupport.binary(b'\x00\xff'),
+                  when,
+                  vim.VirtualMachine,
+                  VmomiSupport.GetVmodlType('long')(7),
+                  VmomiSupport.GetVmodlType('string[]')(['a', 'b']),
+                  [1, u'two', None, True, 2.5]]
+        decoded = serializer.loads(serializer.dumps(values))
+        self.assertSame(values, decoded)
+        for value, result in zip(values, decoded):
+            self.assertIs(type(value), type(result))
+
+    def test_managed_objects_bind_to_the_stub(self):
+        stub = object()
+        vm = serializer.loads(
+            serializer.dumps([vim.VirtualMachine('vm-42')]), stub=stub)[0]
+        self.assertIsInstance(vm, vim.VirtualMachine)
+        self.assertEqual('vm-42', vm._moId)
+        self.assertIs(stub, vm._stub)
+
+    def test_unset_and_empty_come_back_unset(self):
+        spec = vim.vm.ConfigSpec(name='x', deviceChange=[])
+        decoded = serializer.loads(serializer.dumps(spec))
+        self.assertEqual('x', decoded.name)
+        self.assertIsNone(decoded.annotation)
+        self.assertEqual([], decoded.deviceChange)
+
+    def test_objects_of_one_shape_share_a_table_entry(self):
+        version, table, body = serializer.encode(
+            [_config(i) for i in range(10)])
+        names = [entry[0] for entry in table]
+        self.assertEqual(1, names.count('vim.vm.ConfigSpec'))
+
+    def test_smaller_than_soap(self):
+        configs = [_config(i) for i in range(50)]
+        soap = sum(len(SoapAdapter.Serialize(c)) for c in configs)
+        compact = len(serializer.dumps(configs))
+        self.assertTrue(compact * 2 < soap, (compact, soap))
+
+    def test_pickle_needs_to_be_asked_for(self):
+        data = serializer.dumps(_config(1), fmt=serializer.PICKLE)
+        self.assertRaises(ValueError, serializer.loads, data)
+
+    def test_unknown_format(self):
+        self.assertRaises(ValueError, serializer.dumps, 1, fmt='xml')
+        self.assertRaises(ValueError, serializer.loads, '[]', fmt='xml')
+
+    def test_other_versions_are_refused(self):
+        data = pickle.dumps([serializer.VERSION + 1, [], 1])
+        self.assertRaises(ValueError, serializer.loads, data,
+                          fmt=serializer.PICKLE)
@@ -0,0 +1,134 @@
+# Copyright (c) 2014 VMware, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import shutil
+import stat
+import tempfile
+
+import testtools
+
+from pyvmomi_tools.cli import session
+from pyVmomi import vim
+
+from tests import fakes
+
+
+class _Stub(object):
+    """Answers property reads, and records them, in place of a server."""
+
+    def __init__(self, known_cookies, **kwargs):
+        self.known_cookies = known_cookies
+        self.kwargs = kwargs
+        self.cookie = None
+        self.reads = []
+
+    def InvokeAccessor(self, mo, info):
+        self.reads.append((mo._moId, info.name))
+        if self.cookie not in self.known_cookies:
+            raise vim.fault.NotAuthenticated()
+        return vim.UserSession(key='s1', userName='u')
+
+    def InvokeMethod(self, mo, info, args):
+        raise AssertionError('unexpected call to %s' % info.name)
+
+
+class SessionCacheTests(testtools.TestCase):
+
+    def setUp(self):
+        super(SessionCacheTests, self).setUp()
+        self.cache_dir = os.path.join(tempfile.mkdtemp(), 'sessions')
+        self.addCleanup(shutil.rmtree, os.path.dirname(self.cache_dir))
+        self.known_cookies = set(['cookie-1'])
+        self.stubs = []
+
+        def stub_adapter(**kwargs):
+            stub = _Stub(self.known_cookies, **kwargs)
+            self.stubs.append(stub)
+            return stub
+
+        self.patch(session, 'SoapStubAdapter', stub_adapter)
+        self.path = session._cache_file(self.cache_dir, 'vc', 443, 'u')
+
+    def _save(self, cookie='cookie-1', session_manager='ha-sessionmgr'):
+        si = fakes.Record(
+            _stub=fakes.Record(cookie=cookie,
+                               version='vim.version.v8_0_0_0'),
+            content=fakes.Record(sessionManager=vim.SessionManager(
+                session_manager)))
+        session.save_session(si, 'vc', 443, 'u', self.cache_dir)
+
+    def _load(self):
+        return session.load_session('vc', 443, 'u', self.cache_dir)
+
+    def _mode(self, path):
+        return stat.S_IMODE(os.stat(path).st_mode)
+
+    def test_round_trip_is_one_read(self):
+        self._save()
+        si = self._load()
+        self.assertIsInstance(si, vim.ServiceInstance)
+        stub, = self.stubs
+        self.assertIs(stub, si._stub)
+        self.assertEqual('cookie-1', stub.cookie)
+        self.assertEqual({'host': 'vc', 'port': 443,
+                          'version': 'vim.version.v8_0_0_0'}, stub.kwargs)
+        self.assertEqual([('ha-sessionmgr', 'currentSession')], stub.reads)
+
+    def test_expired_session_is_cleared(self):
+        self._save(cookie='cookie-2')
+        self.assertIsNone(self._load())
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_missing_or_old_cache(self):
+        self.assertIsNone(self._load())
+        os.makedirs(self.cache_dir, 0o700)
+        with open(self.path, 'w') as f:
+            json.dump({'cookie': 'cookie-1', 'version': 'v'}, f)
+        os.chmod(self.path, 0o600)
+        self.assertIsNone(self._load())
+        self.assertEqual([], self.stubs)
+
+    @testtools.skipIf(not hasattr(os, 'getuid'), 'no POSIX permissions')
+    def test_saved_private(self):
+        self._save()
+        self.assertEqual(0o700, self._mode(self.cache_dir))
+        self.assertEqual(0o600, self._mode(self.path))
+
+    @testtools.skipIf(not hasattr(os, 'getuid'), 'no POSIX permissions')
+    def test_existing_files_are_narrowed_on_save(self):
+        os.makedirs(self.cache_dir, 0o755)
+        os.chmod(self.cache_dir, 0o755)
+        with open(self.path, 'w') as f:
+            f.write('{}')
+        os.chmod(self.path, 0o644)
+        self._save()
+        self.assertEqual(0o700, self._mode(self.cache_dir))
+        self.assertEqual(0o600, self._mode(self.path))
+
+    @testtools.skipIf(not hasattr(os, 'getuid'), 'no POSIX permissions')
+    def test_readable_file_is_not_trusted(self):
+        self._save()
+        os.chmod(self.path, 0o644)
+        self.assertIsNone(self._load())
+        self.assertEqual([], self.stubs)
+        self.assertFalse(os.path.exists(self.path))
+
+    @testtools.skipIf(not hasattr(os, 'getuid'), 'no POSIX permissions')
+    def test_readable_directory_is_not_trusted(self):
+        self._save()
+        os.chmod(self.cache_dir, 0o755)
+        self.assertIsNone(self._load())
+        self.assertEqual([], self.stubs)
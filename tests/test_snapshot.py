@@ -0,0 +1,297 @@
+# Copyright (c) 2014 VMware, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+import threading
+
+import testtools
+
+from pyvmomi_tools.extensions import snapshot
+from pyvmomi_tools.extensions import task as task_extensions
+from pyVmomi import vim
+from pyVmomi import vmodl
+
+from tests import fakes
+
+collector = vmodl.query.PropertyCollector
+
+
+class _Stub(object):
+    """Answers RetrievePropertiesEx from props, {moid: {name: value}}.
+
+    Objects in deleted fail the whole retrieval, as vCenter does, those in
+    missing come back with a ManagedObjectNotFound missingSet.
+    """
+
+    def __init__(self):
+        self.props = {}
+        self.deleted = set()
+        self.missing = set()
+        self.retrieved = []
+        self.gone = False
+        self.content = fakes.Record(
+            propertyCollector=vim.PropertyCollector('propertyCollector',
+                                                    self))
+
+    def InvokeAccessor(self, mo, info):
+        return self.content
+
+    def InvokeMethod(self, mo, info, args):
+        assert info.wsdlName == 'RetrievePropertiesEx', info.wsdlName
+        objects = [spec.obj for spec in args[0][0].objectSet]
+        self.retrieved.append([obj._moId for obj in objects])
+        if self.gone:
+            raise vmodl.fault.ManagedObjectNotFound(obj=mo)
+        for obj in objects:
+            if obj._moId in self.deleted:
+                raise vmodl.fault.ManagedObjectNotFound(obj=obj)
+        return collector.RetrieveResult(objects=[
+            self._content(obj) for obj in objects])
+
+    def _content(self, obj):
+        if obj._moId in self.missing:
+            return collector.ObjectContent(obj=obj, missingSet=[
+                collector.MissingProperty(
+                    path='snapshot',
+                    fault=vmodl.fault.ManagedObjectNotFound(obj=obj))])
+        return collector.ObjectContent(obj=obj, propSet=[
+            vmodl.DynamicProperty(name=name, val=value)
+            for name, value in self.props.get(obj._moId, {}).items()])
+
+
+class DeletedObjectTests(testtools.TestCase):
+
+    def setUp(self):
+        super(DeletedObjectTests, self).setUp()
+        self.stub = _Stub()
+        self.vms = [vim.VirtualMachine('vm-%d' % i, self.stub)
+                    for i in range(4)]
+
+    def _retrieve(self):
+        pc = self.stub.content.propertyCollector
+        return [(vm._moId, props) for vm, props in
+                pc.iter_object_properties(self.vms, vim.VirtualMachine,
+                                          ['snapshot'])]
+
+    def test_failing_objects_are_dropped(self):
+        self.stub.deleted.update(['vm-1', 'vm-3'])
+        self.assertEqual([('vm-0', {}), ('vm-2', {})], self._retrieve())
+        self.assertEqual([['vm-0', 'vm-1', 'vm-2', 'vm-3'],
+                          ['vm-0', 'vm-2', 'vm-3'], ['vm-0', 'vm-2']],
+                         self.stub.retrieved)
+
+    def test_missing_objects_are_dropped(self):
+        self.stub.missing.add('vm-2')
+        self.assertEqual(['vm-0', 'vm-1', 'vm-3'],
+                         [moid for moid, _ in self._retrieve()])
+
+    def test_other_objects_still_fail(self):
+        # a fault about anything but the objects retrieved is not theirs
+        self.stub.gone = True
+        self.assertRaises(vmodl.fault.ManagedObjectNotFound,
+                          self._retrieve)
+
+    def test_index_snapshots(self):
+        self.stub.deleted.add('vm-1')
+        indexes = snapshot.index_snapshots(self.vms)
+        self.assertEqual(['vm-0', 'vm-2', 'vm-3'], sorted(indexes))
+        self.assertEqual(0, len(indexes['vm-0']))
+        self.assertRaises(vmodl.fault.ManagedObjectNotFound,
+                          snapshot.snapshot_index, self.vms[1])
+
+
+def _tree(moid, name, created, children=()):
+    return vim.vm.SnapshotTree(
+        snapshot=vim.vm.Snapshot(moid), name=name, description='',
+        createTime=created, state='poweredOff',
+        childSnapshotList=list(children))
+
+
+def _layout(moid, data_key, memory_key, chain):
+    return vim.vm.FileLayoutEx.SnapshotLayout(
+        key=vim.vm.Snapshot(moid), dataKey=data_key, memoryKey=memory_key,
+        disk=[vim.vm.FileLayoutEx.DiskLayout(key=2000, chain=[
+            vim.vm.FileLayoutEx.DiskUnit(fileKey=keys) for keys in chain])])
+
+
+class FlattenTests(testtools.TestCase):
+
+    def setUp(self):
+        super(FlattenTests, self).setUp()
+        self.vm = vim.VirtualMachine('vm-1')
+        day = datetime.datetime(2014, 1, 1)
+        self.info = vim.vm.SnapshotInfo(rootSnapshotList=[
+            _tree('snapshot-1', 'base', day, [
+                _tree('snapshot-2', 'patched',
+                      day + datetime.timedelta(days=1), [
+                          _tree('snapshot-3', 'untracked',
+                                day + datetime.timedelta(days=2))])])])
+        sizes = {0: 1000, 1: 100, 2: 200, 3: 5, 4: 10, 5: 50, 6: 20}
+        self.layout = vim.vm.FileLayoutEx(
+            file=[vim.vm.FileLayoutEx.FileInfo(key=key, name='f%d' % key,
+                                               type='', size=size)
+                  for key, size in sorted(sizes.items())],
+            snapshot=[
+                # base disk 0, then delta 1 with its descriptor 3
+                _layout('snapshot-1', 4, 5, [[0], [1, 3]]),
+                # no memory file, delta 2 on top of the parent's chain
+                _layout('snapshot-2', 6, -1, [[0], [1, 3], [2]])])
+
+    def _sizes(self, layout):
+        return [(e.name, e.path, e.parent and e.parent._moId, e.size)
+                for e in snapshot._flatten(self.vm, self.info, layout)]
+
+    def test_sizes(self):
+        self.assertEqual([
+            ('base', ('base',), None, 10 + 50 + 100 + 5),
+            ('patched', ('base', 'patched'), 'snapshot-1', 20 + 200),
+            ('untracked', ('base', 'patched', 'untracked'), 'snapshot-2',
+             None)], self._sizes(self.layout))
+
+    def test_shared_files_count_once(self):
+        # a file in both the state and a delta disk is not counted twice
+        self.layout.snapshot[1].dataKey = 2
+        self.assertEqual(200, self._sizes(self.layout)[1][3])
+
+    def test_without_layout(self):
+        self.assertEqual([None, None, None],
+                         [size for _, _, _, size in self._sizes(None)])
+
+    def test_without_snapshots(self):
+        self.assertEqual([], snapshot._flatten(self.vm, None, self.layout))
+
+    def test_index(self):
+        index = snapshot.SnapshotIndex(
+            self.vm, snapshot._flatten(self.vm, self.info, self.layout))
+        self.assertEqual(165 + 220, index.total_size())
+        self.assertEqual(['patched', 'base', 'untracked'],
+                         [e.name for e in index.by_size()])
+        self.assertEqual(['base'], [e.name for e in index.older_than(
+            datetime.timedelta(hours=36),
+            now=datetime.datetime(2014, 1, 3))])
+
+
+def _entry(vm, depth):
+    moid = 'snapshot-%s-%d' % (vm._moId, depth)
+    path = tuple('s%d' % i for i in range(1, depth + 1))
+    return snapshot.SnapshotEntry(vm, vim.vm.Snapshot(moid, vm._stub), moid,
+                                  path[-1], '', None, 'poweredOff', path,
+                                  None, None)
+
+
+class _RemoveStub(object):
+    """Starts a task per RemoveSnapshot_Task, failing the ids in fail.
+
+    Tracks the removals running per virtual machine.
+    """
+
+    def __init__(self):
+        self.fail = set()
+        self.removed = []
+        self.arguments = set()
+        self.running = {}
+        self.most_running = 0
+        self._vms = {}
+        self._lock = threading.Lock()
+
+    def InvokeMethod(self, mo, info, args):
+        assert info.wsdlName == 'RemoveSnapshot_Task', info.wsdlName
+        # snapshot-<vm id>-<depth>
+        vm = mo._moId[len('snapshot-'):].rsplit('-', 1)[0]
+        with self._lock:
+            self.removed.append(mo._moId)
+            self.arguments.add(tuple(args))
+            if mo._moId in self.fail:
+                raise vim.fault.InvalidState(msg='locked')
+            self.running[vm] = self.running.get(vm, 0) + 1
+            self.most_running = max([self.most_running] +
+                                    list(self.running.values()))
+            self._vms['task-' + mo._moId] = vm
+        return vim.Task('task-' + mo._moId)
+
+    def complete(self, task):
+        with self._lock:
+            self.running[self._vms[task._moId]] -= 1
+
+
+class RemoveSnapshotsTests(testtools.TestCase):
+
+    def setUp(self):
+        super(RemoveSnapshotsTests, self).setUp()
+        self.stub = _RemoveStub()
+        self.entries = []
+        for moid, depth in [('vm-1', 3), ('vm-2', 2), ('vm-3', 1),
+                            ('vm-4', 1)]:
+            vm = vim.VirtualMachine(moid, self.stub)
+            self.entries.extend(_entry(vm, d) for d in range(1, depth + 1))
+        self.done = set()
+
+    def _complete(self, task):
+        self.stub.complete(task)
+        self.done.add(task._moId[len('task-'):])
+
+    def _busy(self, max_concurrency):
+        # the virtual machines with removals left to run, each runs one
+        left = set(e.vm.id for e in self.entries
+                   if e.id not in self.done and e.id not in self.stub.fail)
+        return min(max_concurrency, len(left))
+
+    def _remove(self, max_concurrency, **kwargs):
+        self.monitor = fakes.TaskMonitor(
+            lambda: self._busy(max_concurrency), on_complete=self._complete)
+        self.patch(task_extensions, 'TaskMonitor', lambda si: self.monitor)
+        return snapshot.remove_snapshots(self.entries, max_concurrency,
+                                         **kwargs)
+
+    def _order(self, vm_id):
+        return [moid for moid in self.stub.removed
+                if moid.startswith('snapshot-%s-' % vm_id)]
+
+    def test_deepest_first(self):
+        results = self._remove(2)
+        self.assertEqual(['snapshot-vm-1-3', 'snapshot-vm-1-2',
+                          'snapshot-vm-1-1'], self._order('vm-1'))
+        self.assertEqual(['snapshot-vm-2-2', 'snapshot-vm-2-1'],
+                         self._order('vm-2'))
+        # the first removals started are the deepest snapshots
+        self.assertEqual(['snapshot-vm-1-3', 'snapshot-vm-2-2'],
+                         self.stub.removed[:2])
+        self.assertEqual(sorted(e.id for e in self.entries), sorted(results))
+        self.assertEqual(set([(False, True)]), self.stub.arguments)
+        self.assertTrue(self.monitor.stopped)
+
+    def test_one_removal_per_virtual_machine(self):
+        self._remove(8, remove_children=True, consolidate=False)
+        self.assertEqual(1, self.stub.most_running)
+        # one removal for each of the four virtual machines
+        self.assertEqual(4, self.monitor.most_pending)
+        self.assertEqual(set([(True, False)]), self.stub.arguments)
+
+    def test_max_concurrency(self):
+        results = self._remove(3)
+        self.assertEqual(3, self.monitor.most_pending)
+        self.assertEqual(['success'] * 7,
+                         [state for _, state, _ in results.values()])
+
+    def test_synchronous_faults(self):
+        self.stub.fail.add('snapshot-vm-1-2')
+        results = self._remove(2)
+        entry, state, error = results['snapshot-vm-1-2']
+        self.assertEqual('error', state)
+        self.assertEqual('locked', error.msg)
+        # the next snapshot of the virtual machine still goes
+        self.assertEqual(['snapshot-vm-1-3', 'snapshot-vm-1-2',
+                          'snapshot-vm-1-1'], self._order('vm-1'))
+        self.assertEqual('success', results['snapshot-vm-1-1'][1])
+        self.assertEqual(2, self.monitor.most_pending)
@@ -0,0 +1,280 @@
+# Copyright (c) 2014 VMware, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+
+import testtools
+
+from pyvmomi_tools import extensions  # noqa
+from pyvmomi_tools.extensions import task as task_extensions
+from pyVmomi import vim
+
+from tests import budget
+from tests import fakes
+
+
+def _annotate(si):
+    vm = si.content.rootFolder.find_by_name(budget.VM_NAME)
+    return vm.ReconfigVM_Task(vim.vm.ConfigSpec(annotation=budget.ANNOTATION))
+
+
+class TaskWaitBudgetTests(budget.BudgetTestCase):
+
+    def test_wait_for_task(self):
+        with self.session('wait_for_task') as si:
+            task = _annotate(si)
+            with self.budget('wait_for_task'):
+                task.wait()
+            self.assertEqual(vim.TaskInfo.State.success, task.info.state)
+
+    def test_poll_task(self):
+        # the number of polls must not depend on how long the test takes,
+        # and replaying must not sleep
+        clock = budget.FakeClock()
+        self.patch(task_extensions, 'time', clock)
+        with self.session('poll_task') as si:
+            task = _annotate(si)
+            with self.budget('poll_task'):
+                task.poll()
+            self.assertEqual(vim.TaskInfo.State.success, task.info.state)
+        self.assertEqual([1], clock.slept)
+
+
+class _RunningTask(object):
+
+    def __init__(self):
+        self.info = vim.TaskInfo(state=vim.TaskInfo.State.running)
+        self.cancelled = False
+
+    def CancelTask(self):
+        self.cancelled = True
+
+
+class PollCancelTests(testtools.TestCase):
+
+    def test_cancel_cuts_the_sleep_short(self):
+        task = _RunningTask()
+        token = task_extensions.CancellationToken()
+        timer = threading.Timer(0.1, token.cancel)
+        timer.start()
+        self.addCleanup(timer.cancel)
+        started = time.time()
+        self.assertRaises(task_extensions.TaskCancelledError,
+                          task_extensions.poll_task, task,
+                          sleep_seconds=60, cancel_token=token,
+                          cancel_task=True)
+        self.assertTrue(time.time() - started < 10)
+        self.assertTrue(task.cancelled)
+
+    def test_token_wait(self):
+        token = task_extensions.CancellationToken()
+        self.assertFalse(token.wait(0))
+        token.cancel()
+        self.assertTrue(token.wait(60))
+
+
+class _TimedCollector(fakes.PropertyCollector):
+    """Records the maxWaitSeconds of each wait, an empty wait moves the
+    clock on by maxWaitSeconds as the server would take that long."""
+
+    def __init__(self, clock):
+        super(_TimedCollector, self).__init__()
+        self.clock = clock
+        self.waits = []
+
+    def WaitForUpdates(self, version):
+        self.waits.append(None)
+        return self.updates.get_nowait()
+
+    def WaitForUpdatesEx(self, version, options):
+        self.waits.append(options.maxWaitSeconds)
+        if self.updates.empty():
+            self.clock.sleep(options.maxWaitSeconds)
+            return None
+        return self.updates.get_nowait()
+
+
+class _TaskStub(object):
+    """Records the methods called on a task, CancelTask raises fault."""
+
+    def __init__(self):
+        self.called = []
+        self.fault = None
+
+    def InvokeMethod(self, mo, info, args):
+        self.called.append(info.wsdlName)
+        if self.fault is not None:
+            raise self.fault
+
+
+class WaitLimitTests(testtools.TestCase):
+
+    def setUp(self):
+        super(WaitLimitTests, self).setUp()
+        self.clock = budget.FakeClock()
+        self.patch(task_extensions, 'time', self.clock)
+        self.collector = _TimedCollector(self.clock)
+        si = fakes.Record(content=fakes.Record(
+            propertyCollector=self.collector))
+        self.patch(task_extensions, 'connect',
+                   fakes.Record(GetSi=lambda: si))
+        self.stub = _TaskStub()
+        self.task = vim.Task('task-1', self.stub)
+
+    def _put(self, state):
+        self.collector.put(fakes.update_set([
+            fakes.object_update(self.task, [('info.state', state)])]))
+
+    def test_no_limit(self):
+        self._put(vim.TaskInfo.State.success)
+        task_extensions.wait_for_task(self.task)
+        self.assertEqual([None], self.collector.waits)
+
+    def test_timeout_bounds_each_wait(self):
+        self._put(vim.TaskInfo.State.running)
+        self._put(vim.TaskInfo.State.success)
+        task_extensions.wait_for_task(self.task, timeout=10)
+        self.assertEqual([10, 10], self.collector.waits)
+        self.assertEqual([], self.stub.called)
+        self.assertTrue(self.collector.filters[0].destroyed)
+
+    def test_timeout_expires(self):
+        self._put(vim.TaskInfo.State.running)
+        error = self.assertRaises(task_extensions.TaskTimeoutError,
+                                  task_extensions.wait_for_task, self.task,
+                                  timeout=2.5)
+        self.assertIs(self.task, error.task)
+        # rounded up to whole seconds, the server takes no fractions
+        self.assertEqual([3, 3], self.collector.waits)
+        self.assertEqual([], self.stub.called)
+        self.assertTrue(self.collector.filters[0].destroyed)
+
+    def test_the_earliest_limit_applies(self):
+        self.assertRaises(task_extensions.TaskTimeoutError,
+                          task_extensions.wait_for_task, self.task,
+                          timeout=30, deadline=self.clock.now + 5)
+        self.assertEqual([5], self.collector.waits)
+        self.assertRaises(task_extensions.TaskTimeoutError,
+                          task_extensions.wait_for_task, self.task,
+                          timeout=5, deadline=self.clock.now + 30)
+        self.assertEqual([5, 5], self.collector.waits)
+
+    def test_deadline(self):
+        self.assertRaises(task_extensions.TaskTimeoutError,
+                          task_extensions.wait_for_task, self.task,
+                          deadline=self.clock.now + 7)
+        self.assertEqual([7], self.collector.waits)
+        # a deadline already passed gives up without waiting
+        self.assertRaises(task_extensions.TaskTimeoutError,
+                          task_extensions.wait_for_task, self.task,
+                          deadline=self.clock.now - 1)
+        self.assertEqual([7], self.collector.waits)
+
+    def test_cancel_task_on_expiry(self):
+        self.assertRaises(task_extensions.TaskTimeoutError,
+                          task_extensions.wait_for_task, self.task,
+                          timeout=5, cancel_task=True)
+        self.assertEqual(['CancelTask'], self.stub.called)
+
+    def test_uncancelable_tasks_still_time_out(self):
+        self.stub.fault = vim.fault.InvalidState()
+        self.assertRaises(task_extensions.TaskTimeoutError,
+                          task_extensions.wait_for_task, self.task,
+                          timeout=5, cancel_task=True)
+        self.assertEqual(['CancelTask'], self.stub.called)
+
+    def test_poll_deadline(self):
+        task = _RunningTask()
+        self.assertRaises(task_extensions.TaskTimeoutError,
+                          task_extensions.poll_task, task, sleep_seconds=4,
+                          timeout=10)
+        # the last sleep ends at the deadline
+        self.assertEqual([4, 4, 2], self.clock.slept)
+        self.assertFalse(task.cancelled)
+
+        self.assertRaises(task_extensions.TaskTimeoutError,
+                          task_extensions.poll_task, task, sleep_seconds=4,
+                          deadline=self.clock.now + 1, cancel_task=True)
+        self.assertEqual([4, 4, 2, 1], self.clock.slept)
+        self.assertTrue(task.cancelled)
+
+
+def _finish(collector, task, state, error=None):
+    changes = [('info.state', state)]
+    if error is not None:
+        changes.append(('info.error', error))
+    collector.put(fakes.update_set([fakes.object_update(task, changes)]))
+
+
+class TaskMonitorTests(testtools.TestCase):
+
+    def setUp(self):
+        super(TaskMonitorTests, self).setUp()
+        self.collector = fakes.PropertyCollector()
+        si = fakes.Record(content=fakes.Record(
+            propertyCollector=self.collector))
+        self.monitor = task_extensions.TaskMonitor(si, max_wait_seconds=0)
+        self.monitor.start()
+        self.addCleanup(self.monitor.stop)
+        self.done = []
+
+    def _callback(self, task, state, error):
+        self.done.append((task.id, state, error))
+
+    def test_completions(self):
+        tasks = [vim.Task('task-%d' % i) for i in range(3)]
+        for task in tasks:
+            self.monitor.add(task, self._callback)
+        self.assertEqual(3, len(self.monitor))
+        fault = vim.fault.Timedout()
+        _finish(self.collector, tasks[1], vim.TaskInfo.State.running)
+        _finish(self.collector, tasks[1], vim.TaskInfo.State.error, fault)
+        _finish(self.collector, tasks[0], vim.TaskInfo.State.success)
+        _finish(self.collector, tasks[2], vim.TaskInfo.State.success)
+        self.monitor.wait()
+        self.assertEqual([('task-1', vim.TaskInfo.State.error, fault),
+                          ('task-0', vim.TaskInfo.State.success, None),
+                          ('task-2', vim.TaskInfo.State.success, None)],
+                         self.done)
+        self.assertEqual(0, len(self.monitor))
+        self.assertTrue(all(f.destroyed for f in self.collector.filters))
+
+    def test_completion_before_the_filter_is_returned(self):
+        completed = threading.Event()
+
+        def on_create(pfilter):
+            # the loop sees the task finish while CreateFilter is running
+            _finish(self.collector, pfilter.obj, vim.TaskInfo.State.success)
+            completed.wait(5)
+
+        def callback(task, state, error):
+            self._callback(task, state, error)
+            completed.set()
+
+        self.collector.on_create = on_create
+        self.monitor.add(vim.Task('task-1'), callback)
+        self.monitor.wait()
+        self.assertEqual([('task-1', vim.TaskInfo.State.success, None)],
+                         self.done)
+        self.assertTrue(self.collector.filters[0].destroyed)
+
+    def test_loop_failure_fails_pending_tasks(self):
+        self.monitor.add(vim.Task('task-1'), self._callback)
+        error = ValueError('connection lost')
+        self.collector.put(error)
+        self.assertRaises(ValueError, self.monitor.wait)
+        self.assertEqual([('task-1', None, error)], self.done)
+        self.assertRaises(ValueError, self.monitor.add, vim.Task('task-2'),
+                          self._callback)
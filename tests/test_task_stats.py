@@ -0,0 +1,143 @@
+# Copyright (c) 2014 VMware, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+
+import testtools
+
+from pyvmomi_tools import extensions  # noqa
+from pyvmomi_tools.extensions import task_stats
+from pyvmomi_tools.extensions.task import TaskMonitor
+from pyVmomi import vim
+
+from tests import fakes
+
+_T0 = datetime.datetime(2024, 1, 1, 12, 0, 0)
+
+
+def _at(seconds):
+    return _T0 + datetime.timedelta(seconds=seconds)
+
+
+class HistogramTests(testtools.TestCase):
+
+    def test_buckets_are_cumulative(self):
+        histogram = task_stats.Histogram((1, 5, float('inf')))
+        for value in (0.5, 1, 3, 7):
+            histogram.observe(value)
+        self.assertEqual({'buckets': [(1, 2), (5, 3), (float('inf'), 4)],
+                          'sum': 11.5,
+                          'count': 4},
+                         histogram.as_dict())
+
+
+class TaskStatsTests(testtools.TestCase):
+
+    def setUp(self):
+        super(TaskStatsTests, self).setUp()
+        self.stats = task_stats.TaskStats(buckets=(1, 10, float('inf')))
+
+    def test_phases(self):
+        self.stats.record('VirtualMachine.powerOn', vim.VirtualMachine('vm-1'),
+                          _at(0), _at(2), _at(7),
+                          observed=task_stats._seconds(_at(7.5)))
+        phases = self.stats.snapshot()[('VirtualMachine.powerOn',
+                                        'vim.VirtualMachine')]
+        self.assertEqual(2, phases['queue']['sum'])
+        self.assertEqual(5, phases['run']['sum'])
+        self.assertEqual(0.5, phases['lag']['sum'])
+
+    def test_clock_offset_corrects_lag(self):
+        stats = task_stats.TaskStats(clock_offset=-3.0)
+        stats.record('a', None, _at(0), _at(0), _at(1),
+                     observed=task_stats._seconds(_at(5)))
+        self.assertEqual(1.0, stats.snapshot()[('a', 'None')]['lag']['sum'])
+
+    def test_never_started_records_lag_only(self):
+        self.stats.record('a', None, _at(0), None, _at(1),
+                          observed=task_stats._seconds(_at(1)))
+        phases = self.stats.snapshot()[('a', 'None')]
+        self.assertEqual(0, phases['queue']['count'])
+        self.assertEqual(0, phases['run']['count'])
+        self.assertEqual(1, phases['lag']['count'])
+
+    def test_prometheus_text(self):
+        self.stats.record('Folder.create"d"', None, _at(0), _at(2), _at(4),
+                          observed=task_stats._seconds(_at(4)))
+        lines = self.stats.prometheus_text(prefix='t').splitlines()
+        labels = 'description_id="Folder.create\\"d\\"",entity_type="None"'
+        self.assertEqual('# HELP t_queue_seconds Seconds tasks spent queued '
+                         'on the server.', lines[0])
+        self.assertEqual('# TYPE t_queue_seconds histogram', lines[1])
+        self.assertEqual(['t_queue_seconds_bucket{%s,le="1"} 0' % labels,
+                          't_queue_seconds_bucket{%s,le="10"} 1' % labels,
+                          't_queue_seconds_bucket{%s,le="+Inf"} 1' % labels,
+                          't_queue_seconds_sum{%s} 2.0' % labels,
+                          't_queue_seconds_count{%s} 1' % labels],
+                         lines[2:7])
+        self.assertEqual(3 * 7, len(lines))
+
+    def test_prometheus_text_without_description_id(self):
+        self.stats.record(None, None, _at(0), _at(1), _at(2))
+        self.stats.record('b', None, _at(0), _at(1), _at(2))
+        text = self.stats.prometheus_text()
+        self.assertTrue(text.index('description_id="None"') <
+                        text.index('description_id="b"'))
+
+
+def _update(task, **values):
+    return fakes.update_set([fakes.object_update(
+        task, [('info.' + name, val)
+               for name, val in sorted(values.items())])])
+
+
+class TaskMonitorStatsTests(testtools.TestCase):
+
+    def _monitor(self, updates, stats):
+        si = fakes.Record(content=fakes.Record(
+            propertyCollector=fakes.PropertyCollector(updates)))
+        monitor = TaskMonitor(si, max_wait_seconds=0, stats=stats)
+        self.addCleanup(monitor.stop)
+        return monitor
+
+    def test_records_completed_tasks(self):
+        stats = task_stats.TaskStats()
+        task = vim.Task('task-1')
+        monitor = self._monitor([
+            _update(task, state=vim.TaskInfo.State.running,
+                    descriptionId='VirtualMachine.powerOn',
+                    queueTime=_at(0), startTime=_at(1)),
+            _update(task, state=vim.TaskInfo.State.success,
+                    completeTime=_at(4))], stats)
+        done = []
+        monitor.add(task, lambda *args: done.append(args))
+        monitor.start()
+        monitor.wait()
+        self.assertEqual([(task, vim.TaskInfo.State.success, None)], done)
+        phases = stats.snapshot()[('VirtualMachine.powerOn', 'None')]
+        self.assertEqual(3, phases['run']['sum'])
+        self.assertEqual({}, monitor._values)
+
+    def test_values_are_dropped_when_the_loop_fails(self):
+        task = vim.Task('task-1')
+        monitor = self._monitor([
+            _update(task, state=vim.TaskInfo.State.running,
+                    queueTime=_at(0)),
+            ValueError('connection lost')], task_stats.TaskStats())
+        done = []
+        monitor.add(task, lambda *args: done.append(args))
+        monitor.start()
+        self.assertRaises(ValueError, monitor.wait)
+        self.assertEqual(None, done[0][1])
+        self.assertEqual({}, monitor._values)
@@ -11,3 +11,338 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+
+import threading
+
+import testtools
+
+from pyvmomi_tools import extensions  # noqa
+from pyvmomi_tools.extensions import task as task_extensions
+from pyvmomi_tools.extensions import virtual_machine
+from pyVmomi import vim
+
+from tests import budget
+from tests import fakes
+
+
+class PowerBudgetTests(budget.BudgetTestCase):
+
+    def test_power_cycle(self):
+        with self.session('power_cycle') as si:
+            vm = si.content.rootFolder.find_by_name(budget.VM_NAME)
+            with self.budget('power_on'):
+                vm.power_on()
+            with self.budget('hard_reboot'):
+                vm.hard_reboot()
+            with self.budget('power_off'):
+                vm.power_off()
+            self.assertEqual(vim.VirtualMachinePowerState.poweredOff,
+                             vm.runtime.powerState)
+
+
+class BulkCloneArgumentTests(testtools.TestCase):
+
+    def setUp(self):
+        super(BulkCloneArgumentTests, self).setUp()
+        self.template = vim.VirtualMachine('vm-1')
+        self.folder = vim.Folder('group-v1')
+        self.hosts = [vim.HostSystem('host-1')]
+        self.datastores = [vim.Datastore('datastore-1')]
+
+    def _clone(self, **kwargs):
+        args = dict(names=['a', 'b'], folder=self.folder, hosts=self.hosts,
+                    datastores=self.datastores)
+        args.update(kwargs)
+        return virtual_machine.bulk_clone(self.template, **args)
+
+    def test_no_names(self):
+        self.assertRaises(ValueError, self._clone, names=[])
+
+    def test_no_hosts(self):
+        self.assertRaises(ValueError, self._clone, hosts=[])
+
+    def test_no_datastores(self):
+        self.assertRaises(ValueError, self._clone, datastores=[])
+
+    def test_no_slots(self):
+        self.assertRaises(ValueError, self._clone, max_per_datastore=0)
+
+
+class _CloneStub(object):
+    """Starts a clone task per CloneVM_Task, failing those named in fail.
+
+    Tracks the clones running per datastore, each completion takes ten
+    seconds on clock.
+    """
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.fail = set()
+        self.specs = {}
+        self.running = {}
+        self.most_running = {}
+        self._datastores = {}
+        self._lock = threading.Lock()
+
+    def InvokeAccessor(self, mo, info):
+        assert info.name == 'parent', info.name
+        return fakes.Record(resourcePool=vim.ResourcePool(
+            'resgroup-' + mo._moId))
+
+    def InvokeMethod(self, mo, info, args):
+        assert info.wsdlName == 'CloneVM_Task', info.wsdlName
+        folder, name, spec = args
+        self.specs[name] = spec
+        if name in self.fail:
+            raise vim.fault.InvalidState(msg='no space')
+        datastore = spec.location.datastore._moId
+        with self._lock:
+            self.running[datastore] = self.running.get(datastore, 0) + 1
+            self.most_running[datastore] = max(
+                self.most_running.get(datastore, 0),
+                self.running[datastore])
+            self._datastores['task-' + name] = datastore
+        return vim.Task('task-' + name)
+
+    def complete(self, task):
+        with self._lock:
+            self.running[self._datastores[task._moId]] -= 1
+        self.clock.sleep(10)
+
+
+class BulkCloneTests(testtools.TestCase):
+
+    def setUp(self):
+        super(BulkCloneTests, self).setUp()
+        self.clock = budget.FakeClock()
+        self.patch(virtual_machine, 'time', self.clock)
+        self.stub = _CloneStub(self.clock)
+        self.template = vim.VirtualMachine('vm-1', self.stub)
+        self.folder = vim.Folder('group-v1')
+        self.hosts = [vim.HostSystem('host-%d' % i, self.stub)
+                      for i in (1, 2, 3)]
+        self.datastores = [vim.Datastore('datastore-a'),
+                           vim.Datastore('datastore-b')]
+        self.names = ['clone-%d' % i for i in range(6)]
+
+    def _clone(self, limit, outcomes=None, **kwargs):
+        self.monitor = fakes.TaskMonitor(limit, outcomes, self.stub.complete)
+        self.patch(task_extensions, 'TaskMonitor', lambda si: self.monitor)
+        return virtual_machine.bulk_clone(self.template, self.names,
+                                          self.folder, self.hosts,
+                                          self.datastores, **kwargs)
+
+    def test_placement(self):
+        results, _ = self._clone(4, max_per_datastore=2)
+        self.assertEqual(self.names, [r.name for r in results])
+        self.assertEqual(['success'] * 6, [r.state for r in results])
+        # the least busy datastore with a free slot, then the least used
+        self.assertEqual(['datastore-a', 'datastore-b'] * 3,
+                         [r.datastore._moId for r in results])
+        self.assertEqual({'datastore-a': 2, 'datastore-b': 2},
+                         self.stub.most_running)
+        self.assertEqual(4, self.monitor.most_pending)
+        self.assertTrue(self.monitor.stopped)
+
+    def test_one_datastore_bounds_the_clones(self):
+        self.datastores = self.datastores[:1]
+        self._clone(3, max_per_datastore=3)
+        self.assertEqual({'datastore-a': 3}, self.stub.most_running)
+        self.assertEqual(3, self.monitor.most_pending)
+
+    def test_hosts_round_robin(self):
+        results, _ = self._clone(4, max_per_datastore=2)
+        self.assertEqual(['host-1', 'host-2', 'host-3'] * 2,
+                         [r.host._moId for r in results])
+        for name, host in zip(self.names, ['host-1', 'host-2', 'host-3'] * 2):
+            location = self.stub.specs[name].location
+            self.assertEqual(host, location.host._moId)
+            self.assertEqual('resgroup-' + host, location.pool._moId)
+
+    def test_full_clones(self):
+        self._clone(8)
+        for spec in self.stub.specs.values():
+            self.assertIsNone(spec.snapshot)
+            self.assertIsNone(spec.location.diskMoveType)
+
+    def test_linked_clones(self):
+        snapshot = vim.vm.Snapshot('snapshot-1')
+        self._clone(8, snapshot=snapshot, power_on=True)
+        self.assertEqual(6, len(self.stub.specs))
+        for spec in self.stub.specs.values():
+            self.assertIs(snapshot, spec.snapshot)
+            self.assertEqual('createNewChildDiskBacking',
+                             spec.location.diskMoveType)
+            self.assertTrue(spec.powerOn)
+            self.assertFalse(spec.template)
+
+    def test_clones_per_minute(self):
+        # six clones completing ten seconds apart
+        results, rate = self._clone(8)
+        self.assertEqual(6.0, rate)
+        self.assertEqual(60, self.clock.now - budget.FakeClock().now)
+
+    def test_failed_clones_are_not_counted(self):
+        fault = vim.fault.InvalidState(msg='no space')
+        self.stub.fail.add('clone-1')
+        results, rate = self._clone(
+            8, outcomes={'task-clone-2': ('error', fault)})
+        self.assertEqual(['success', 'error', 'error', 'success', 'success',
+                          'success'], [r.state for r in results])
+        self.assertEqual('no space', results[1].error.msg)
+        self.assertIs(fault, results[2].error)
+        # five tasks ran, four of them succeeded
+        self.assertEqual(4 * 60 / 50.0, rate)
+
+
+class _ReconfigStub(object):
+    """Starts a task per ReconfigVM_Task, failing the machines in fail."""
+
+    def __init__(self):
+        self.fail = set()
+        self.specs = []
+
+    def InvokeMethod(self, mo, info, args):
+        assert info.wsdlName == 'ReconfigVM_Task', info.wsdlName
+        self.specs.append((mo._moId, args[0]))
+        if mo._moId in self.fail:
+            raise vim.fault.InvalidPowerState(msg='powered on')
+        return vim.Task('task-' + mo._moId)
+
+
+class ReconfigFlushTests(testtools.TestCase):
+
+    def setUp(self):
+        super(ReconfigFlushTests, self).setUp()
+        self.stub = _ReconfigStub()
+        self.vms = [vim.VirtualMachine('vm-%d' % i, self.stub)
+                    for i in range(10)]
+
+    def _flush(self, batcher, limit, outcomes=None):
+        self.monitor = fakes.TaskMonitor(limit, outcomes)
+        self.patch(task_extensions, 'TaskMonitor', lambda si: self.monitor)
+        return batcher.flush()
+
+    def test_one_task_per_machine(self):
+        batcher = virtual_machine.ReconfigBatcher()
+        for vm in self.vms[:3]:
+            batcher.add(vm, memoryMB=4096)
+            vm.queue_reconfig(batcher, numCPUs=2)
+        results = self._flush(batcher, 3)
+        self.assertEqual(['vm-0', 'vm-1', 'vm-2'],
+                         sorted(moid for moid, _ in self.stub.specs))
+        for _, spec in self.stub.specs:
+            self.assertEqual((4096, 2), (spec.memoryMB, spec.numCPUs))
+        self.assertEqual(dict((vm.id, (vm, 'success', None))
+                              for vm in self.vms[:3]), results)
+        # the edits went out with the flush
+        self.assertEqual(0, len(batcher))
+        self.assertTrue(self.monitor.stopped)
+
+    def test_concurrency_is_bounded(self):
+        batcher = virtual_machine.ReconfigBatcher(max_concurrency=4)
+        for vm in self.vms:
+            batcher.add(vm, annotation='patched')
+        results = self._flush(batcher, 4)
+        self.assertEqual(10, len(self.stub.specs))
+        self.assertEqual(4, self.monitor.most_pending)
+        self.assertEqual(['success'] * 10,
+                         [state for _, state, _ in results.values()])
+
+    def test_failures(self):
+        fault = vim.fault.InvalidState(msg='busy')
+        self.stub.fail.add('vm-1')
+        batcher = virtual_machine.ReconfigBatcher(max_concurrency=2)
+        for vm in self.vms[:4]:
+            batcher.add(vm, numCPUs=4)
+        results = self._flush(batcher, 2, {'task-vm-2': ('error', fault)})
+        self.assertEqual('success', results['vm-0'][1])
+        # a reconfigure refused outright gives its slot back
+        self.assertEqual('error', results['vm-1'][1])
+        self.assertEqual('powered on', results['vm-1'][2].msg)
+        self.assertEqual(('error', fault), results['vm-2'][1:])
+        self.assertEqual('success', results['vm-3'][1])
+        self.assertEqual(2, self.monitor.most_pending)
+
+
+def _disk(operation, key, controller_key=1000):
+    return vim.vm.device.VirtualDeviceSpec(
+        operation=operation,
+        device=vim.vm.device.VirtualDisk(key=key,
+                                         controllerKey=controller_key))
+
+
+class ReconfigMergeTests(testtools.TestCase):
+
+    def _merge(self, *specs):
+        merged = vim.vm.ConfigSpec()
+        for spec in specs:
+            virtual_machine._merge(merged, spec)
+        return merged
+
+    def test_fields(self):
+        merged = self._merge(vim.vm.ConfigSpec(memoryMB=4096),
+                             vim.vm.ConfigSpec(numCPUs=2, memoryMB=4096))
+        self.assertEqual(4096, merged.memoryMB)
+        self.assertEqual(2, merged.numCPUs)
+
+    def test_conflicting_fields(self):
+        self.assertRaises(virtual_machine.ReconfigConflict, self._merge,
+                          vim.vm.ConfigSpec(memoryMB=4096),
+                          vim.vm.ConfigSpec(memoryMB=8192))
+
+    def test_nested_objects_merge_by_field(self):
+        merged = self._merge(
+            vim.vm.ConfigSpec(cpuAllocation=vim.ResourceAllocationInfo(
+                reservation=1000)),
+            vim.vm.ConfigSpec(cpuAllocation=vim.ResourceAllocationInfo(
+                limit=4000, shares=vim.SharesInfo(level='high'))))
+        self.assertEqual(1000, merged.cpuAllocation.reservation)
+        self.assertEqual(4000, merged.cpuAllocation.limit)
+        self.assertEqual('high', merged.cpuAllocation.shares.level)
+
+    def test_nested_conflict_names_the_field(self):
+        e = self.assertRaises(
+            virtual_machine.ReconfigConflict, self._merge,
+            vim.vm.ConfigSpec(cpuAllocation=vim.ResourceAllocationInfo(
+                shares=vim.SharesInfo(level='high'))),
+            vim.vm.ConfigSpec(cpuAllocation=vim.ResourceAllocationInfo(
+                shares=vim.SharesInfo(level='low'))))
+        self.assertIn('cpuAllocation.shares.level', str(e))
+
+    def test_extra_config_merges_by_key(self):
+        option = vim.option.OptionValue
+        merged = self._merge(
+            vim.vm.ConfigSpec(extraConfig=[option(key='a', value='1')]),
+            vim.vm.ConfigSpec(extraConfig=[option(key='b', value='2'),
+                                           option(key='a', value='1')]))
+        self.assertEqual({'a': '1', 'b': '2'},
+                         dict((o.key, o.value) for o in merged.extraConfig))
+        self.assertRaises(
+            virtual_machine.ReconfigConflict, self._merge,
+            vim.vm.ConfigSpec(extraConfig=[option(key='a', value='1')]),
+            vim.vm.ConfigSpec(extraConfig=[option(key='a', value='2')]))
+
+    def test_device_edited_twice(self):
+        self.assertRaises(
+            virtual_machine.ReconfigConflict, self._merge,
+            vim.vm.ConfigSpec(deviceChange=[_disk('edit', 2000)]),
+            vim.vm.ConfigSpec(deviceChange=[_disk('remove', 2000)]))
+
+    def test_new_devices_sharing_a_key_are_renumbered(self):
+        controller = vim.vm.device.VirtualDeviceSpec(
+            operation='add',
+            device=vim.vm.device.ParaVirtualSCSIController(key=-1,
+                                                           busNumber=1))
+        first = vim.vm.ConfigSpec(deviceChange=[_disk('add', -1)])
+        second = vim.vm.ConfigSpec(deviceChange=[controller,
+                                                 _disk('add', -2, -1),
+                                                 _disk('edit', 2000)])
+        merged = self._merge(first, second)
+        keys = [(c.operation, c.device.key, c.device.controllerKey)
+                for c in merged.deviceChange]
+        self.assertEqual([('add', -1, 1000), ('add', -3, None),
+                          ('add', -2, -3), ('edit', 2000, 1000)], keys)
+        # the caller's specs are left alone
+        self.assertEqual(-1, second.deviceChange[0].device.key)
+        self.assertEqual(-1, second.deviceChange[1].device.controllerKey)